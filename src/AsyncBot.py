@@ -0,0 +1,206 @@
+import asyncio
+import time
+import DeveloperMsg
+from AsyncOpenAIClient import AsyncOpenAIClient
+from Bot import Bot
+from ContextIndex import DEFAULT_TOKEN_BUDGET
+from ContextPacks import default_registry
+from DocTools import DocTools
+from IntentRouter import DEFAULT_THRESHOLD, LABELS, normalize_label
+from RateLimiter import RateLimiter
+from ResponseCache import ResponseCache
+from StreamParser import AnswerStreamParser
+from Startup import PROFILE, AsyncWarmUp
+from StructuredAnswer import is_error
+
+
+async def ainput(prompt):
+    """
+    Reads a line from the user without blocking the event loop.
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, input, prompt)
+
+
+class AsyncBot(Bot):
+    def __init__(self, context_budget=DEFAULT_TOKEN_BUDGET, stream=True, cache=True, client=None,
+                 intent_threshold=DEFAULT_THRESHOLD, packs=None, metrics=None, limiter=None, policy=None,
+                 cascade=None, question_cache=None, stateful=False, warm_up=True, tools=False, store=None,
+                 session_id=None):
+        """
+        Initializes the Bot with the asyncio OpenAI client.
+        the start_msg classification runs concurrently with the answer to the first question.
+        the connection is warmed up by a task of the chat event loop.
+        """
+        packs = packs if packs is not None else default_registry()
+        if client is None:
+            client = AsyncOpenAIClient(cache=ResponseCache() if cache else None, metrics=metrics,
+                                       limiter=limiter if limiter is not None else RateLimiter(), policy=policy,
+                                       stateful=stateful, tools=DocTools(packs) if tools else None)
+        super().__init__(context_budget, stream, cache, client, intent_threshold, packs, metrics, limiter, policy,
+                         cascade, question_cache, stateful, warm_up, tools, store, session_id)
+        if warm_up:
+            self.warm_up = AsyncWarmUp(self.client)
+
+    async def classify(self, user_input):
+        """
+        Returns the start_msg label of the user input, without touching the chat history.
+        the LLM is asked only when the local router is not confident enough.
+        """
+        label, confidence = self.router.classify(user_input)
+        if confidence >= self.router.threshold:
+            return label
+        message = {"role": "developer", "content": DeveloperMsg.get_dev_msg('start_msg', user_input)}
+        reply = await self.client.query(self.classify_model, messages=[message], kind="classify")
+        # the call failed, or the LLM didn't reply with a label
+        label = None if is_error(reply) else normalize_label(reply)
+        return label if label in LABELS else self.router.classify(user_input)[0]
+
+    async def stream_answer(self, model="gpt-4.1"):
+        """
+        Queries the model as a stream and prints the answer field as it arrives.
+        Returns the Answer and the raw response text.
+        """
+        parser = AnswerStreamParser()
+        print("Assistant: ", end="", flush=True)
+        response = await self.client.query_stream(model,
+                                                  on_delta=lambda delta: print(parser.feed(delta), end="", flush=True))
+        if parser.quote is None:
+            print(response, end="")
+        print()
+        return self.parse(response, self.client.last_record()), response
+
+    async def ask(self, user_input):
+        """
+        Answers a question in a new turn and returns its Answer.
+        """
+        cached = self.cached_answer(user_input)
+        self.next_turn()
+        self.add_question(user_input)
+        if cached is not None:
+            result, response = cached
+            print("Assistant:", result.answer)
+        else:
+            if self.cascade is not None:
+                result, response = await self.cascade_answer()
+            else:
+                result, response = await self.answer()
+            self.remember_answer(user_input, result, response)
+        self.end_turn(response)
+        return result
+
+    async def answer(self, model="gpt-4.1"):
+        """
+        Queries the model, streamed or not, and prints the answer.
+        Returns the Answer and the raw response text.
+        """
+        if self.stream:
+            return await self.stream_answer(model)
+        response = await self.client.query(model)
+        result = self.parse(response, self.client.last_record())
+        print("Assistant:", result.answer)
+        return result, response
+
+    async def cascade_answer(self):
+        """
+        Queries the cascade tiers in turn until a response is accepted, the last tier is always accepted.
+        Returns the Answer and the raw response text.
+        """
+        cascade = self.cascade
+        if cascade.race and len(cascade.tiers) > 1:
+            return await self.race_answer()
+        for model in cascade.tiers[:-1]:
+            start = time.perf_counter()
+            response = await self.client.query(model)
+            result = self.parse(response, self.client.last_record())
+            reason = cascade.escalation_reason(result, response)
+            cascade.record(model, time.perf_counter() - start, reason)
+            if reason is None:
+                print("Assistant:", result.answer)
+                return result, response
+        start = time.perf_counter()
+        result, response = await self.answer(cascade.tiers[-1])
+        cascade.record(cascade.tiers[-1], time.perf_counter() - start)
+        return result, response
+
+    async def race_query(self, model, messages):
+        """
+        Returns the response of a raced query and its metrics record, the query runs in its own task.
+        """
+        return await self.client.query(model, True, messages), self.client.last_record()
+
+    async def race_answer(self):
+        """
+        Queries the first and last cascade tiers at once, the first tier answers if it completes first and is
+        accepted, the last tier answers otherwise. the slower call is cancelled.
+        Returns the Answer and the raw response text.
+        """
+        cascade = self.cascade
+        small, large = cascade.tiers[0], cascade.tiers[-1]
+        messages = self.client.messages
+        start = time.perf_counter()
+        small_call = asyncio.ensure_future(self.race_query(small, messages))
+        large_call = asyncio.ensure_future(self.race_query(large, messages))
+        try:
+            await asyncio.wait((small_call, large_call), return_when=asyncio.FIRST_COMPLETED)
+            if not large_call.done():
+                response, record = small_call.result()
+                result = self.parse(response, record)
+                reason = cascade.escalation_reason(result, response)
+                cascade.record(small, time.perf_counter() - start, reason)
+                if reason is None:
+                    large_call.cancel()
+                    cascade.record_loser()
+                    print("Assistant:", result.answer)
+                    return result, response
+            response, record = await large_call
+            result = self.parse(response, record)
+            cascade.record(large, time.perf_counter() - start)
+            if not small_call.done():
+                small_call.cancel()
+                cascade.record_loser()
+            print("Assistant:", result.answer)
+            return result, response
+        finally:
+            small_call.cancel()
+            large_call.cancel()
+
+    async def read_input(self, prompt):
+        """
+        Returns a line typed by the user, the connection to the API is warmed up meanwhile.
+        """
+        if self.warm_up is None:
+            return await ainput(prompt)
+        self.warm_up.resume()
+        try:
+            return await ainput(prompt)
+        finally:
+            self.warm_up.pause()
+
+    async def start_chat(self):
+        """
+        Starts the chat loop, the background requests are cancelled when the user exits.
+        """
+        print("Chatbot is ready! Type 'exit' to end the chat.")
+        if self.session is not None:
+            print(f"Session {self.session.session_id}, continue it later with --resume {self.session.session_id}")
+        PROFILE.mark("ready")
+        user_input = await self.read_input("You: ")
+        if not self.turn:
+            self.client.clear_messages()
+        classification = asyncio.ensure_future(self.classify(user_input)) if self.label is None else None
+        try:
+            while user_input.lower() != "exit":
+                await self.ask(user_input)
+                PROFILE.mark("first answer")
+                if self.label is None:
+                    self.label = await classification
+                    print("Assistant:", self.label)
+                    self.save_session()
+                user_input = await self.read_input("You: ")
+        finally:
+            if self.warm_up is not None:
+                self.warm_up.close()
+            if classification is not None:
+                classification.cancel()
+            self.client.history.cancel()
+            self.client.metrics.flush()
@@ -0,0 +1,177 @@
+import asyncio
+import time
+from CallPolicy import AsyncPrimedStream
+from OpenAIClient import CHAIN_ERRORS, OpenAIClient
+from Startup import PROFILE, WARM_UP_TIMEOUT, keepalive_limits, sdk, sdk_errors
+
+
+class AsyncOpenAIClient(OpenAIClient):
+    def __init__(self, cache=None, history=None, summary_model="gpt-4.1-mini", client=None, metrics=None,
+                 limiter=None, policy=None, stateful=False, tools=None):
+        """
+        Initializes the client on top of the asyncio OpenAI client.
+        the messages, cache, history, metrics, rate limiter, call policy, stateful mode and tools handling are the
+        same as OpenAIClient, the API calls are coroutines. the tools are run on the event loop, they take
+        microseconds.
+        """
+        super().__init__(cache, history, summary_model, client, metrics, limiter, policy, stateful, tools)
+
+    def make_client(self):
+        """
+        Returns a new asyncio OpenAI client keeping its idle connections open between the questions.
+        """
+        openai = sdk()
+        return openai.AsyncOpenAI(http_client=openai.DefaultAsyncHttpxClient(limits=keepalive_limits()))
+
+    async def warm_up(self):
+        """
+        Opens a connection to the API, or keeps the idle one open, with a request that costs no tokens.
+        """
+        client = self.client.with_options(timeout=WARM_UP_TIMEOUT)
+        with PROFILE.timed("connect"):
+            await client.models.list()
+
+    async def summarize(self, summary, turns):
+        """
+        Returns a summary of the given turns merged with the previous summary, using the summary model.
+        """
+        record, params = self.summary_request(summary, turns)
+        return self.end_summary(record, await self._create(record, None, **params))
+
+    async def _create(self, record, priority=None, deadline=None, **params):
+        """
+        Returns the result of a responses.create call, handled like OpenAIClient._create.
+        """
+        policy = self.policy
+        deadline_at, key, priority, tokens = self.begin_call(record, priority, deadline, params)
+        stream = bool(params.get("stream"))
+
+        async def send():
+            timeout = max(deadline_at - time.monotonic(), 0.001)
+            if self.limiter is None:
+                response = await self.client.responses.create(timeout=timeout, **params)
+            else:
+                raw = await self.client.responses.with_raw_response.create(timeout=timeout, **params)
+                self.limiter.update(raw.headers)
+                response = raw.parse()
+            if stream:
+                try:
+                    first = await response.__anext__()
+                except StopAsyncIteration:
+                    first = None
+                response = AsyncPrimedStream(response, first)
+            return response
+
+        for attempt in range(policy.attempts):
+            policy.breaker.check()
+            try:
+                if self.limiter is not None:
+                    await self.limiter.acquire_async(tokens, priority)
+                record.mark("queue")
+                start = time.monotonic()
+                response = await policy.run_async(key, send, deadline_at, lambda: self.can_hedge(tokens))
+            except Exception as e:
+                wait = self.retry_delay(record, attempt, deadline_at, e)
+            except BaseException:
+                policy.breaker.release()
+                raise
+            else:
+                self.call_done(key, start)
+                return response
+            await asyncio.sleep(wait)
+            record.mark("retry")
+
+    async def _create_chained(self, record, priority, deadline, messages, **params):
+        """
+        Returns the result of _create for the messages and the keys of the messages its response holds,
+        handled like OpenAIClient._create_chained.
+        """
+        input, previous, sent = self.chain_input(record.data["kind"], messages)
+        if previous is not None:
+            record.data["chained"] = True
+            try:
+                return await self._create_with_tools(record, priority, deadline, input=input,
+                                                     previous_response_id=previous, **params), sent
+            except sdk_errors(*CHAIN_ERRORS) as e:
+                if not self.chain_lost(e):
+                    raise
+                sent = self.lose_chain(record, messages)
+        return await self._create_with_tools(record, priority, deadline, input=messages, **params), sent
+
+    async def _create_with_tools(self, record, priority, deadline, **params):
+        """
+        Returns the result of _create once the tools the model called were run, like
+        OpenAIClient._create_with_tools.
+        """
+        result = await self._create(record, priority, deadline, **params)
+        if not params.get("tools"):
+            return result
+        if params.get("stream"):
+            return self._tool_stream(record, priority, deadline, params, result)
+        follow_up = self.tool_follow_up(record, params, result.output)
+        while follow_up is not None:
+            # the query records the usage and the wait of the last response only
+            record.usage(result.usage)
+            record.mark("first_byte")
+            params = follow_up
+            result = await self._create(record, priority, deadline, **params)
+            follow_up = self.tool_follow_up(record, params, result.output)
+        return result
+
+    async def _tool_stream(self, record, priority, deadline, params, stream):
+        """
+        Yields the events of the stream and of the streams of the requests sending the tool outputs back.
+        """
+        text = False
+        while True:
+            follow_up = None
+            async for event in stream:
+                if event.type == "response.output_text.delta":
+                    text = True
+                elif event.type == "response.completed":
+                    follow_up = self.tool_follow_up(record, params, event.response.output)
+                yield event
+            if follow_up is None:
+                return
+            # the rounds before the first text are part of the wait for the first byte
+            record.mark("generation" if text else "first_byte")
+            params = follow_up
+            stream = await self._create(record, priority, deadline, **params)
+
+    async def query(self, model="gpt-4.1", use_cache=True, messages=None, kind="answer", priority=None,
+                    deadline=None):
+        """
+        Sends the messages to the OpenAI API and returns the result, like OpenAIClient.query.
+        """
+        record, messages, params, key, cached = self.begin_query(model, messages, kind, use_cache)
+        if cached is not None:
+            return cached
+        try:
+            response, sent = await self._create_chained(record, priority, deadline, messages, **params)
+            record.mark("first_byte")
+            record.usage(response.usage)
+            return self.end_query(record, key, response.id, sent, response.output_text)
+        except Exception as e:
+            return self.failed_query(record, e, "first_byte")
+
+    async def query_stream(self, model="gpt-4.1", on_delta=None, use_cache=True, messages=None, kind="answer",
+                           priority=None, deadline=None):
+        """
+        Sends the messages to the OpenAI API as a stream and returns the full result, like
+        OpenAIClient.query_stream.
+        """
+        record, messages, params, key, cached = self.begin_query(model, messages, kind, use_cache)
+        if cached is not None:
+            if on_delta:
+                on_delta(cached)
+            return cached
+        chunks = []
+        response_id = None
+        try:
+            stream, sent = await self._create_chained(record, priority, deadline, messages, stream=True, **params)
+            async for event in stream:
+                response_id = self.read_event(record, event, chunks, on_delta) or response_id
+            record.mark("generation" if chunks else "first_byte")
+            return self.end_query(record, key, response_id, sent, "".join(chunks))
+        except Exception as e:
+            return self.failed_query(record, e, "generation" if chunks else "first_byte")
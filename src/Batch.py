@@ -0,0 +1,219 @@
+import asyncio
+import json
+import os
+import random
+import time
+from openai import AsyncOpenAI
+from AsyncBot import AsyncBot
+from AsyncOpenAIClient import AsyncOpenAIClient
+from ContextIndex import DEFAULT_TOKEN_BUDGET
+from ContextPacks import default_registry
+from ConversationHistory import ConversationHistory
+from Metrics import Metrics
+from RateLimiter import BATCH, RateLimiter
+from CallPolicy import CallPolicy
+from ResponseCache import ResponseCache
+from QuestionCache import QuestionCache
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_ATTEMPTS = 5
+DEFAULT_BACKOFF = 1.0
+DEFAULT_MAX_BACKOFF = 30.0
+
+
+def read_questions(path):
+    """
+    Yields the (id, question) items of a JSON Lines file.
+    a line is {"id": ..., "question": ...} or a JSON string, the line number is the id when there is none.
+    """
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                yield str(number), item
+            else:
+                yield str(item.get("id", number)), item["question"]
+
+
+def completed_ids(path):
+    """
+    Returns the ids already answered in an output file, a line cut by an interrupted run is ignored.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if "answer" in record:
+                done.add(str(record["id"]))
+    return done
+
+
+class Batch:
+    def __init__(self, out_path, concurrency=DEFAULT_CONCURRENCY, attempts=DEFAULT_ATTEMPTS, backoff=DEFAULT_BACKOFF,
+                 max_backoff=DEFAULT_MAX_BACKOFF, context_budget=DEFAULT_TOKEN_BUDGET, model="gpt-4.1", label=None,
+                 cache=True, client=None, metrics=None, limiter=None, policy=None, question_cache=True):
+        """
+        Initializes a batch run answering independent questions, each one with its own single turn history.
+        at most concurrency questions are sent at once. a failed question is retried up to attempts times, waiting
+        a random time up to backoff * 2 ** retry seconds (capped at max_backoff) before each retry.
+        label routes the context of all the questions, by default every question is classified on its own.
+        the results are appended to out_path as they complete.
+        limiter is the RateLimiter the requests wait for, by default one adjusted from the API rate limit headers.
+        policy is the CallPolicy of the calls, its transient error retries happen within an attempt.
+        question_cache answers the near duplicates of the questions already answered in this run from a QuestionCache.
+        """
+        self.out_path = out_path
+        self.concurrency = concurrency
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.context_budget = context_budget
+        self.model = model
+        self.label = label
+        self.openai = client if client is not None else AsyncOpenAI()
+        self.cache = ResponseCache() if cache else None
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.limiter = limiter if limiter is not None else RateLimiter()
+        self.policy = policy if policy is not None else CallPolicy()
+        self.packs = default_registry()
+        self.question_cache = QuestionCache() if question_cache else None
+        self.out = None
+        self.answered = 0
+        self.failed = 0
+        self.skipped = 0
+
+    def make_bot(self):
+        """
+        Returns a bot answering a single question with the shared client, cache and packs.
+        """
+        client = AsyncOpenAIClient(cache=self.cache, history=ConversationHistory(), client=self.openai,
+                                   metrics=self.metrics, limiter=self.limiter, policy=self.policy)
+        bot = AsyncBot(self.context_budget, stream=False, client=client, packs=self.packs,
+                       question_cache=self.question_cache)
+        client.clear_messages()
+        return bot
+
+    async def answer(self, item_id, question):
+        """
+        Returns the result record of a question, retrying the failed requests and the invalid answers.
+        """
+        start = time.perf_counter()
+        bot = self.make_bot()
+        bot.label = self.label if self.label is not None else await bot.classify(question)
+        cached = bot.cached_answer(question)
+        if cached is not None:
+            result = cached[0]
+            return {"id": item_id, "question": question, "label": bot.label, "answer": result.answer,
+                    "code": result.code, "attempts": 0, "latency": time.perf_counter() - start}
+        bot.add_question(question)
+        # the question is the first turn of its bot, without tagging the shared metrics
+        bot.turn = 1
+        response = None
+        for attempt in range(1, self.attempts + 1):
+            if attempt > 1:
+                await asyncio.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 2))))
+            response = await bot.client.query(self.model, priority=BATCH)
+            result = bot.parse(response, bot.client.last_record())
+            if result.ok:
+                bot.remember_answer(question, result, response)
+                return {"id": item_id, "question": question, "label": bot.label, "answer": result.answer,
+                        "code": result.code, "attempts": attempt, "latency": time.perf_counter() - start}
+        return {"id": item_id, "question": question, "label": bot.label, "error": str(result.error),
+                "error_type": type(result.error).__name__, "attempts": self.attempts,
+                "latency": time.perf_counter() - start}
+
+    def write(self, record):
+        """
+        Appends a result record to the output file.
+        """
+        self.out.write(json.dumps(record) + "\n")
+        self.out.flush()
+        if "answer" in record:
+            self.answered += 1
+        else:
+            self.failed += 1
+
+    async def worker(self, queue):
+        """
+        Answers the questions of the queue until it gets None.
+        """
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            try:
+                record = await self.answer(*item)
+            except Exception as e:
+                record = {"id": item[0], "question": item[1], "error": f"An unexpected error occurred: {e}"}
+            self.write(record)
+
+    async def run(self, in_path):
+        """
+        Answers the questions of in_path that are not already answered in the output file.
+        """
+        done = completed_ids(self.out_path)
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        self.out = open(self.out_path, "a+")
+        # an interrupted run may have left a partial line
+        if self.out.tell():
+            self.out.seek(self.out.tell() - 1)
+            if self.out.read(1) != "\n":
+                self.out.write("\n")
+        workers = [asyncio.ensure_future(self.worker(queue)) for _ in range(self.concurrency)]
+        try:
+            for item_id, question in read_questions(in_path):
+                if item_id in done:
+                    self.skipped += 1
+                    continue
+                await queue.put((item_id, question))
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self.out.close()
+            self.metrics.flush()
+            await self.openai.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="answer the DPDK questions of a JSON Lines file")
+    parser.add_argument("input", help='JSON Lines file of {"id": ..., "question": ...}')
+    parser.add_argument("output", help="JSON Lines file the answers are appended to, answered ids are skipped")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--attempts", type=int, default=DEFAULT_ATTEMPTS)
+    parser.add_argument("--backoff", type=float, default=DEFAULT_BACKOFF, help="base of the retry backoff in seconds")
+    parser.add_argument("--max-backoff", type=float, default=DEFAULT_MAX_BACKOFF)
+    parser.add_argument("--context-budget", type=int, default=DEFAULT_TOKEN_BUDGET)
+    parser.add_argument("--model", default="gpt-4.1")
+    parser.add_argument("--label", help="route the context of all the questions to this label")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--metrics-jsonl", help="append the record of every call to this JSON Lines file")
+    parser.add_argument("--rpm", type=int, help="requests per minute budget, by default learned from the API")
+    parser.add_argument("--tpm", type=int, help="tokens per minute budget, by default learned from the API")
+    parser.add_argument("--no-question-cache", action="store_true",
+                        help="send every question, even the near duplicates of the ones already answered")
+    args = parser.parse_args()
+    batch = Batch(args.output, args.concurrency, args.attempts, args.backoff, args.max_backoff, args.context_budget,
+                  args.model, args.label, not args.no_cache, metrics=Metrics(args.metrics_jsonl),
+                  limiter=RateLimiter(args.rpm, args.tpm), question_cache=not args.no_question_cache)
+    start = time.perf_counter()
+    try:
+        asyncio.run(batch.run(args.input))
+    finally:
+        elapsed = time.perf_counter() - start
+        print(f"{batch.answered} answered, {batch.failed} failed, {batch.skipped} already answered "
+              f"in {elapsed:.1f} s ({batch.answered / elapsed if elapsed else 0:.2f} answers/s)")
+        if batch.question_cache is not None:
+            print(f"question cache: {batch.question_cache.stats()['hits']} near duplicates answered without a call")
@@ -0,0 +1,246 @@
+import contextlib
+import io
+import json
+import os
+import threading
+import time
+from Bot import Bot
+from ContextIndex import DEFAULT_TOKEN_BUDGET
+from ConversationHistory import ConversationHistory, DEFAULT_KEEP_TURNS, DEFAULT_MAX_INPUT_TOKENS
+from DocTools import DocTools
+from Metrics import Metrics, percentile
+from MockResponsesServer import MockConfig, MockResponsesServer
+from OpenAIClient import OpenAIClient
+from RateLimiter import RateLimiter
+from CallPolicy import CallPolicy, DEFAULT_DEADLINE
+from ModelCascade import ModelCascade
+from QuestionCache import QuestionCache
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CONVERSATIONS_PATH = os.path.join(HERE, "bench_conversations.json")
+
+
+class BenchOptions:
+    def __init__(self, sessions=1, rounds=1, stream=True, context_budget=DEFAULT_TOKEN_BUDGET,
+                 keep_turns=DEFAULT_KEEP_TURNS, max_input_tokens=DEFAULT_MAX_INPUT_TOKENS, summarize=True,
+                 rate_limiter=True, hedge=True, deadline=DEFAULT_DEADLINE, cascade=False, race=False,
+                 question_cache=False, stateful=False, tools=False):
+        """
+        Initializes the client settings of a benchmark run.
+        sessions is the number of concurrent chat sessions, every session replays rounds conversations.
+        rate_limiter shares a RateLimiter between the sessions, as a server would.
+        hedge and deadline configure the CallPolicy shared by the sessions.
+        cascade answers with the small model first through a ModelCascade shared by the sessions, race queries
+        both models at once.
+        question_cache answers the near duplicate first questions from a QuestionCache shared by the sessions.
+        stateful chains the answer requests with previous_response_id, sending only the new messages.
+        tools lets the model look up the documentation through a DocTools shared by the sessions instead of
+        attaching the context sections to the questions.
+        """
+        self.sessions = sessions
+        self.rounds = rounds
+        self.stream = stream
+        self.context_budget = context_budget
+        self.keep_turns = keep_turns
+        self.max_input_tokens = max_input_tokens
+        self.summarize = summarize
+        self.rate_limiter = rate_limiter
+        self.hedge = hedge
+        self.deadline = deadline
+        self.cascade = cascade
+        self.race = race
+        self.question_cache = question_cache
+        self.stateful = stateful
+        self.tools = tools
+
+
+def make_bot(options, metrics, limiter, policy, cascade=None, question_cache=None, tools=None):
+    """
+    Returns a Bot configured for the benchmark, without the response cache.
+    """
+    history = ConversationHistory(options.keep_turns, options.max_input_tokens)
+    client = OpenAIClient(history=history, metrics=metrics, limiter=limiter, policy=policy, stateful=options.stateful,
+                          tools=tools)
+    # the OpenAI client is created on its first use, create it before the turns are timed
+    client.client
+    if options.summarize:
+        history.summarizer = client.summarize
+    return Bot(options.context_budget, options.stream, cache=False, client=client, cascade=cascade,
+               question_cache=question_cache)
+
+
+def run_session(conversations, options, metrics, limiter, policy, cascade, question_cache, tools, results):
+    """
+    Replays the conversations through a single Bot and records the latency of every turn.
+    """
+    for conversation in conversations:
+        bot = make_bot(options, metrics, limiter, policy, cascade, question_cache, tools)
+        bot.label = bot.classify(conversation[0])
+        bot.client.clear_messages()
+        for question in conversation:
+            start = time.perf_counter()
+            try:
+                result = bot.ask(question)
+            except Exception:
+                result = None
+            if result is None or not result.ok:
+                results["failed"] += 1
+            else:
+                results["latency"].append(time.perf_counter() - start)
+
+
+def run(server, conversations, options):
+    """
+    Runs the sessions concurrently against the server and returns the results.
+    """
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+    metrics = Metrics()
+    limiter = RateLimiter() if options.rate_limiter else None
+    policy = CallPolicy(options.deadline, hedge=options.hedge)
+    cascade = ModelCascade(race=options.race) if options.cascade or options.race else None
+    question_cache = QuestionCache() if options.question_cache else None
+    tools = DocTools() if options.tools else None
+    results = {"latency": [], "failed": 0}
+    threads = []
+    for session in range(options.sessions):
+        # every session starts at a different conversation
+        rotated = conversations[session % len(conversations):] + conversations[:session % len(conversations)]
+        threads.append(threading.Thread(target=run_session, args=(rotated * options.rounds, options, metrics, limiter,
+                                                                      policy, cascade, question_cache, tools,
+                                                                      results)))
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    results["elapsed"] = time.perf_counter() - start
+    results["metrics"] = metrics
+    results["calls"] = policy.stats()
+    results["cascade"] = cascade
+    results["question_cache"] = question_cache.stats() if question_cache is not None else None
+    results["tools"] = tools.stats() if tools is not None else None
+    return results
+
+
+def report(server, results):
+    """
+    Returns the latency, upload and throughput report of a run.
+    """
+    latency = results["latency"]
+    turns = len(latency)
+    answers = [r for r in server.requests if r["kind"] == "answer"]
+    upload = [r["bytes"] for r in answers]
+    records = [r for r in results["metrics"].records if r.data["kind"] == "answer"]
+    first_byte = [r.data["build"] + r.data["queue"] + r.data["retry"] + r.data["first_byte"] for r in records]
+    input_tokens = sum(r.data["input_tokens"] for r in records)
+    cached_tokens = sum(r.data["cached_tokens"] for r in records)
+    return {
+        "turns": turns,
+        "failed": results["failed"],
+        "elapsed": results["elapsed"],
+        "throughput": turns / results["elapsed"] if results["elapsed"] else 0,
+        "latency_p50": percentile(latency, 0.5),
+        "latency_p95": percentile(latency, 0.95),
+        "latency_p99": percentile(latency, 0.99),
+        "first_byte_p50": percentile(first_byte, 0.5),
+        "first_byte_p95": percentile(first_byte, 0.95),
+        "requests": {kind: sum(r["kind"] == kind for r in server.requests) for kind in ("answer", "classify", "summary")},
+        "rate_limited": sum(r["status"] == 429 for r in server.requests),
+        "chained": sum(r["chained"] for r in answers),
+        "chain_lost": sum(r["chained"] and r["status"] == 400 for r in answers),
+        "calls": results["calls"],
+        "models": {model: sum(r["model"] == model for r in answers) for model in sorted({r["model"] for r in answers})},
+        "cascade": results["cascade"].stats() if results["cascade"] is not None else None,
+        "question_cache": results["question_cache"],
+        "tools": results["tools"],
+        "tool_rounds": sum(r.data.get("tool_rounds", 0) for r in records),
+        "input_tokens_per_turn": input_tokens / turns if turns else 0,
+        "cached_tokens_per_turn": cached_tokens / turns if turns else 0,
+        "prompt_cache_ratio": cached_tokens / input_tokens if input_tokens else 0,
+        "upload_bytes_total": sum(r["bytes"] for r in server.requests),
+        "upload_bytes_per_turn": sum(upload) / turns if turns else 0,
+        # a turn sends several answer requests with tools or retries, the percentiles are per request
+        "upload_bytes_request_p95": percentile(upload, 0.95),
+        "upload_bytes_request_max": max(upload) if upload else 0,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="replay scripted DPDK conversations through Bot against a mock server")
+    parser.add_argument("--conversations", default=CONVERSATIONS_PATH)
+    parser.add_argument("--sessions", type=int, default=1, help="number of concurrent sessions")
+    parser.add_argument("--rounds", type=int, default=1, help="conversations replayed per session")
+    parser.add_argument("--no-stream", action="store_true")
+    parser.add_argument("--context-budget", type=int, default=DEFAULT_TOKEN_BUDGET)
+    parser.add_argument("--keep-turns", type=int, default=DEFAULT_KEEP_TURNS)
+    parser.add_argument("--max-input-tokens", type=int, default=DEFAULT_MAX_INPUT_TOKENS)
+    parser.add_argument("--no-summary", action="store_true", help="drop old turns instead of summarizing them")
+    parser.add_argument("--latency", type=float, default=0.2, help="mock seconds to the first token")
+    parser.add_argument("--token-rate", type=float, default=100.0, help="mock generated tokens per second")
+    parser.add_argument("--answer-tokens", type=int, default=120)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--rpm", type=int, help="mock requests per minute limit")
+    parser.add_argument("--tpm", type=int, help="mock tokens per minute limit")
+    parser.add_argument("--no-rate-limiter", action="store_true", help="send the requests without the RateLimiter")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of mock requests with a slow first token")
+    parser.add_argument("--slow-latency", type=float, default=2.0)
+    parser.add_argument("--no-hedge", action="store_true", help="don't send a second request for the slow calls")
+    parser.add_argument("--deadline", type=float, default=DEFAULT_DEADLINE)
+    parser.add_argument("--cascade", action="store_true", help="answer with gpt-4.1-mini first, escalate when needed")
+    parser.add_argument("--race", action="store_true", help="with --cascade, query both models at once")
+    parser.add_argument("--question-cache", action="store_true",
+                        help="answer the near duplicate first questions from a cache shared by the sessions")
+    parser.add_argument("--small-unsure-rate", type=float, default=0.0,
+                        help="fraction of the mock mini answers that are not sure")
+    parser.add_argument("--small-speedup", type=float, default=1.0, help="mock speed factor of the mini model")
+    parser.add_argument("--stateful", action="store_true",
+                        help="chain the answer requests with previous_response_id instead of resending the history")
+    parser.add_argument("--chain-loss-rate", type=float, default=0.0,
+                        help="fraction of the mock previous_response_id requests failing as expired")
+    parser.add_argument("--tools", action="store_true",
+                        help="let the model look up the documentation it needs instead of attaching the context")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    args = parser.parse_args()
+
+    with open(args.conversations) as f:
+        conversations = json.load(f)
+    config = MockConfig(args.latency, args.token_rate, args.answer_tokens, args.error_rate, args.rate_limit_rate,
+                        args.seed, args.rpm, args.tpm, args.slow_rate, args.slow_latency, args.small_unsure_rate,
+                        args.small_speedup, args.chain_loss_rate)
+    options = BenchOptions(args.sessions, args.rounds, not args.no_stream, args.context_budget, args.keep_turns,
+                           args.max_input_tokens, not args.no_summary, not args.no_rate_limiter, not args.no_hedge,
+                           args.deadline, args.cascade, args.race, args.question_cache, args.stateful, args.tools)
+    server = MockResponsesServer(config).start()
+    results = run(server, conversations, options)
+    result = report(server, results)
+    server.shutdown()
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"{result['turns']} turns ({result['failed']} failed) in {result['elapsed']:.2f} s, "
+              f"{result['throughput']:.2f} turns/s with {args.sessions} sessions")
+        print(f"turn latency   p50 {result['latency_p50']:.3f} s  p95 {result['latency_p95']:.3f} s  "
+              f"p99 {result['latency_p99']:.3f} s")
+        print(f"first byte     p50 {result['first_byte_p50']:.3f} s  p95 {result['first_byte_p95']:.3f} s")
+        print(f"upload         {result['upload_bytes_per_turn']:.0f} bytes/turn  per request p95 "
+              f"{result['upload_bytes_request_p95']} max {result['upload_bytes_request_max']}  "
+              f"total {result['upload_bytes_total']}")
+        print(f"prompt cache   {result['cached_tokens_per_turn']:.0f}/{result['input_tokens_per_turn']:.0f} "
+              f"input tokens cached per turn ({result['prompt_cache_ratio']:.0%})")
+        print(f"requests       {result['requests']}, {result['rate_limited']} rate limited")
+        if args.stateful:
+            print(f"chained        {result['chained']} answer requests, {result['chain_lost']} replayed after a lost chain")
+        print(f"calls          {result['calls']}")
+        print(f"answer models  {result['models']}")
+        if result["tools"] is not None:
+            print(f"tools          {result['tool_rounds']} tool rounds, {result['tools']}")
+        if result["question_cache"] is not None:
+            print(f"question cache {result['question_cache']}")
+        if result["cascade"] is not None:
+            print(results["cascade"].summary())
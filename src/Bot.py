@@ -1,39 +1,398 @@
+from Startup import PROFILE, WarmUp
 from OpenAIClient import OpenAIClient
 import DeveloperMsg
-import ast
-import TemplateAPICTX
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from ContextIndex import DEFAULT_TOKEN_BUDGET
+from ContextPacks import default_registry
+from DocTools import DocTools
+from SessionStore import DEFAULT_PATH as SESSIONS_PATH, SessionLog, SessionStore
+from StreamParser import AnswerStreamParser
+from ResponseCache import ResponseCache
+from IntentRouter import IntentRouter, DEFAULT_THRESHOLD, LABELS
+from Metrics import Metrics
+from RateLimiter import RateLimiter
+from CallPolicy import CallPolicy, DEFAULT_DEADLINE
+from ModelCascade import ModelCascade
+from ConversationHistory import serialize
+from StructuredAnswer import ANSWERED, FAILED, Answer, AnswerError, is_error, parse_answer
 
 class Bot:
-    def __init__(self):
+    def __init__(self, context_budget=DEFAULT_TOKEN_BUDGET, stream=True, cache=True, client=None,
+                 intent_threshold=DEFAULT_THRESHOLD, packs=None, metrics=None, limiter=None, policy=None,
+                 cascade=None, question_cache=None, stateful=False, warm_up=True, tools=False, store=None,
+                 session_id=None):
         """
         Initializes the Bot with the OpenAI client and a system message.
+        context_budget is the max number of context tokens attached to each question.
+        stream prints the answer while it is being generated.
+        cache answers repeated requests from the on disk response cache.
+        client is an already created OpenAIClient to use instead of a new one.
+        intent_threshold is the local router confidence below which the start_msg classification is sent to the LLM.
+        packs is the ContextPackRegistry the context is taken from, by default the built in context and src/packs.
+        metrics records the calls of the client, tagged by turn and label.
+        limiter is the RateLimiter of the client, by default one adjusted from the API rate limit headers.
+        policy is the CallPolicy of the client calls, deadlines, hedging, retries and circuit breaker.
+        cascade is an optional ModelCascade, the questions are sent to its small model first and escalated to the
+        larger ones only when needed. without it all the questions are sent to gpt-4.1.
+        question_cache is an optional QuestionCache, possibly shared with other sessions, the first question of the
+        session is answered from it when a near duplicate was answered before with the same context.
+        stateful keeps the conversation on the API side, each answer request continues the previous response and
+        sends only the new messages.
+        warm_up opens the connection to the API in the background while the chat waits for the user, so the
+        questions don't pay for the SDK import and the connection setup (see Startup.WarmUp).
+        tools lets the model look up the sections and the API prototypes of the packs it needs (see DocTools)
+        instead of attaching the context sections to the questions. a given client keeps its own tools.
+        store is an optional SessionStore the session is written to as each turn completes, session_id the id of
+        the session in it, a new one by default. an existing session is restored with resume.
         """
-        self.client = OpenAIClient()
+        packs = packs if packs is not None else default_registry()
+        if client is None:
+            client = OpenAIClient(cache=ResponseCache() if cache else None, metrics=metrics,
+                                  limiter=limiter if limiter is not None else RateLimiter(), policy=policy,
+                                  stateful=stateful, tools=DocTools(packs) if tools else None)
+        self.client = client
+        self.packs = packs
+        self.context_budget = context_budget
+        self.stream = stream
+        self.cascade = cascade
+        self.question_cache = question_cache
+        self.executor = None
+        self.warm_up = WarmUp(self.client) if warm_up else None
+        self.session = SessionLog(store, session_id) if store is not None else None
+        self.router = IntentRouter(threshold=intent_threshold)
+        self.label = None
+        self.turn = 0
         self.sys_msg = "You are a helpful assistant."
         self.client.add_user_message(self.sys_msg)
 
+    def classify(self, user_input):
+        """
+        Returns the start_msg label of the user input.
+        the LLM is asked only when the local router is not confident enough.
+        """
+        def ask_llm(text):
+            message = {"role": "developer", "content": DeveloperMsg.get_dev_msg('start_msg', text)}
+            return self.client.query(self.classify_model, messages=[message], kind="classify")
+        label, _ = self.router.route(user_input, ask_llm)
+        if label not in LABELS:
+            # the LLM didn't reply with a label, use the local guess
+            label = self.router.classify(user_input)[0]
+        return label
+
+    @property
+    def classify_model(self):
+        """
+        Returns the model of the start_msg classification, the small one of the cascade if there is one.
+        """
+        return self.cascade.first if self.cascade is not None else "gpt-4.1"
+
+    def next_turn(self):
+        """
+        Starts a new turn, the following calls are tagged with the turn number and the session label.
+        """
+        self.client.metrics.flush()
+        self.turn += 1
+        self.client.metrics.tags.update(turn=self.turn, label=self.label)
+
+    def parse(self, response, record=None):
+        """
+        Returns the Answer of the response and adds the parse time to the metrics record of its query, if any.
+        a response without a valid answer is returned as the answer text with code FAILED and its AnswerError,
+        the error message of a failed call or the response as is.
+        """
+        start = time.perf_counter()
+        try:
+            result = parse_answer(response)
+        except AnswerError as e:
+            result = Answer(response, FAILED, e)
+        if record is not None:
+            self.client.metrics.add_parse(record, time.perf_counter() - start)
+        return result
+
+    def race_query(self, model, messages):
+        """
+        Returns the response of a raced query and its metrics record, the query runs on another thread.
+        """
+        return self.client.query(model, True, messages), self.client.last_record()
+
+    def context_label(self, user_input):
+        """
+        Returns the label the context of the question is routed to, the local router guess until the session
+        is classified.
+        """
+        return self.label if self.label is not None else self.router.classify(user_input)[0]
+
+    def cached_answer(self, user_input):
+        """
+        Returns the Answer and the response of a near duplicate of the first question of the session answered
+        before, None if there is none or the session already started.
+        """
+        if self.question_cache is None or self.turn:
+            return None
+        response = self.question_cache.get(user_input, self.packs.version(self.context_label(user_input)))
+        if response is None:
+            return None
+        return self.parse(response), response
+
+    def remember_answer(self, user_input, result, response):
+        """
+        Adds the answer to the first question of the session to the question cache.
+        """
+        if self.question_cache is not None and self.turn == 1 and result.ok and result.code == ANSWERED:
+            self.question_cache.put(user_input, self.packs.version(self.context_label(user_input)), response)
+
+    def add_question(self, user_input):
+        """
+        Adds the question to the messages, along with the relevant context sections
+        of the packs routed to the session label.
+        sections already sent in this session are not sent again.
+        with the documentation tools the model looks the context up itself, no section is attached.
+        """
+        if self.client.tools is None:
+            for key, section in self.packs.select(self.context_label(user_input), user_input, self.context_budget):
+                self.client.add_context(key, section.text)
+        self.client.add_user_message(serialize({'question': user_input}))
+
+    def stream_answer(self, model="gpt-4.1"):
+        """
+        Queries the model as a stream and prints the answer field as it arrives.
+        Returns the Answer and the raw response text.
+        """
+        parser = AnswerStreamParser()
+        print("Assistant: ", end="", flush=True)
+        response = self.client.query_stream(model, on_delta=lambda delta: print(parser.feed(delta), end="", flush=True))
+        if parser.quote is None:
+            # the response doesn't follow the expected structure, show it as is
+            print(response, end="")
+        print()
+        return self.parse(response, self.client.last_record()), response
+
+    def ask(self, user_input):
+        """
+        Answers a question in a new turn and returns its Answer.
+        """
+        cached = self.cached_answer(user_input)
+        self.next_turn()
+        self.add_question(user_input)
+        if cached is not None:
+            result, response = cached
+            print("Assistant:", result.answer)
+        else:
+            if self.cascade is not None:
+                result, response = self.cascade_answer()
+            else:
+                result, response = self.answer()
+            self.remember_answer(user_input, result, response)
+        self.end_turn(response)
+        return result
+
+    def answer(self, model="gpt-4.1"):
+        """
+        Queries the model, streamed or not, and prints the answer.
+        Returns the Answer and the raw response text.
+        """
+        if self.stream:
+            return self.stream_answer(model)
+        response = self.client.query(model)
+        result = self.parse(response, self.client.last_record())
+        print("Assistant:", result.answer)
+        return result, response
+
+    def cascade_answer(self):
+        """
+        Queries the cascade tiers in turn until a response is accepted, the last tier is always accepted.
+        the responses of the other tiers are printed only once accepted, so they are not streamed.
+        Returns the Answer and the raw response text.
+        """
+        cascade = self.cascade
+        if cascade.race and len(cascade.tiers) > 1:
+            return self.race_answer()
+        for model in cascade.tiers[:-1]:
+            start = time.perf_counter()
+            response = self.client.query(model)
+            result = self.parse(response, self.client.last_record())
+            reason = cascade.escalation_reason(result, response)
+            cascade.record(model, time.perf_counter() - start, reason)
+            if reason is None:
+                print("Assistant:", result.answer)
+                return result, response
+        start = time.perf_counter()
+        result, response = self.answer(cascade.tiers[-1])
+        cascade.record(cascade.tiers[-1], time.perf_counter() - start)
+        return result, response
+
+    def race_answer(self):
+        """
+        Queries the first and last cascade tiers at once, the first tier answers if it completes first and is
+        accepted, the last tier answers otherwise.
+        a thread can't interrupt the slower call, its response is only left to the cache.
+        Returns the Answer and the raw response text.
+        """
+        cascade = self.cascade
+        small, large = cascade.tiers[0], cascade.tiers[-1]
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(thread_name_prefix="race")
+        # both calls send the messages of this turn, the slower one may build its request after the turn ended
+        messages = self.client.messages
+        start = time.perf_counter()
+        small_call = self.executor.submit(self.race_query, small, messages)
+        large_call = self.executor.submit(self.race_query, large, messages)
+        wait((small_call, large_call), return_when=FIRST_COMPLETED)
+        if not large_call.done():
+            response, record = small_call.result()
+            result = self.parse(response, record)
+            reason = cascade.escalation_reason(result, response)
+            cascade.record(small, time.perf_counter() - start, reason)
+            if reason is None:
+                cascade.record_loser(cancelled=False)
+                print("Assistant:", result.answer)
+                return result, response
+        response, record = large_call.result()
+        result = self.parse(response, record)
+        cascade.record(large, time.perf_counter() - start)
+        if not small_call.done():
+            cascade.record_loser(cancelled=False)
+        print("Assistant:", result.answer)
+        return result, response
+
+    def end_turn(self, response):
+        """
+        Adds the response to the messages, the question of a failed call is dropped so it isn't sent again.
+        """
+        if is_error(response):
+            self.client.history.discard_turn()
+        else:
+            self.client.add_assistant_message(response)
+        self.save_session()
+
+    def save_session(self):
+        """
+        Writes the session to its store in the background, if it has one.
+        """
+        if self.session is not None:
+            self.session.save(self.label, self.turn, self.client.history)
+
+    def resume(self):
+        """
+        Restores the label, the turn number, the messages and the context sections of the persisted session,
+        without any API call. returns False if the store has no such session.
+        """
+        with PROFILE.timed("resume"):
+            state = self.session.restore(self.client.history)
+        if state is None:
+            return False
+        self.label = state["label"]
+        self.turn = state["turn"]
+        self.client.metrics.tags.update(turn=self.turn, label=self.label)
+        return True
+
+    def read_input(self, prompt):
+        """
+        Returns a line typed by the user, the connection to the API is warmed up meanwhile.
+        """
+        if self.warm_up is None:
+            return input(prompt)
+        self.warm_up.resume()
+        try:
+            return input(prompt)
+        finally:
+            self.warm_up.pause()
+
     def start_chat(self):
         """
         Starts the chat loop, allowing the user to send messages and receive responses.
         """
         print("Chatbot is ready! Type 'exit' to end the chat.")
-        
-        req = {}
-        user_input = input("You: ")
-        self.client.add_developer_message(DeveloperMsg.get_dev_msg('start_msg', user_input))
-        response = self.client.query()
-        print("Assistant:", response)
-        self.client.clear_messages()
-        req['context'] = TemplateAPICTX.ctx
-        while user_input.lower() != "exit":           
-            req['question'] = user_input
-            self.client.add_user_message(str(req))
-            response = self.client.query()
-            print("Assistant:", ast.literal_eval(response)['answer'])
-            self.client.add_assistant_message(response)
-            user_input = input("You: ")
+        if self.session is not None:
+            print(f"Session {self.session.session_id}, continue it later with --resume {self.session.session_id}")
+        PROFILE.mark("ready")
+        try:
+            user_input = self.read_input("You: ")
+            if self.label is None:
+                self.label = self.classify(user_input)
+                print("Assistant:", self.label)
+            if not self.turn:
+                self.client.clear_messages()
+            while user_input.lower() != "exit":
+                self.ask(user_input)
+                PROFILE.mark("first answer")
+                user_input = self.read_input("You: ")
+        finally:
+            if self.warm_up is not None:
+                self.warm_up.close()
+        self.client.metrics.flush()
 
 if __name__ == "__main__":  
-    bot = Bot()
-    bot.start_chat()
+    PROFILE.mark("imports")
+    import argparse
+    parser = argparse.ArgumentParser(description="DPDK bot")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="run the independent requests concurrently with the asyncio client")
+    parser.add_argument("--profile", action="store_true",
+                        help="print the latency and tokens summary of the session on exit")
+    parser.add_argument("--metrics-jsonl", help="append the record of every call to this JSON Lines file")
+    parser.add_argument("--metrics-prom", help="write the metrics totals to this Prometheus textfile")
+    parser.add_argument("--deadline", type=float, default=DEFAULT_DEADLINE, help="time limit of a call in seconds")
+    parser.add_argument("--no-hedge", action="store_true", help="don't send a second request for the slow calls")
+    parser.add_argument("--cascade", action="store_true",
+                        help="answer with gpt-4.1-mini first and escalate to gpt-4.1 only when needed")
+    parser.add_argument("--race", action="store_true", help="with --cascade, query both models at once")
+    parser.add_argument("--stateful", action="store_true",
+                        help="continue the previous response instead of sending the whole conversation again")
+    parser.add_argument("--no-warm-up", action="store_true",
+                        help="don't connect to the API before the first question")
+    parser.add_argument("--startup-profile", action="store_true",
+                        help="print the time of the startup phases on exit")
+    parser.add_argument("--startup-jsonl", help="append the startup phases of the run to this JSON Lines file")
+    parser.add_argument("--tools", action="store_true",
+                        help="let the model look up the documentation it needs instead of attaching the context")
+    parser.add_argument("--resume", metavar="SESSION",
+                        help="continue a persisted session, 'last' for the last used one")
+    parser.add_argument("--sessions-db", default=SESSIONS_PATH, help="the database the sessions are persisted to")
+    parser.add_argument("--no-persist", action="store_true", help="don't persist the session")
+    args = parser.parse_args()
+    if args.resume and args.no_persist:
+        parser.error("--resume needs the persisted sessions")
+    store = SessionStore(args.sessions_db) if not args.no_persist else None
+    session_id = store.latest() if args.resume == "last" else args.resume
+    metrics = Metrics(args.metrics_jsonl, args.metrics_prom)
+    policy = CallPolicy(args.deadline, hedge=not args.no_hedge)
+    cascade = ModelCascade(race=args.race) if args.cascade or args.race else None
+    bot = None
+    try:
+        if args.use_async:
+            import asyncio
+            from AsyncBot import AsyncBot
+            bot = AsyncBot(metrics=metrics, policy=policy, cascade=cascade, stateful=args.stateful,
+                           warm_up=not args.no_warm_up, tools=args.tools, store=store, session_id=session_id)
+        else:
+            bot = Bot(metrics=metrics, policy=policy, cascade=cascade, stateful=args.stateful,
+                      warm_up=not args.no_warm_up, tools=args.tools, store=store, session_id=session_id)
+        if args.resume:
+            if session_id is None or not bot.resume():
+                parser.exit(1, f"no persisted session {args.resume}\n")
+            print(f"Resumed session {session_id}: {bot.turn} turns, label {bot.label}")
+        if args.use_async:
+            asyncio.run(bot.start_chat())
+        else:
+            bot.start_chat()
+    finally:
+        metrics.flush()
+        if store is not None:
+            store.close()
+        if args.profile:
+            print(metrics.summary())
+            if cascade is not None:
+                print(cascade.summary())
+            if bot is not None:
+                print("memory", bot.client.history.memory())
+                if bot.client.cache is not None:
+                    print("response cache", bot.client.cache.stats())
+                if bot.client.tools is not None:
+                    print("tools", bot.client.tools.stats())
+        if args.startup_profile:
+            print(PROFILE.report())
+        if args.startup_jsonl:
+            PROFILE.write(args.startup_jsonl)
 
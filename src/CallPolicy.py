@@ -0,0 +1,377 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from Metrics import percentile
+
+DEFAULT_DEADLINE = 120.0
+DEFAULT_ATTEMPTS = 3
+DEFAULT_BACKOFF = 0.5
+DEFAULT_MAX_BACKOFF = 8.0
+HEDGE_PERCENTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+MAX_HEDGE_RATIO = 0.1
+LATENCY_SAMPLES = 200
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30.0
+# the openai errors worth sending the call again, rate limits are handled by the RateLimiter
+TRANSIENT_ERRORS = ("APIConnectionError", "InternalServerError")
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling the API while the upstream is considered down.
+    """
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Raised when a call didn't complete within its deadline.
+    """
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        """
+        Initializes a breaker opened by failure_threshold transient failures in a row.
+        once open the calls fail fast for reset_timeout seconds, then a single trial call decides whether it closes.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def check(self):
+        """
+        Raises CircuitOpenError if the call should not be sent.
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0 or self.trial:
+                raise CircuitOpenError(f"the API looks down, not calling it for {max(remaining, 0):.0f} s")
+            self.trial = True
+
+    def success(self):
+        """
+        Records a successful call, closing the breaker.
+        """
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def failure(self):
+        """
+        Records a transient failure, opening the breaker after too many in a row or a failed trial call.
+        """
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self.trial = False
+
+    def release(self):
+        """
+        Ends a call cancelled before its outcome was known, the next call is the trial if it was one.
+        """
+        with self.lock:
+            self.trial = False
+
+    @property
+    def state(self):
+        """
+        Returns closed, open or half_open.
+        """
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self.trial else "open"
+
+
+def start_thread(call, name):
+    """
+    Returns the Future of call() run on a new daemon thread.
+    """
+    future = Future()
+
+    def run():
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(call())
+            except BaseException as e:
+                future.set_exception(e)
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+    return future
+
+
+class PrimedStream:
+    def __init__(self, stream, first):
+        """
+        Wraps a stream whose first event was already read.
+        """
+        self.stream = stream
+        self.first = first
+
+    def __iter__(self):
+        if self.first is not None:
+            yield self.first
+        yield from self.stream
+
+    def close(self):
+        self.stream.close()
+
+
+class AsyncPrimedStream:
+    def __init__(self, stream, first):
+        """
+        Wraps an asyncio stream whose first event was already read.
+        """
+        self.stream = stream
+        self.first = first
+
+    async def __aiter__(self):
+        if self.first is not None:
+            yield self.first
+        async for event in self.stream:
+            yield event
+
+    async def close(self):
+        await self.stream.close()
+
+
+class CallPolicy:
+    def __init__(self, deadline=DEFAULT_DEADLINE, attempts=DEFAULT_ATTEMPTS, backoff=DEFAULT_BACKOFF,
+                 max_backoff=DEFAULT_MAX_BACKOFF, hedge=True, hedge_percentile=HEDGE_PERCENTILE,
+                 hedge_min_samples=HEDGE_MIN_SAMPLES, max_hedge_ratio=MAX_HEDGE_RATIO, breaker=None):
+        """
+        Initializes the latency and failure handling of the API calls, shared by the clients using it.
+        deadline is the default time limit of a call in seconds, retries included.
+        a call failing with a transient error is sent up to attempts times, waiting a jittered
+        backoff * 2 ** retry seconds (capped at max_backoff) in between.
+        with hedge, a call taking longer than the hedge_percentile of the observed latencies (once there are
+        hedge_min_samples of them) is sent a second time and the first answer wins, for at most
+        max_hedge_ratio of the calls, and of the calls in flight.
+        breaker is the CircuitBreaker failing the calls fast while the API is down.
+        """
+        self.deadline = deadline
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.max_hedge_ratio = max_hedge_ratio
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.latencies = {}
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.retries = 0
+        # the calls and the hedges in flight
+        self.inflight = 0
+        self.hedging = 0
+        self.lock = threading.Lock()
+
+    def observe(self, key, seconds):
+        """
+        Records the latency of a successful call, key is the (model, kind, stream) of the call.
+        """
+        with self.lock:
+            self.latencies.setdefault(key, deque(maxlen=LATENCY_SAMPLES)).append(seconds)
+
+    def hedge_delay(self, key):
+        """
+        Returns the time after which a call should be hedged, None if there aren't enough samples yet.
+        """
+        if not self.hedge:
+            return None
+        with self.lock:
+            samples = self.latencies.get(key)
+            if samples is None or len(samples) < self.hedge_min_samples:
+                return None
+            return percentile(samples, self.hedge_percentile)
+
+    def hedge_budget(self):
+        """
+        Returns True if one more call can be hedged within the hedge ratio, of all the calls and of the calls in
+        flight. must be called with the lock held.
+        """
+        return (self.hedges + 1 <= self.max_hedge_ratio * max(self.calls, 1)
+                and self.hedging < max(1, int(self.max_hedge_ratio * self.inflight)))
+
+    def take_hedge(self):
+        """
+        Returns True if one more call can be hedged within the hedge ratio, counting it as in flight until
+        hedge_done is called.
+        """
+        with self.lock:
+            if not self.hedge_budget():
+                return False
+            self.hedges += 1
+            self.hedging += 1
+            return True
+
+    def hedge_done(self, _=None):
+        """
+        Counts a hedge out of the calls in flight.
+        """
+        with self.lock:
+            self.hedging -= 1
+
+    def retried(self):
+        """
+        Counts a call sent again.
+        """
+        with self.lock:
+            self.retries += 1
+
+    def backoff_delay(self, retry):
+        """
+        Returns the jittered wait before the given retry, counted from 0.
+        """
+        return random.uniform(0.5, 1.0) * min(self.max_backoff, self.backoff * 2 ** retry)
+
+    def stats(self):
+        """
+        Returns the hedging, retries and breaker counters.
+        """
+        with self.lock:
+            return {"calls": self.calls, "hedges": self.hedges, "hedge_wins": self.hedge_wins,
+                    "retries": self.retries, "breaker": self.breaker.state}
+
+    def run(self, key, call, deadline_at, can_hedge=None, close=None):
+        """
+        Returns the result of call(), hedged with a second call() when it is slower than usual.
+        can_hedge() tells whether the second call may be sent, close(result) releases the result of the loser.
+        a call which can't be hedged runs on the caller's thread, otherwise the caller waits for the first answer
+        while the calls run on threads of their own.
+        raises DeadlineExceeded when no call completed before deadline_at.
+        """
+        with self.lock:
+            self.calls += 1
+            self.inflight += 1
+            hedged = self.hedge_budget()
+        try:
+            delay = self.hedge_delay(key)
+            if delay is None or delay >= deadline_at - time.monotonic() or not hedged:
+                return self.run_once(call, deadline_at)
+            return self.run_hedged(call, deadline_at, delay, can_hedge, close)
+        finally:
+            with self.lock:
+                self.inflight -= 1
+
+    def run_once(self, call, deadline_at):
+        """
+        Returns the result of call() run on the caller's thread, raises DeadlineExceeded when it failed past
+        deadline_at.
+        """
+        if time.monotonic() >= deadline_at:
+            raise DeadlineExceeded("the call didn't complete within its deadline")
+        try:
+            return call()
+        except Exception as e:
+            if time.monotonic() >= deadline_at:
+                raise DeadlineExceeded("the call didn't complete within its deadline") from e
+            raise
+
+    def run_hedged(self, call, deadline_at, delay, can_hedge, close):
+        """
+        Returns the first result of call() and of the hedge sent after delay seconds, see run.
+        """
+        def release(future):
+            if close is not None and future.exception() is None:
+                close(future.result())
+
+        futures = [start_thread(call, "call")]
+        done, _ = wait(futures, timeout=delay)
+        if not done and (can_hedge is None or can_hedge()) and self.take_hedge():
+            futures.append(start_thread(call, "hedge"))
+            futures[1].add_done_callback(self.hedge_done)
+        pending = set(futures)
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(deadline_at - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                if future is not futures[0]:
+                    with self.lock:
+                        self.hedge_wins += 1
+                for loser in pending | (done - {future}):
+                    loser.add_done_callback(release)
+                return future.result()
+        for loser in pending:
+            loser.add_done_callback(release)
+        if error is not None and not pending:
+            raise error
+        raise DeadlineExceeded("the call didn't complete within its deadline")
+
+    async def run_async(self, key, call, deadline_at, can_hedge=None):
+        """
+        Returns the result of await call(), hedged like run(). the loser is cancelled, or closed if it completed.
+        """
+        import asyncio
+        with self.lock:
+            self.calls += 1
+            self.inflight += 1
+        try:
+            delay = self.hedge_delay(key)
+            remaining = deadline_at - time.monotonic()
+            if delay is None or delay >= remaining:
+                try:
+                    return await asyncio.wait_for(call(), max(remaining, 0))
+                except asyncio.TimeoutError:
+                    raise DeadlineExceeded("the call didn't complete within its deadline")
+            return await self.run_hedged_async(call, deadline_at, delay, can_hedge)
+        finally:
+            with self.lock:
+                self.inflight -= 1
+
+    async def run_hedged_async(self, call, deadline_at, delay, can_hedge):
+        """
+        Returns the first result of await call() and of the hedge sent after delay seconds, see run_async.
+        """
+        import asyncio
+
+        def release(task):
+            if not task.cancelled() and task.exception() is None and hasattr(task.result(), "close"):
+                asyncio.ensure_future(task.result().close())
+
+        tasks = [asyncio.ensure_future(call())]
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done and (can_hedge is None or can_hedge()) and self.take_hedge():
+            tasks.append(asyncio.ensure_future(call()))
+            tasks[1].add_done_callback(self.hedge_done)
+        pending = set(tasks)
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=max(deadline_at - time.monotonic(), 0),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    if task is not tasks[0]:
+                        with self.lock:
+                            self.hedge_wins += 1
+                    for loser in done - {task}:
+                        release(loser)
+                    return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+                task.add_done_callback(release)
+        if error is not None and not pending:
+            raise error
+        raise DeadlineExceeded("the call didn't complete within its deadline")
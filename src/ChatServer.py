@@ -0,0 +1,532 @@
+import asyncio
+import base64
+import hashlib
+import json
+import secrets
+import struct
+import time
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from AsyncBot import AsyncBot
+from AsyncOpenAIClient import AsyncOpenAIClient
+from ContextIndex import DEFAULT_TOKEN_BUDGET
+from ContextPacks import default_registry
+from DocTools import DocTools
+from ResponseCache import ResponseCache
+from QuestionCache import QuestionCache
+from StreamParser import AnswerStreamParser
+from Metrics import Metrics
+from RateLimiter import RateLimiter
+from CallPolicy import CallPolicy, DEFAULT_DEADLINE
+from ConversationHistory import ConversationHistory
+from MessageStore import BLOBS, SpillFile
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MAX_BODY_BYTES = 64 * 1024
+DEFAULT_MAX_CONNECTIONS = 64
+DEFAULT_MAX_INFLIGHT = 32
+DEFAULT_MAX_WAITING = 128
+DEFAULT_QUEUE_TIMEOUT = 30.0
+DEFAULT_IDLE_TIMEOUT = 30 * 60
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 503: "Service Unavailable"}
+
+
+class Busy(Exception):
+    """
+    Raised when the upstream is saturated and the question can't be queued.
+    """
+
+
+class Gate:
+    def __init__(self, max_inflight=DEFAULT_MAX_INFLIGHT, max_waiting=DEFAULT_MAX_WAITING,
+                 queue_timeout=DEFAULT_QUEUE_TIMEOUT):
+        """
+        Initializes the admission control of the upstream requests.
+        at most max_inflight answers are generated at once, at most max_waiting questions wait for a slot
+        and no question waits longer than queue_timeout seconds, the others are rejected as Busy.
+        """
+        self.slots = asyncio.Semaphore(max_inflight)
+        self.max_waiting = max_waiting
+        self.queue_timeout = queue_timeout
+        self.waiting = 0
+        self.inflight = 0
+
+    async def __aenter__(self):
+        if self.slots.locked() and self.waiting >= self.max_waiting:
+            raise Busy()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise Busy()
+        finally:
+            self.waiting -= 1
+        self.inflight += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self.inflight -= 1
+        self.slots.release()
+
+
+class Session:
+    def __init__(self, session_id, bot):
+        """
+        Initializes the state of a single chat, the questions of a session are answered one at a time.
+        """
+        self.id = session_id
+        self.bot = bot
+        self.lock = asyncio.Lock()
+        self.classification = None
+        self.last_used = time.monotonic()
+
+    async def answer(self, question, send, cached=None):
+        """
+        Answers a question in a new turn, send is called with every event of the answer.
+        the first question starts the start_msg classification, it runs along with the first answer.
+        cached is the (Answer, response) of the question found in the question cache, sent without calling the API.
+        """
+        bot = self.bot
+        if self.classification is None:
+            self.classification = asyncio.ensure_future(bot.classify(question))
+        bot.next_turn()
+        bot.add_question(question)
+        parser = AnswerStreamParser()
+
+        def send_text(text):
+            if text:
+                send({"type": "delta", "text": text})
+
+        if cached is not None:
+            result, response = cached
+            send_text(result.answer)
+        else:
+            if bot.stream:
+                response = await bot.client.query_stream(
+                    on_delta=lambda delta: send_text(parser.feed(delta)))
+            else:
+                response = await bot.client.query()
+            result = bot.parse(response, bot.client.last_record())
+            bot.remember_answer(question, result, response)
+        bot.end_turn(response)
+        if not result.ok:
+            send({"type": "error", "error": type(result.error).__name__, "message": str(result.error)})
+            return
+        if bot.label is None:
+            bot.label = await self.classification
+            send({"type": "label", "label": bot.label})
+        send({"type": "done", "answer": result.answer, "code": result.code})
+
+    def close(self):
+        """
+        Cancels the background requests of the session.
+        """
+        if self.classification is not None:
+            self.classification.cancel()
+        self.bot.client.history.cancel()
+        self.bot.client.metrics.flush()
+
+
+class ChatServer:
+    def __init__(self, host="127.0.0.1", port=8080, context_budget=DEFAULT_TOKEN_BUDGET, stream=True, cache=True,
+                 max_connections=DEFAULT_MAX_CONNECTIONS, max_inflight=DEFAULT_MAX_INFLIGHT,
+                 max_waiting=DEFAULT_MAX_WAITING, queue_timeout=DEFAULT_QUEUE_TIMEOUT,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, metrics_jsonl=None, rpm=None, tpm=None, policy=None,
+                 question_cache=True, stateful=False, spill=False, tools=False):
+        """
+        Initializes a server hosting many chat sessions over HTTP and WebSocket.
+        all the sessions share one OpenAI client, so one pool of at most max_connections keep alive connections,
+        along with the response cache and the context packs. every session keeps its own messages.
+        max_inflight, max_waiting and queue_timeout bound the questions sent upstream (see Gate).
+        sessions unused for idle_timeout seconds are closed.
+        metrics_jsonl is the JSON Lines file the calls of all the sessions are appended to.
+        rpm and tpm are the initial budgets of the RateLimiter shared by the sessions.
+        policy is the CallPolicy shared by the sessions, so the hedging and the circuit breaker see all the calls.
+        question_cache answers the near duplicate first questions of the sessions from a shared QuestionCache.
+        stateful chains the answers of a session with previous_response_id, so only the new messages are uploaded.
+        the context texts are held once for all the sessions (see MessageStore), with spill the older turns of the
+        sessions are moved to a memory mapped temporary file.
+        tools lets the model of every session look up the documentation of the packs through a shared DocTools
+        instead of attaching the context sections to the questions.
+        """
+        self.host = host
+        self.port = port
+        self.context_budget = context_budget
+        self.stream = stream
+        self.idle_timeout = idle_timeout
+        self.metrics_jsonl = metrics_jsonl
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.openai = AsyncOpenAI(http_client=DefaultAsyncHttpxClient(limits=limits))
+        self.cache = ResponseCache() if cache else None
+        self.packs = default_registry()
+        self.limiter = RateLimiter(rpm, tpm)
+        self.policy = policy if policy is not None else CallPolicy()
+        self.gate = Gate(max_inflight, max_waiting, queue_timeout)
+        self.question_cache = QuestionCache() if question_cache else None
+        self.stateful = stateful
+        self.spill = SpillFile() if spill else None
+        self.tools = DocTools(self.packs) if tools else None
+        self.sessions = {}
+        self.server = None
+
+    def create_session(self):
+        """
+        Returns a new session, its bot uses the shared client, cache and packs.
+        """
+        session_id = secrets.token_urlsafe(12)
+        metrics = Metrics(self.metrics_jsonl)
+        metrics.tags["session"] = session_id
+        history = ConversationHistory(spill=self.spill)
+        client = AsyncOpenAIClient(cache=self.cache, history=history, client=self.openai, metrics=metrics,
+                                   limiter=self.limiter, policy=self.policy, stateful=self.stateful,
+                                   tools=self.tools)
+        history.summarizer = client.summarize
+        bot = AsyncBot(self.context_budget, self.stream, client=client, packs=self.packs,
+                       question_cache=self.question_cache)
+        client.clear_messages()
+        session = Session(session_id, bot)
+        self.sessions[session_id] = session
+        return session
+
+    def close_session(self, session_id):
+        """
+        Closes a session, returns False if there is no such session.
+        """
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        session.close()
+        return True
+
+    async def ask(self, session, question, send):
+        """
+        Answers a question of a session, waiting for an upstream slot.
+        raises Busy when the upstream is saturated.
+        """
+        session.last_used = time.monotonic()
+        if session.lock.locked():
+            raise Busy()
+        async with session.lock:
+            # a near duplicate first question doesn't need an upstream slot
+            cached = session.bot.cached_answer(question)
+            if cached is not None:
+                await session.answer(question, send, cached)
+            else:
+                async with self.gate:
+                    await session.answer(question, send)
+        session.last_used = time.monotonic()
+
+    def stats(self):
+        """
+        Returns the sessions and upstream load.
+        """
+        return {"sessions": len(self.sessions), "inflight": self.gate.inflight, "waiting": self.gate.waiting,
+                "rate_limiter": self.limiter.stats(), "calls": self.policy.stats(),
+                "question_cache": self.question_cache.stats() if self.question_cache is not None else None,
+                "response_cache": self.cache.stats() if self.cache is not None else None,
+                "tools": self.tools.stats() if self.tools is not None else None,
+                "memory": self.memory()}
+
+    def memory(self):
+        """
+        Returns the memory held by the sessions, by the context texts they share and the size of the spill file.
+        """
+        return {"sessions_bytes": sum(s.bot.client.history.memory()["bytes"] for s in self.sessions.values()),
+                "context": BLOBS.stats(), "spill": self.spill.stats() if self.spill is not None else None}
+
+    async def reap(self):
+        """
+        Closes the idle sessions.
+        """
+        while True:
+            await asyncio.sleep(min(self.idle_timeout, 60))
+            now = time.monotonic()
+            for session_id, session in list(self.sessions.items()):
+                if now - session.last_used > self.idle_timeout and not session.lock.locked():
+                    self.close_session(session_id)
+
+    async def handle(self, reader, writer):
+        """
+        Serves the HTTP requests of a connection, or its WebSocket after an upgrade.
+        """
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                if headers.get("upgrade", "").lower() == "websocket":
+                    await self.websocket(reader, writer, headers)
+                    break
+                if not await self.route(writer, method, path, body):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except ValueError as e:
+            send_response(writer, 400, {"error": str(e)}, keep_alive=False)
+        finally:
+            writer.close()
+
+    async def route(self, writer, method, path, body):
+        """
+        Answers an HTTP request, returns False when the connection should be closed.
+        POST /sessions creates a session, POST /sessions/<id> asks {"question": ...} and streams the answer
+        events as JSON lines, GET /sessions/<id> returns its memory report, DELETE /sessions/<id> closes the
+        session and GET /stats returns the load.
+        """
+        parts = path.strip("/").split("/")
+        if parts == ["stats"] and method == "GET":
+            send_response(writer, 200, self.stats())
+        elif parts == ["sessions"] and method == "POST":
+            send_response(writer, 200, {"session": self.create_session().id})
+        elif len(parts) == 2 and parts[0] == "sessions":
+            session = self.sessions.get(parts[1])
+            if session is None:
+                send_response(writer, 404, {"error": "unknown session"})
+            elif method == "GET":
+                send_response(writer, 200, {"session": session.id, "memory": session.bot.client.history.memory()})
+            elif method == "DELETE":
+                self.close_session(session.id)
+                send_response(writer, 200, {"session": session.id})
+            elif method == "POST":
+                try:
+                    question = request_question(json.loads(body or b"{}"))
+                except ValueError as e:
+                    send_response(writer, 400, {"error": str(e)})
+                    return True
+                return await self.stream_http(writer, session, question)
+            else:
+                send_response(writer, 405, {"error": "method not allowed"})
+        else:
+            send_response(writer, 404, {"error": "not found"})
+        await writer.drain()
+        return True
+
+    async def stream_http(self, writer, session, question):
+        """
+        Streams the answer events as chunked JSON lines, the headers are sent once a slot is acquired.
+        """
+        started = False
+
+        def send(event):
+            nonlocal started
+            if not started:
+                writer.write(b"HTTP/1.1 200 OK\r\ncontent-type: application/x-ndjson\r\n"
+                             b"transfer-encoding: chunked\r\n\r\n")
+                started = True
+            data = (json.dumps(event) + "\n").encode("utf-8")
+            writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+        try:
+            await self.ask(session, question, send)
+        except Busy:
+            if not started:
+                send_response(writer, 503, {"error": "busy"}, {"retry-after": "1"})
+                await writer.drain()
+                return True
+            raise
+        send({"type": "end"})
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        return True
+
+    async def websocket(self, reader, writer, headers):
+        """
+        Serves a WebSocket connection as one session.
+        every text message is a question (plain or {"question": ...}), the answer events are sent as JSON messages.
+        """
+        key = headers.get("sec-websocket-key")
+        if not key:
+            raise ValueError("missing sec-websocket-key")
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nupgrade: websocket\r\nconnection: Upgrade\r\n"
+                      f"sec-websocket-accept: {accept}\r\n\r\n").encode())
+        session = self.create_session()
+
+        def send(event):
+            writer.write(ws_frame(0x1, json.dumps(event).encode("utf-8")))
+
+        send({"type": "session", "session": session.id})
+        try:
+            while True:
+                message = await read_ws_message(reader, writer)
+                if message is None:
+                    break
+                try:
+                    request = json.loads(message)
+                except ValueError:
+                    request = None
+                try:
+                    # a message which isn't a JSON object is a plain text question
+                    question = request_question(request if isinstance(request, dict) else {"question": message})
+                except ValueError as e:
+                    send({"type": "error", "error": type(e).__name__, "message": str(e)})
+                else:
+                    try:
+                        await self.ask(session, question, send)
+                    except Busy:
+                        send({"type": "busy", "retry_after": 1})
+                # the socket buffer is drained before reading the next question, slow readers slow their session only
+                await writer.drain()
+        finally:
+            self.close_session(session.id)
+
+    async def serve(self):
+        """
+        Serves the sessions until cancelled.
+        """
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        reaper = asyncio.ensure_future(self.reap())
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            reaper.cancel()
+            for session_id in list(self.sessions):
+                self.close_session(session_id)
+            await self.openai.close()
+            if self.spill is not None:
+                self.spill.close()
+
+
+async def read_request(reader):
+    """
+    Returns the method, path, lower case headers and body of the next HTTP request, None at the end of the connection.
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, path, _ = line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise ValueError("bad request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY_BYTES:
+        raise ValueError("request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method, path, headers, body
+
+
+def request_question(request):
+    """
+    Returns the question of a decoded JSON request, raises ValueError if it isn't an object with a non empty
+    question string.
+    """
+    question = request.get("question") if isinstance(request, dict) else None
+    if not isinstance(question, str) or not question.strip():
+        raise ValueError("missing question, expected {\"question\": \"...\"}")
+    return question
+
+
+def send_response(writer, status, payload, headers=None, keep_alive=True):
+    """
+    Writes a JSON response.
+    """
+    data = json.dumps(payload).encode("utf-8")
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", "content-type: application/json",
+             f"content-length: {len(data)}"]
+    lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+    if not keep_alive:
+        lines.append("connection: close")
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + data)
+
+
+def ws_frame(opcode, payload):
+    """
+    Returns a final, unmasked WebSocket frame.
+    """
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+async def read_ws_message(reader, writer):
+    """
+    Returns the next text message of a WebSocket, None when it is closed.
+    pings are answered and fragmented messages are reassembled, a message over MAX_BODY_BYTES closes the socket.
+    """
+    fragments = []
+    size = 0
+    while True:
+        first, second = await reader.readexactly(2)
+        opcode = first & 0x0F
+        length = second & 0x7F
+        if length == 126:
+            length, = struct.unpack("!H", await reader.readexactly(2))
+        elif length == 127:
+            length, = struct.unpack("!Q", await reader.readexactly(8))
+        # the control frames may come between the fragments, the data frames count toward the message size
+        if (length if opcode & 0x8 else size + length) > MAX_BODY_BYTES:
+            writer.write(ws_frame(0x8, struct.pack("!H", 1009)))
+            return None
+        mask = await reader.readexactly(4) if second & 0x80 else b"\0\0\0\0"
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(await reader.readexactly(length)))
+        if opcode == 0x8:
+            writer.write(ws_frame(0x8, payload[:2]))
+            return None
+        if opcode == 0x9:
+            writer.write(ws_frame(0xA, payload))
+            continue
+        if opcode == 0xA:
+            continue
+        fragments.append(payload)
+        size += length
+        if first & 0x80:
+            return b"".join(fragments).decode("utf-8")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="DPDK bot server, many chat sessions over HTTP and WebSocket")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--no-stream", action="store_true")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--max-connections", type=int, default=DEFAULT_MAX_CONNECTIONS,
+                        help="size of the shared upstream connection pool")
+    parser.add_argument("--max-inflight", type=int, default=DEFAULT_MAX_INFLIGHT,
+                        help="answers generated at once, the other questions wait")
+    parser.add_argument("--max-waiting", type=int, default=DEFAULT_MAX_WAITING,
+                        help="questions waiting for a slot before new ones are rejected as busy")
+    parser.add_argument("--queue-timeout", type=float, default=DEFAULT_QUEUE_TIMEOUT)
+    parser.add_argument("--idle-timeout", type=float, default=DEFAULT_IDLE_TIMEOUT)
+    parser.add_argument("--metrics-jsonl", help="append the record of every call to this JSON Lines file")
+    parser.add_argument("--rpm", type=int, help="requests per minute budget, by default learned from the API")
+    parser.add_argument("--tpm", type=int, help="tokens per minute budget, by default learned from the API")
+    parser.add_argument("--deadline", type=float, default=DEFAULT_DEADLINE, help="time limit of a call in seconds")
+    parser.add_argument("--no-hedge", action="store_true", help="don't send a second request for the slow calls")
+    parser.add_argument("--no-question-cache", action="store_true",
+                        help="don't answer the near duplicate first questions from the shared question cache")
+    parser.add_argument("--stateful", action="store_true",
+                        help="continue the previous response instead of sending the whole conversation again")
+    parser.add_argument("--spill", action="store_true",
+                        help="move the older turns of the sessions to a memory mapped temporary file")
+    parser.add_argument("--tools", action="store_true",
+                        help="let the model look up the documentation it needs instead of attaching the context")
+    args = parser.parse_args()
+    server = ChatServer(args.host, args.port, stream=not args.no_stream, cache=not args.no_cache,
+                        max_connections=args.max_connections, max_inflight=args.max_inflight,
+                        max_waiting=args.max_waiting, queue_timeout=args.queue_timeout,
+                        idle_timeout=args.idle_timeout, metrics_jsonl=args.metrics_jsonl, rpm=args.rpm, tpm=args.tpm,
+                        policy=CallPolicy(args.deadline, hedge=not args.no_hedge),
+                        question_cache=not args.no_question_cache, stateful=args.stateful, spill=args.spill,
+                        tools=args.tools)
+    print(f"serving on {args.host}:{args.port}")
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,179 @@
+import math
+import re
+
+# characters RST accepts as section underline adornments
+HEADING_CHARS = "=-~^\"'`#*+:._"
+HEADING_RE = re.compile(r"^([" + re.escape(HEADING_CHARS) + r"])\1{2,}\s*$")
+# DPDK guides adornment order: chapter, section, subsection, subsubsection
+HEADING_LEVELS = "=-~^"
+WORD_RE = re.compile(r"[a-z0-9_]+")
+
+STOP_WORDS = frozenset("""
+a an and are as at be by can do does for from how i if in into is it its me my of on or
+so that the then this to was what when where which who why will with you your
+""".split())
+
+DEFAULT_TOKEN_BUDGET = 1500
+# sections scoring below this fraction of the best match are not worth their tokens
+MIN_SCORE_RATIO = 0.25
+TITLE_WEIGHT = 3
+
+
+def estimate_tokens(text):
+    """
+    Returns a rough token count for the text (about 4 characters per token).
+    """
+    return (len(text) + 3) // 4
+
+
+def tokenize(text):
+    """
+    Splits text into lower case index terms.
+    identifiers such as rte_flow_async_create are kept whole and also split on '_'.
+    """
+    terms = []
+    for word in WORD_RE.findall(text.lower()):
+        if word in STOP_WORDS:
+            continue
+        terms.append(word)
+        if "_" in word:
+            terms.extend(part for part in word.split("_") if part and part not in STOP_WORDS)
+    return terms
+
+
+class Section:
+    def __init__(self, title, path, text):
+        """
+        Initializes a section with its title, the titles path from the top level heading and its text.
+        """
+        self.title = title
+        self.path = path
+        self.text = text
+        self.tokens = estimate_tokens(text)
+
+
+def split_sections(rst):
+    """
+    Splits an RST document into sections based on the heading underlines.
+    """
+    lines = rst.splitlines()
+    levels = list(HEADING_LEVELS)
+    path = []
+    sections = []
+    start = 0
+    title = ""
+
+    def flush(end):
+        text = "\n".join(lines[start:end]).strip()
+        if text:
+            sections.append(Section(title, " / ".join(name for _, name in path), text))
+
+    for i in range(1, len(lines)):
+        head = lines[i - 1].strip()
+        match = HEADING_RE.match(lines[i])
+        if not match or not head or HEADING_RE.match(lines[i - 1]) or len(lines[i].rstrip()) < len(head):
+            continue
+        flush(i - 1)
+        char = match.group(1)
+        if char not in levels:
+            levels.append(char)
+        level = levels.index(char)
+        path = [(lvl, name) for lvl, name in path if lvl < level] + [(level, head)]
+        title = head
+        start = i - 1
+    flush(len(lines))
+    return sections
+
+
+def pack_sections(ranked, token_budget=DEFAULT_TOKEN_BUDGET):
+    """
+    Returns the items of a ranked list of (score, section, ...) tuples that are worth their tokens
+    and fit in the token budget.
+    """
+    chosen = []
+    used = 0
+    for item in ranked:
+        score, section = item[0], item[1]
+        if score < ranked[0][0] * MIN_SCORE_RATIO:
+            break
+        if used + section.tokens > token_budget:
+            continue
+        chosen.append(item)
+        used += section.tokens
+    return chosen
+
+
+class ContextIndex:
+    def __init__(self, rst=None, k1=1.5, b=0.75, sections=None):
+        """
+        Initializes the index by splitting the RST context into sections and precomputing the BM25 weights.
+        sections is an already split list of sections to index instead of the RST text.
+        """
+        self.sections = split_sections(rst) if sections is None else sections
+        self.postings = {}
+        lengths = []
+        doc_terms = []
+        for section in self.sections:
+            terms = tokenize(section.text) + tokenize(section.path) * TITLE_WEIGHT
+            lengths.append(len(terms))
+            counts = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            doc_terms.append(counts)
+
+        nb_docs = len(self.sections)
+        avg_len = sum(lengths) / nb_docs if nb_docs else 0
+        doc_freq = {}
+        for counts in doc_terms:
+            for term in counts:
+                doc_freq[term] = doc_freq.get(term, 0) + 1
+
+        for doc_id, counts in enumerate(doc_terms):
+            norm = k1 * (1 - b + b * lengths[doc_id] / avg_len)
+            for term, tf in counts.items():
+                idf = math.log(1 + (nb_docs - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+                weight = idf * tf * (k1 + 1) / (tf + norm)
+                self.postings.setdefault(term, []).append((doc_id, weight))
+
+    def search(self, query, limit=None):
+        """
+        Returns a list of (score, section index) pairs ranked by relevance to the query.
+        """
+        scores = {}
+        for term in set(tokenize(query)):
+            for doc_id, weight in self.postings.get(term, ()):
+                scores[doc_id] = scores.get(doc_id, 0.0) + weight
+        ranked = sorted(((score, doc_id) for doc_id, score in scores.items()), reverse=True)
+        return ranked[:limit] if limit else ranked
+
+    def select(self, query, token_budget=DEFAULT_TOKEN_BUDGET):
+        """
+        Returns the top ranked sections that fit in the token budget, in document order.
+        """
+        ranked = [(score, self.sections[doc_id], doc_id) for score, doc_id in self.search(query)]
+        chosen = sorted(doc_id for _, _, doc_id in pack_sections(ranked, token_budget))
+        return [self.sections[doc_id] for doc_id in chosen]
+
+    def build_context(self, query, token_budget=DEFAULT_TOKEN_BUDGET):
+        """
+        Returns the context text for the query, built only from the relevant sections.
+        """
+        return "\n\n".join(section.text for section in self.select(query, token_budget))
+
+
+if __name__ == "__main__":
+    import time
+    import TemplateAPICTX
+
+    start = time.perf_counter()
+    index = ContextIndex(TemplateAPICTX.ctx)
+    print(f"indexed {len(index.sections)} sections in {(time.perf_counter() - start) * 1000:.2f} ms")
+    queries = ["how do I resize a template table", "enqueue destruction operation",
+               "what does rte_flow_pull return", "testpmd command to send udp traffic to queue 1"]
+    rounds = 1000
+    for query in queries:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            sections = index.select(query)
+        elapsed = (time.perf_counter() - start) / rounds * 1e6
+        print(f"{elapsed:8.1f} us  {query!r} -> {[s.title for s in sections]}")
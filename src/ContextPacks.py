@@ -0,0 +1,221 @@
+import abc
+import glob
+import hashlib
+import importlib
+import json
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from ContextIndex import ContextIndex, DEFAULT_TOKEN_BUDGET, pack_sections, split_sections
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PACKS_DIR = os.path.join(HERE, "packs")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# rough memory used by a single posting of the BM25 index
+POSTING_BYTES = 64
+
+
+class MappedSection:
+    def __init__(self, body, title, path, offset, length, tokens):
+        """
+        Initializes a section stored at offset in the memory mapped body of a pack.
+        the text is decoded only when it is used.
+        """
+        self.body = body
+        self.title = title
+        self.path = path
+        self.offset = offset
+        self.length = length
+        self.tokens = tokens
+
+    @property
+    def text(self):
+        """
+        Returns the text of the section.
+        """
+        return self.body[self.offset:self.offset + self.length].decode("utf-8")
+
+
+class ContextPack(abc.ABC):
+    def __init__(self, name, labels=None, version=None):
+        """
+        Initializes a pack of context sections.
+        labels are the start_msg labels routed to the pack, None routes all of them.
+        """
+        self.name = name
+        self.labels = labels
+        self.version = version
+        self.index = None
+        self.size = 0
+
+    @abc.abstractmethod
+    def read_sections(self):
+        """
+        Returns the sections of the pack.
+        """
+
+    def load(self):
+        """
+        Builds the index of the pack and returns it.
+        """
+        if self.index is None:
+            self.index = ContextIndex(sections=self.read_sections())
+            self.size = sum(len(postings) for postings in self.index.postings.values()) * POSTING_BYTES
+        return self.index
+
+    def unload(self):
+        """
+        Drops the index of the pack.
+        """
+        self.index = None
+        self.size = 0
+
+
+class FilePack(ContextPack):
+    def __init__(self, manifest_path):
+        """
+        Initializes a pack from its manifest, <name>.json, the sections text is in <name>.txt next to it.
+        only the manifest header is kept until the pack is loaded.
+        """
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        super().__init__(manifest["name"], manifest.get("labels"), manifest.get("version"))
+        self.manifest_path = manifest_path
+        self.body_path = os.path.splitext(manifest_path)[0] + ".txt"
+        self.body = None
+
+    def read_sections(self):
+        """
+        Memory maps the body of the pack and returns its sections using the boundaries from the manifest.
+        """
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        with open(self.body_path, "rb") as f:
+            self.body = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+        return [MappedSection(self.body, s["title"], s["path"], s["offset"], s["length"], s["tokens"])
+                for s in manifest["sections"]]
+
+    def unload(self):
+        """
+        Drops the index of the pack, the body is unmapped once no section refers to it.
+        """
+        super().unload()
+        self.body = None
+
+
+class ModulePack(ContextPack):
+    def __init__(self, name, module, attribute="ctx", labels=None):
+        """
+        Initializes a pack from the RST text held by a python module, such as TemplateAPICTX.
+        the module is imported only when the pack is loaded.
+        """
+        super().__init__(name, labels)
+        self.module = module
+        self.attribute = attribute
+
+    def read_sections(self):
+        """
+        Imports the module and splits its text into sections.
+        """
+        rst = getattr(importlib.import_module(self.module), self.attribute)
+        self.version = hashlib.sha256(rst.encode("utf-8")).hexdigest()[:16]
+        return split_sections(rst)
+
+
+class ContextPackRegistry:
+    def __init__(self, path=PACKS_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Initializes the registry with the packs found in path.
+        packs are loaded on first use and the least recently used ones are unloaded above max_bytes.
+        """
+        self.packs = OrderedDict()
+        self.loaded = OrderedDict()
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        if path:
+            self.discover(path)
+
+    def discover(self, path):
+        """
+        Registers the packs found in the directory.
+        """
+        for manifest_path in sorted(glob.glob(os.path.join(path, "*.json"))):
+            self.register(FilePack(manifest_path))
+
+    def register(self, pack):
+        """
+        Registers a pack, replacing a pack with the same name.
+        """
+        with self.lock:
+            old = self.packs.pop(pack.name, None)
+            if old is not None and self.loaded.pop(pack.name, None):
+                old.unload()
+            self.packs[pack.name] = pack
+
+    def packs_for(self, label):
+        """
+        Returns the packs routed to the label, or all the packs if the label is None.
+        """
+        return [pack for pack in self.packs.values()
+                if label is None or pack.labels is None or label in pack.labels]
+
+    def index(self, pack):
+        """
+        Returns the index of the pack, loading it and evicting cold packs if needed.
+        """
+        with self.lock:
+            index = pack.load()
+            self.loaded[pack.name] = pack
+            self.loaded.move_to_end(pack.name)
+            used = sum(p.size for p in self.loaded.values())
+            while used > self.max_bytes and len(self.loaded) > 1:
+                _, cold = self.loaded.popitem(last=False)
+                used -= cold.size
+                cold.unload()
+            return index
+
+    def select(self, label, query, token_budget=DEFAULT_TOKEN_BUDGET):
+        """
+        Returns the (key, section) pairs of the most relevant sections of the packs routed to the label,
+        within the token budget. the key identifies a section across packs.
+        """
+        ranked = []
+        for order, pack in enumerate(self.packs_for(label)):
+            index = self.index(pack)
+            ranked.extend((score, index.sections[doc_id], order, doc_id, pack.name)
+                          for score, doc_id in index.search(query))
+        ranked.sort(key=lambda item: item[0], reverse=True)
+        chosen = sorted(pack_sections(ranked, token_budget), key=lambda item: (item[2], item[3]))
+        return [(f"{name}:{section.path}", section) for _, section, _, _, name in chosen]
+
+    def version(self, label):
+        """
+        Returns the version of the context of the label, it changes when a pack routed to it changes.
+        """
+        versions = []
+        for pack in self.packs_for(label):
+            if pack.version is None and pack.index is None:
+                # the version of a module pack is known once it is loaded
+                self.index(pack)
+            versions.append(f"{pack.name}:{pack.version}")
+        return hashlib.sha256("\n".join(versions).encode("utf-8")).hexdigest()[:16]
+
+    def stats(self):
+        """
+        Returns the number of registered and loaded packs and the estimated memory of the loaded ones.
+        """
+        with self.lock:
+            return {"packs": len(self.packs), "loaded": list(self.loaded),
+                    "bytes": sum(p.size for p in self.loaded.values())}
+
+
+def default_registry(path=PACKS_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Returns a registry with the built in rte_flow template API context and the packs found in path.
+    """
+    registry = ContextPackRegistry(None, max_bytes)
+    registry.register(ModulePack("rte_flow_templates", "TemplateAPICTX"))
+    if os.path.isdir(path):
+        registry.discover(path)
+    return registry
@@ -0,0 +1,277 @@
+import hashlib
+import json
+import logging
+import sys
+import threading
+from ContextIndex import estimate_tokens
+from MessageStore import BLOBS, Message, text_size
+
+DEFAULT_KEEP_TURNS = 4
+DEFAULT_MAX_INPUT_TOKENS = 12000
+# the turns sent the most often, kept in memory when the older ones are spilled
+DEFAULT_HOT_TURNS = 1
+# the tokens of a context message besides its text
+CONTEXT_MESSAGE_TOKENS = 8
+
+
+def serialize(payload):
+    """
+    Returns the text of a request payload, always the same for the same payload so the request prefix can be
+    cached by the API.
+    """
+    return json.dumps(payload, ensure_ascii=False, sort_keys=True)
+
+
+def message_key(message):
+    """
+    Returns a short key identifying a message by its content.
+    """
+    return hashlib.blake2b(serialize(message).encode("utf-8"), digest_size=16).digest()
+
+
+def message_tokens(message):
+    """
+    Returns the estimated number of tokens of a message.
+    """
+    return estimate_tokens(message["content"]) + 4
+
+
+class ConversationHistory:
+    def __init__(self, keep_turns=DEFAULT_KEEP_TURNS, max_input_tokens=DEFAULT_MAX_INPUT_TOKENS, summarizer=None,
+                 blobs=BLOBS, spill=None, hot_turns=DEFAULT_HOT_TURNS, fold_turns=1):
+        """
+        Initializes the history of a chat session.
+        the context is sent once per session, the last keep_turns turns are kept verbatim and older turns
+        are folded into a rolling summary by summarizer(summary, turns) in the background,
+        on a thread or as an asyncio task if the summarizer is a coroutine function.
+        max_input_tokens is a hard limit on the size of the messages sent in a single request.
+        the context texts are interned in blobs, shared by the sessions, and the messages are kept as Message
+        records rendered as dicts only when a request is built.
+        spill is an optional SpillFile, possibly shared by the sessions, the turns older than the last hot_turns
+        are moved to it.
+        fold_turns is the least number of turns folded at once, a stateful client restarts its chain of responses
+        once per summary so it folds several turns at a time.
+        """
+        self.keep_turns = keep_turns
+        self.fold_turns = fold_turns
+        self.max_input_tokens = max_input_tokens
+        self.summarizer = summarizer
+        self.blobs = blobs
+        self.spill = spill
+        self.hot_turns = hot_turns
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.tasks = set()
+        self.clear()
+
+    def clear(self):
+        """
+        Clears the context, the summary and all the turns.
+        """
+        self.cancel()
+        with self.lock:
+            self.context = {}
+            self.summary = ""
+            self.folding = []
+            self.turns = []
+            self.generation += 1
+
+    def add_context(self, key, text):
+        """
+        Adds a context section to the session, returns False if it was already sent.
+        """
+        with self.lock:
+            if key in self.context:
+                return False
+        blob = self.blobs.intern(text)
+        with self.lock:
+            return self.context.setdefault(key, blob) is blob
+
+    def add_message(self, role, content):
+        """
+        Adds a message, a new turn starts with the first message after an assistant reply.
+        """
+        with self.lock:
+            if not self.turns or self.turns[-1][-1].role == "assistant":
+                self.turns.append([])
+            self.turns[-1].append(Message(role, content))
+            if role == "assistant":
+                self._compact()
+                self._spill_cold()
+
+    def _spill_cold(self):
+        """
+        Moves the content of the turns older than the hot ones to the spill file, if there is one.
+        must be called with the lock held.
+        """
+        if self.spill is not None:
+            for turn in self.turns[:-self.hot_turns] if self.hot_turns else self.turns:
+                for message in turn:
+                    self.spill.spill(message)
+
+    def snapshot(self):
+        """
+        Returns the state of the session to persist: the summary, the (key, blob) pairs of the context sections and
+        the messages of the answered turns, including the ones being summarized.
+        """
+        with self.lock:
+            turns = self.folding + self.turns
+            if turns and turns[-1][-1].role != "assistant":
+                turns = turns[:-1]
+            return self.summary, list(self.context.items()), [m for turn in turns for m in turn]
+
+    def restore(self, summary, context, messages):
+        """
+        Replaces the state of the session with a persisted one, given as the summary, the (key, text) pairs of the
+        context sections and the (role, content) pairs of the messages, and returns the restored Message records.
+        nothing is summarized until the next answer.
+        """
+        self.clear()
+        blobs = [(key, self.blobs.intern(text)) for key, text in context]
+        restored = [Message(role, content) for role, content in messages]
+        with self.lock:
+            self.summary = summary
+            self.context = dict(blobs)
+            for message in restored:
+                if not self.turns or self.turns[-1][-1].role == "assistant":
+                    self.turns.append([])
+                self.turns[-1].append(message)
+            self._spill_cold()
+        return restored
+
+    def discard_turn(self):
+        """
+        Removes the last turn if it wasn't answered, e.g. when the request failed.
+        """
+        with self.lock:
+            if self.turns and self.turns[-1][-1].role != "assistant":
+                self.turns.pop()
+
+    def _compact(self):
+        """
+        Moves the turns above keep_turns out of the verbatim history and starts summarizing them, once there are at
+        least fold_turns of them. must be called with the lock held.
+        """
+        if len(self.turns) < self.keep_turns + self.fold_turns or self.folding:
+            return
+        overflow = len(self.turns) - self.keep_turns
+        if self.summarizer is None:
+            del self.turns[:overflow]
+            return
+        self.folding = self.turns[:overflow]
+        del self.turns[:overflow]
+        args = (self.generation, self.summary, [[message.to_dict() for message in turn] for turn in self.folding])
+        # a coroutine summarizer runs on an event loop, so asyncio is already imported
+        asyncio = sys.modules.get("asyncio")
+        if asyncio is not None and asyncio.iscoroutinefunction(self.summarizer):
+            task = asyncio.get_running_loop().create_task(self._summarize_async(*args))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        else:
+            threading.Thread(target=self._summarize, args=args, daemon=True).start()
+
+    def _summarize(self, generation, summary, turns):
+        """
+        Runs the summarizer and replaces the folded turns with the new summary.
+        """
+        try:
+            summary = self.summarizer(summary, turns)
+        except Exception:
+            self._unfold(generation)
+            return
+        self._set_summary(generation, summary)
+
+    async def _summarize_async(self, generation, summary, turns):
+        """
+        Runs the coroutine summarizer and replaces the folded turns with the new summary.
+        """
+        try:
+            summary = await self.summarizer(summary, turns)
+        except Exception:
+            self._unfold(generation)
+            return
+        self._set_summary(generation, summary)
+
+    def _set_summary(self, generation, summary):
+        """
+        Replaces the folded turns with the summary, unless the history was cleared meanwhile.
+        """
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.summary = summary
+            self.folding = []
+            self._compact()
+
+    def _unfold(self, generation):
+        """
+        Puts the folded turns back in the verbatim history after a failed summary, keeping the previous summary.
+        they are folded again, with the turns added meanwhile, after the next answer.
+        """
+        logging.getLogger(__name__).warning("summarizing the conversation failed, it is retried after the next answer",
+                                            exc_info=True)
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.turns[:0] = self.folding
+            self.folding = []
+
+    def cancel(self):
+        """
+        Cancels the running summary tasks.
+        """
+        for task in list(self.tasks):
+            task.cancel()
+
+    def build(self, reserved_tokens=0):
+        """
+        Returns the list of messages to send, limited to max_input_tokens minus reserved_tokens.
+        the messages are laid out for the API prompt cache, from the most to the least stable: the context sections
+        in the order they were first sent (one message each, so a new section leaves the previous ones cached),
+        the summary, the turns and the question of the last turn.
+        the oldest turns are dropped first, then the summary and then the oldest context sections.
+        the last turn is always sent.
+        """
+        with self.lock:
+            context = list(self.context.values())
+            summary = self.summary
+            turns = self.folding + self.turns
+
+        def summary_message():
+            return {"role": "developer", "content": "summary of the earlier conversation:\n" + summary}
+
+        budget = self.max_input_tokens - reserved_tokens
+        used = sum(m.tokens for turn in turns for m in turn)
+        while len(turns) > 1 and used > budget:
+            used -= sum(m.tokens for m in turns.pop(0))
+        if summary and used + message_tokens(summary_message()) > budget:
+            summary = ""
+        if summary:
+            used += message_tokens(summary_message())
+        used += sum(blob.tokens + CONTEXT_MESSAGE_TOKENS for blob in context)
+        while context and used > budget:
+            used -= context.pop(0).tokens + CONTEXT_MESSAGE_TOKENS
+
+        messages = [{"role": "user", "content": serialize({"context": blob.text})} for blob in context]
+        if summary:
+            messages.append(summary_message())
+        for turn in turns:
+            messages.extend(m.to_dict() for m in turn)
+        return messages
+
+    def memory(self):
+        """
+        Returns the memory used by the session: its messages in memory and spilled, the summary, and the context
+        texts it refers to, shared with the other sessions sending them.
+        """
+        with self.lock:
+            messages = [m for turn in self.folding + self.turns for m in turn]
+            context = list(self.context.values())
+            summary = self.summary
+        spilled = [m for m in messages if m.text is None]
+        message_bytes = sum(m.size for m in messages)
+        return {"turns": len(self.folding) + len(self.turns), "messages": len(messages),
+                "spilled_messages": len(spilled), "spilled_bytes": sum(m.length for m in spilled),
+                "message_bytes": message_bytes, "summary_bytes": text_size(summary),
+                "context_sections": len(context), "shared_context_bytes": sum(text_size(b.text) for b in context),
+                "bytes": message_bytes + text_size(summary)}
@@ -0,0 +1,172 @@
+import difflib
+import json
+import re
+import threading
+import time
+from ContextPacks import default_registry
+
+# the tool rounds of an answer, the last one must answer without calling a tool
+DEFAULT_MAX_TOOL_ROUNDS = 3
+# the tokens of guide sections returned by a search, a few sections
+SEARCH_TOKEN_BUDGET = 600
+MAX_SUGGESTIONS = 3
+# a C prototype in a code block: the return type, the rte_ function name and typed parameters
+SIGNATURE_RE = re.compile(r"^[ \t]*((?:const\s+)?(?:(?:struct|enum|union)\s+)?\w+(?:\s*\*)*)\s+(\*?\s*rte_\w+)\s*"
+                          r"\(([^;(){}&=]*)\)\s*;", re.M)
+NOT_TYPES = frozenset(("return", "else", "if", "case", "goto"))
+
+TOOLS = [
+    {"type": "function", "name": "search_dpdk_docs",
+     "description": "Searches the DPDK guides and returns the few sections most relevant to the query.",
+     "parameters": {"type": "object",
+                    "properties": {"query": {"type": "string",
+                                             "description": "what to look for, API names or a short description"}},
+                    "required": ["query"], "additionalProperties": False},
+     "strict": True},
+    {"type": "function", "name": "get_api_signature",
+     "description": "Returns the C prototype of a DPDK API function and the guide section documenting it.",
+     "parameters": {"type": "object",
+                    "properties": {"name": {"type": "string",
+                                            "description": "the function name, e.g. rte_flow_async_create"}},
+                    "required": ["name"], "additionalProperties": False},
+     "strict": True},
+]
+
+
+def extract_signatures(text):
+    """
+    Returns the (name, prototype) pairs of the C prototypes declared in a text, each prototype joined on
+    a single line.
+    """
+    signatures = []
+    for match in SIGNATURE_RE.finditer(text):
+        result, name, parameters = match.groups()
+        if result in NOT_TYPES:
+            continue
+        parameters = [" ".join(parameter.split()) for parameter in parameters.split(",")]
+        # the parameters of a call are names or values, the ones of a prototype have a type
+        if parameters != ["void"] and not all(" " in parameter or "*" in parameter for parameter in parameters):
+            continue
+        result = " ".join(result.split()) + (" *" if name.startswith("*") else "")
+        name = name.lstrip("* \t")
+        separator = "" if result.endswith("*") else " "
+        signatures.append((name, f"{result}{separator}{name}({', '.join(parameters)});"))
+    return signatures
+
+
+def tool_calls(output):
+    """
+    Returns the function calls of the output items of a response.
+    """
+    return [item for item in output or () if item.type == "function_call"]
+
+
+class DocTools:
+    def __init__(self, packs=None, max_rounds=DEFAULT_MAX_TOOL_ROUNDS, token_budget=SEARCH_TOKEN_BUDGET):
+        """
+        Initializes the documentation tools the model calls to look up what it needs instead of being sent the
+        context with every question: search_dpdk_docs over the guide sections of the packs, and
+        get_api_signature over the index of the prototypes found in their code blocks.
+        packs is the ContextPackRegistry searched, by default the built in context and src/packs.
+        max_rounds is the number of tool rounds of an answer, token_budget the size of the search results.
+        """
+        self.packs = packs if packs is not None else default_registry()
+        self.max_rounds = max_rounds
+        self.token_budget = token_budget
+        self.definitions = TOOLS
+        # name -> (prototype, section key), rebuilt when the packs change
+        self.signatures = {}
+        self.version = None
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.lock = threading.Lock()
+
+    def signature_index(self):
+        """
+        Returns the prototypes index of the packs, building it on the first use and when a pack changed.
+        """
+        version = self.packs.version(None)
+        with self.lock:
+            if version == self.version:
+                return self.signatures
+        signatures = {}
+        for pack in self.packs.packs_for(None):
+            for section in self.packs.index(pack).sections:
+                for name, signature in extract_signatures(section.text):
+                    signatures.setdefault(name, (signature, f"{pack.name}:{section.path}"))
+        with self.lock:
+            self.signatures, self.version = signatures, version
+        return signatures
+
+    def search_dpdk_docs(self, query):
+        """
+        Returns the guide sections most relevant to the query within the token budget.
+        """
+        sections = self.packs.select(None, query, self.token_budget)
+        if not sections:
+            return f"no section of the guides matches {query!r}"
+        return "\n\n".join(f"[{key}]\n{section.text}" for key, section in sections)
+
+    def get_api_signature(self, name):
+        """
+        Returns the prototype of the function and where it is documented, or the closest known names.
+        """
+        name = name.strip().rstrip("()")
+        signatures = self.signature_index()
+        found = signatures.get(name)
+        if found is not None:
+            return f"{found[0]}\ndocumented in [{found[1]}]"
+        close = difflib.get_close_matches(name, signatures, MAX_SUGGESTIONS)
+        suggestion = f", did you mean {', '.join(close)}?" if close else ", try search_dpdk_docs"
+        return f"no prototype of {name} in the guides{suggestion}"
+
+    def execute(self, name, arguments):
+        """
+        Returns the output of a tool call, the errors are returned to the model as text.
+        """
+        start = time.perf_counter()
+        try:
+            arguments = json.loads(arguments or "{}")
+            if name == "search_dpdk_docs":
+                output = self.search_dpdk_docs(str(arguments["query"]))
+            elif name == "get_api_signature":
+                output = self.get_api_signature(str(arguments["name"]))
+            else:
+                raise KeyError(name)
+        except (ValueError, KeyError, TypeError) as e:
+            output = f"invalid call of {name}: {e!r}"
+            with self.lock:
+                self.errors += 1
+        with self.lock:
+            self.calls += 1
+            self.seconds += time.perf_counter() - start
+        return output
+
+    def follow_up(self, record, params, calls):
+        """
+        Returns the parameters of the request sending the output of the calls back to the model: the input of the
+        previous request followed by the calls and their output. the request of the last round can't call a tool.
+        """
+        items = []
+        for call in calls:
+            items.append({"type": "function_call", "call_id": call.call_id, "name": call.name,
+                          "arguments": call.arguments})
+            items.append({"type": "function_call_output", "call_id": call.call_id,
+                          "output": self.execute(call.name, call.arguments)})
+        rounds = record.data.get("tool_rounds", 0) + 1
+        record.data["tool_rounds"] = rounds
+        record.data["tool_calls"] = record.data.get("tool_calls", 0) + len(calls)
+        params = dict(params, input=list(params["input"]) + items)
+        if rounds >= self.max_rounds:
+            params["tool_choice"] = "none"
+        return params
+
+    def stats(self):
+        """
+        Returns the number of calls, failed calls and their average time in microseconds, and the size of the
+        prototypes index.
+        """
+        with self.lock:
+            return {"calls": self.calls, "errors": self.errors, "signatures": len(self.signatures),
+                    "average_us": self.seconds / self.calls * 1e6 if self.calls else 0}
@@ -0,0 +1,251 @@
+import hashlib
+import json
+import os
+import re
+from ContextIndex import HEADING_RE, estimate_tokens, split_sections
+from ContextPacks import PACKS_DIR
+
+# start_msg labels routed to the packs built from each guides directory, other directories serve all labels
+PACK_LABELS = {
+    "prog_guide": ["feature", "general_app", "gateway", "IPSec"],
+    "testpmd_app_ug": ["testpmd"],
+    "sample_app_ug": ["general_app", "gateway", "IPSec"],
+    "nics": ["feature", "testpmd", "gateway"],
+    "cryptodevs": ["IPSec"],
+    "linux_gsg": ["general_app"],
+    "howto": ["general_app", "gateway"],
+}
+STATE_DIR = ".ingest"
+STATE_FILE = "state.json"
+
+LABEL_RE = re.compile(r"^\.\. _[^:]+:\s*$")
+DROP_DIRECTIVE_RE = re.compile(r"^\.\. (image|figure|toctree|only|raw|index)::")
+COMMENT_RE = re.compile(r"^\.\.(\s|$)(?!.*::)")
+DIRECTIVE_RE = re.compile(r"^\.\. [\w-]+::")
+ROLE_RE = re.compile(r":(?:ref|doc|numref|term):`([^`<]*?)\s*(?:<[^>]*>)?`")
+
+
+def block_end(lines, start):
+    """
+    Returns the index after the indented block that follows the line at start.
+    """
+    indent = len(lines[start]) - len(lines[start].lstrip())
+    end = start + 1
+    while end < len(lines) and (not lines[end].strip() or len(lines[end]) - len(lines[end].lstrip()) > indent):
+        end += 1
+    return end
+
+
+def compact(text):
+    """
+    Returns the section text compacted for tokens.
+    heading rulers, image and figure directives, comments, label anchors, role markup and redundant
+    indentation are removed, literal and code blocks are kept intact.
+    """
+    lines = text.splitlines()
+    out = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        stripped = line.strip()
+        if DROP_DIRECTIVE_RE.match(stripped) or (COMMENT_RE.match(stripped) and not LABEL_RE.match(stripped)):
+            i = block_end(lines, i)
+            continue
+        if LABEL_RE.match(stripped) or HEADING_RE.match(line):
+            i += 1
+            continue
+        if stripped.endswith("::") or DIRECTIVE_RE.match(stripped):
+            end = block_end(lines, i)
+            out.append(ROLE_RE.sub(r"\1", stripped))
+            out.extend(lines[i + 1:end])
+            i = end
+            continue
+        if stripped or (out and out[-1]):
+            out.append(ROLE_RE.sub(r"\1", stripped))
+        i += 1
+    return "\n".join(out).strip()
+
+
+def file_hash(path):
+    """
+    Returns the sha256 of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Ingest:
+    def __init__(self, guides, out=PACKS_DIR, labels=PACK_LABELS):
+        """
+        Initializes the ingestion of a DPDK doc/guides tree into context packs written to out.
+        every directory directly under guides becomes a pack, routed to the labels given for it.
+        """
+        self.guides = os.path.abspath(guides)
+        self.out = out
+        self.labels = labels
+        self.state_dir = os.path.join(out, STATE_DIR)
+        self.state_path = os.path.join(self.state_dir, STATE_FILE)
+        self.state = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                self.state = json.load(f)
+
+    def rst_files(self):
+        """
+        Yields the relative path of every rst file of the guides tree.
+        """
+        for root, dirs, files in os.walk(self.guides):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith(".rst"):
+                    yield os.path.relpath(os.path.join(root, name), self.guides)
+
+    def pack_name(self, rel):
+        """
+        Returns the name of the pack a file belongs to.
+        """
+        parts = rel.split(os.sep)
+        return parts[0] if len(parts) > 1 else "guides"
+
+    def sections_path(self, digest):
+        """
+        Returns the path of the compacted sections of a file content.
+        """
+        return os.path.join(self.state_dir, digest + ".json")
+
+    def process(self, rel, digest):
+        """
+        Splits a file by headings, compacts its sections and stores them by content hash.
+        the stored sections only depend on the content, the file path is added to them by write_pack.
+        returns the raw token count of the file.
+        """
+        with open(os.path.join(self.guides, rel), encoding="utf-8", errors="replace") as f:
+            raw = f.read()
+        sections = []
+        for section in split_sections(raw):
+            text = compact(section.text)
+            if text:
+                sections.append({"title": section.title, "path": section.path, "text": text})
+        with open(self.sections_path(digest), "w") as f:
+            json.dump(sections, f)
+        return estimate_tokens(raw)
+
+    def run(self):
+        """
+        Processes the new and changed files and rebuilds the packs they belong to.
+        returns a report of the processed files and of the token savings.
+        """
+        os.makedirs(self.state_dir, exist_ok=True)
+        state = {}
+        changed_packs = set()
+        processed = 0
+        for rel in self.rst_files():
+            path = os.path.join(self.guides, rel)
+            stat = os.stat(path)
+            entry = self.state.get(rel)
+            if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+                state[rel] = entry
+                continue
+            digest = file_hash(path)
+            if entry and entry["sha256"] == digest and os.path.exists(self.sections_path(digest)):
+                entry.update(mtime=stat.st_mtime, size=stat.st_size)
+                state[rel] = entry
+                continue
+            raw_tokens = self.process(rel, digest)
+            processed += 1
+            state[rel] = {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": digest,
+                          "pack": self.pack_name(rel), "raw_tokens": raw_tokens}
+            changed_packs.add(state[rel]["pack"])
+        for rel in set(self.state) - set(state):
+            changed_packs.add(self.state[rel]["pack"])
+
+        packs = {}
+        for rel, entry in state.items():
+            packs.setdefault(entry["pack"], []).append(rel)
+        for name in changed_packs:
+            if name in packs:
+                self.write_pack(name, packs[name], state)
+            else:
+                for ext in (".json", ".txt"):
+                    if os.path.exists(os.path.join(self.out, name + ext)):
+                        os.remove(os.path.join(self.out, name + ext))
+
+        live = {entry["sha256"] for entry in state.values()}
+        for name in os.listdir(self.state_dir):
+            if name.endswith(".json") and name != STATE_FILE and name[:-5] not in live:
+                os.remove(os.path.join(self.state_dir, name))
+        self.state = state
+        with open(self.state_path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(self.state_path + ".tmp", self.state_path)
+        return self.report(processed, changed_packs)
+
+    def write_pack(self, name, files, state):
+        """
+        Writes the body and the manifest of a pack from the compacted sections of its files.
+        the files are replaced atomically, so packs already memory mapped keep their old content.
+        """
+        manifest = {"name": name, "labels": self.labels.get(name), "sections": [], "files": len(files),
+                    "raw_tokens": 0, "tokens": 0}
+        body_path = os.path.join(self.out, name + ".txt")
+        digest = hashlib.sha256()
+        offset = 0
+        with open(body_path + ".tmp", "wb") as body:
+            for rel in sorted(files):
+                manifest["raw_tokens"] += state[rel]["raw_tokens"]
+                with open(self.sections_path(state[rel]["sha256"])) as f:
+                    sections = json.load(f)
+                for section in sections:
+                    data = (section["text"] + "\n\n").encode("utf-8")
+                    body.write(data)
+                    digest.update(data)
+                    tokens = estimate_tokens(section["text"])
+                    path = " / ".join(part for part in (rel, section["path"]) if part)
+                    manifest["sections"].append({"title": section["title"], "path": path,
+                                                 "offset": offset, "length": len(data) - 2, "tokens": tokens})
+                    manifest["tokens"] += tokens
+                    offset += len(data)
+        manifest["version"] = digest.hexdigest()[:16]
+        with open(os.path.join(self.out, name + ".json.tmp"), "w") as f:
+            json.dump(manifest, f, separators=(",", ":"))
+        os.replace(body_path + ".tmp", body_path)
+        os.replace(os.path.join(self.out, name + ".json.tmp"), os.path.join(self.out, name + ".json"))
+
+    def report(self, processed, changed_packs):
+        """
+        Returns the ingestion report, with the raw and compacted token counts of every pack.
+        """
+        packs = []
+        for name in sorted({entry["pack"] for entry in self.state.values()}):
+            with open(os.path.join(self.out, name + ".json")) as f:
+                manifest = json.load(f)
+            packs.append({"name": name, "files": manifest["files"], "sections": len(manifest["sections"]),
+                          "raw_tokens": manifest["raw_tokens"], "tokens": manifest["tokens"],
+                          "rebuilt": name in changed_packs})
+        return {"files": len(self.state), "processed": processed, "packs": packs}
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="build context packs from a DPDK doc/guides tree")
+    parser.add_argument("guides", help="path to the doc/guides directory of a DPDK checkout")
+    parser.add_argument("--out", default=PACKS_DIR, help="directory the packs are written to")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    result = Ingest(args.guides, args.out).run()
+    print(f"{result['processed']}/{result['files']} files processed in {time.perf_counter() - start:.2f} s")
+    raw = sum(p["raw_tokens"] for p in result["packs"])
+    compacted = sum(p["tokens"] for p in result["packs"])
+    for p in result["packs"]:
+        saved = 1 - p["tokens"] / p["raw_tokens"] if p["raw_tokens"] else 0
+        print(f"  {p['name']:20} {p['files']:4} files {p['sections']:5} sections "
+              f"{p['raw_tokens']:8} -> {p['tokens']:8} tokens ({saved:.1%} saved)"
+              f"{' rebuilt' if p['rebuilt'] else ''}")
+    if raw:
+        print(f"total {raw} -> {compacted} tokens ({1 - compacted / raw:.1%} saved)")
@@ -0,0 +1,197 @@
+import json
+import math
+import os
+from ContextIndex import tokenize
+from StructuredAnswer import is_error
+
+LABELS = ["feature", "testpmd", "general_app", "gateway", "IPSec"]
+HERE = os.path.dirname(os.path.abspath(__file__))
+CORPUS_PATH = os.path.join(HERE, "intent_corpus.jsonl")
+MODEL_PATH = os.path.join(HERE, "intent_model.json")
+DEFAULT_THRESHOLD = 0.8
+
+# terms that almost always mean the label, they boost the naive bayes score
+KEYWORDS = {
+    "testpmd": {"testpmd", "fwd"},
+    "IPSec": {"ipsec", "esp", "secgw", "ike", "sa", "sp", "rte_security", "cryptodev", "crypto"},
+    "gateway": {"gateway", "nat", "snat", "dnat", "lpm", "gtp"},
+}
+KEYWORD_BOOST = math.log(20)
+
+
+def features(text):
+    """
+    Returns the word unigrams and bigrams of the text.
+    """
+    terms = tokenize(text)
+    return terms + [f"{a} {b}" for a, b in zip(terms, terms[1:])]
+
+
+def normalize_label(text):
+    """
+    Returns the label found in a free text LLM reply, or the reply itself if there is none.
+    """
+    lowered = text.lower()
+    for label in LABELS:
+        if label.lower() in lowered:
+            return label
+    return text.strip()
+
+
+def load_corpus(path=CORPUS_PATH):
+    """
+    Returns the labeled examples as a list of (text, label) pairs.
+    """
+    with open(path) as f:
+        return [(item["text"], item["label"]) for item in map(json.loads, f) if item]
+
+
+def train(examples):
+    """
+    Returns the naive bayes model, the feature counts of every label, trained on (text, label) pairs.
+    """
+    model = {"labels": LABELS, "docs": {label: 0 for label in LABELS}, "counts": {label: {} for label in LABELS}}
+    for text, label in examples:
+        model["docs"][label] += 1
+        counts = model["counts"][label]
+        for feature in features(text):
+            counts[feature] = counts.get(feature, 0) + 1
+    return model
+
+
+def save_model(model, path=MODEL_PATH):
+    """
+    Writes the model in a compact json file.
+    """
+    with open(path, "w") as f:
+        json.dump(model, f, separators=(",", ":"), sort_keys=True)
+
+
+class IntentRouter:
+    def __init__(self, model=None, threshold=DEFAULT_THRESHOLD, path=MODEL_PATH):
+        """
+        Initializes the router from a trained model, loaded from path or trained from the corpus if there is no file.
+        inputs classified with a confidence below threshold should be sent to the LLM.
+        """
+        if model is None:
+            if os.path.exists(path):
+                with open(path) as f:
+                    model = json.load(f)
+            else:
+                model = train(load_corpus())
+        self.threshold = threshold
+        self.labels = model["labels"]
+        total_docs = sum(model["docs"].values())
+        vocab = set()
+        for counts in model["counts"].values():
+            vocab.update(counts)
+        self.log_prior = {}
+        self.log_prob = {}
+        self.log_unknown = {}
+        for label in self.labels:
+            counts = model["counts"][label]
+            denominator = math.log(sum(counts.values()) + len(vocab) + 1)
+            self.log_prior[label] = math.log((model["docs"][label] + 1) / (total_docs + len(self.labels)))
+            self.log_prob[label] = {feature: math.log(count + 1) - denominator for feature, count in counts.items()}
+            self.log_unknown[label] = -denominator
+
+    def classify(self, text):
+        """
+        Returns the most likely label of the text and its confidence (posterior probability).
+        """
+        feats = features(text)
+        terms = set(feats)
+        scores = {}
+        for label in self.labels:
+            log_prob = self.log_prob[label]
+            unknown = self.log_unknown[label]
+            score = self.log_prior[label] + sum(log_prob.get(feature, unknown) for feature in feats)
+            if terms & KEYWORDS.get(label, set()):
+                score += KEYWORD_BOOST
+            scores[label] = score
+        best = max(scores, key=scores.get)
+        total = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1 / total
+
+    def route(self, text, fallback=None):
+        """
+        Returns the label of the text and whether it was found locally.
+        fallback(text) is called to get the label from the LLM when the confidence is below the threshold, the
+        local label is kept when the call failed.
+        """
+        label, confidence = self.classify(text)
+        if confidence >= self.threshold or fallback is None:
+            return label, True
+        reply = fallback(text)
+        if is_error(reply):
+            return label, True
+        return normalize_label(reply), False
+
+
+def report(examples, threshold=DEFAULT_THRESHOLD, folds=5, llm=None):
+    """
+    Prints the cross validated accuracy, the fast path coverage and the latency of the router.
+    llm(text) optionally returns the LLM label of a text, to check that the router agrees with it.
+    """
+    import time
+
+    predictions = []
+    latencies = []
+    for fold in range(folds):
+        train_set = [example for i, example in enumerate(examples) if i % folds != fold]
+        router = IntentRouter(train(train_set), threshold)
+        for i in range(fold, len(examples), folds):
+            text, label = examples[i]
+            start = time.perf_counter()
+            predicted, confidence = router.classify(text)
+            latencies.append((time.perf_counter() - start) * 1e6)
+            predictions.append((text, label, predicted, confidence))
+
+    correct = sum(label == predicted for _, label, predicted, _ in predictions)
+    confident = [p for p in predictions if p[3] >= threshold]
+    confident_correct = sum(label == predicted for _, label, predicted, _ in confident)
+    print(f"{folds}-fold accuracy: {correct / len(predictions):.1%} ({correct}/{len(predictions)})")
+    print(f"fast path coverage at threshold {threshold}: {len(confident) / len(predictions):.1%}, "
+          f"accuracy {confident_correct / max(len(confident), 1):.1%}")
+    for label in LABELS:
+        items = [p for p in predictions if p[1] == label]
+        hits = sum(p[2] == label for p in items)
+        print(f"  {label:12} {hits}/{len(items)}")
+    latencies.sort()
+    print(f"latency: mean {sum(latencies) / len(latencies):.1f} us, "
+          f"p99 {latencies[int(len(latencies) * 0.99)]:.1f} us")
+
+    if llm:
+        agree = 0
+        for text, label, predicted, _ in predictions:
+            llm_label = normalize_label(llm(text))
+            agree += llm_label == predicted
+            if llm_label != label:
+                print(f"  llm disagrees with the corpus: {text!r} {label} -> {llm_label}")
+        print(f"agreement with the LLM: {agree / len(predictions):.1%}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="train and evaluate the start_msg intent router")
+    parser.add_argument("command", choices=["train", "report"])
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--llm", action="store_true", help="compare the router labels with the LLM labels")
+    args = parser.parse_args()
+
+    examples = load_corpus()
+    if args.command == "train":
+        save_model(train(examples))
+        print(f"trained on {len(examples)} examples, model saved to {MODEL_PATH}")
+    else:
+        llm = None
+        if args.llm:
+            import DeveloperMsg
+            from OpenAIClient import OpenAIClient
+            client = OpenAIClient()
+
+            def llm(text):
+                message = {"role": "developer", "content": DeveloperMsg.get_dev_msg('start_msg', text)}
+                return client.query(messages=[message], kind="classify")
+        report(examples, args.threshold, llm=llm)
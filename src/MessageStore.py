@@ -0,0 +1,205 @@
+import hashlib
+import json
+import mmap
+import os
+import sys
+import tempfile
+import threading
+import weakref
+from ContextIndex import estimate_tokens
+
+# the spill file is compacted when more than half of it belongs to dropped messages
+COMPACT_RATIO = 0.5
+MIN_COMPACT_BYTES = 4 * 1024 * 1024
+
+
+def text_size(text):
+    """
+    Returns the memory held by a string.
+    """
+    return sys.getsizeof(text)
+
+
+class Blob:
+    __slots__ = ("digest", "text", "tokens", "__weakref__")
+
+    def __init__(self, digest, text):
+        """
+        Initializes an interned context text, tokens is its estimated size once JSON encoded in a message.
+        """
+        self.digest = digest
+        self.text = text
+        self.tokens = estimate_tokens(json.dumps(text, ensure_ascii=False))
+
+
+class BlobStore:
+    def __init__(self):
+        """
+        Initializes the table of the interned context texts, shared by the sessions of the process so a section
+        sent by many sessions is held once, whatever string the pack returned for it.
+        a blob is dropped once no session refers to it anymore.
+        """
+        self.blobs = weakref.WeakValueDictionary()
+        self.lookups = 0
+        self.hits = 0
+        self.lock = threading.Lock()
+
+    def intern(self, text):
+        """
+        Returns the blob of the text, the existing one if the same text was interned before.
+        """
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        with self.lock:
+            self.lookups += 1
+            blob = self.blobs.get(digest)
+            if blob is None:
+                blob = Blob(digest, text)
+                self.blobs[digest] = blob
+            else:
+                self.hits += 1
+            return blob
+
+    def stats(self):
+        """
+        Returns the number and memory of the interned texts, and how often a text was already interned.
+        """
+        with self.lock:
+            blobs = list(self.blobs.values())
+            lookups, hits = self.lookups, self.hits
+        return {"blobs": len(blobs), "bytes": sum(text_size(blob.text) for blob in blobs), "lookups": lookups,
+                "hits": hits}
+
+
+# the context texts of all the sessions of the process
+BLOBS = BlobStore()
+
+
+class Message:
+    __slots__ = ("role", "text", "tokens", "spill", "offset", "length", "__weakref__")
+
+    def __init__(self, role, content):
+        """
+        Initializes a message of the history, its content is held in memory until it is spilled.
+        """
+        self.role = role
+        self.text = content
+        self.tokens = estimate_tokens(content) + 4
+        self.spill = None
+        self.offset = 0
+        self.length = 0
+
+    @property
+    def content(self):
+        """
+        Returns the content of the message, read back from the spill file if it was spilled.
+        """
+        if self.text is not None:
+            return self.text
+        return self.spill.read(self.offset, self.length)
+
+    @property
+    def size(self):
+        """
+        Returns the memory held by the message.
+        """
+        return sys.getsizeof(self) + (text_size(self.text) if self.text is not None else 0)
+
+    def to_dict(self):
+        """
+        Returns the message as sent to the API.
+        """
+        return {"role": self.role, "content": self.content}
+
+
+class SpillFile:
+    def __init__(self, path=None, compact_ratio=COMPACT_RATIO, min_compact_bytes=MIN_COMPACT_BYTES):
+        """
+        Initializes an append only file holding the content of the cold messages, possibly shared by many
+        sessions, read back through a memory map so it stays in the page cache rather than on the heap.
+        without a path an anonymous temporary file is used.
+        the space of the dropped messages is reclaimed by rewriting the file once it is more than compact_ratio
+        garbage and at least min_compact_bytes long.
+        """
+        self.path = path
+        self.compact_ratio = compact_ratio
+        self.min_compact_bytes = min_compact_bytes
+        self.file = tempfile.TemporaryFile() if path is None else open(path, "w+b")
+        self.map = None
+        self.size = 0
+        self.next_check = min_compact_bytes
+        self.compactions = 0
+        # the spilled messages still referred to, the others are garbage
+        self.messages = weakref.WeakSet()
+        self.lock = threading.Lock()
+
+    def spill(self, message):
+        """
+        Moves the content of the message to the file.
+        """
+        if message.text is None:
+            return
+        data = message.text.encode("utf-8")
+        with self.lock:
+            self.file.seek(self.size)
+            self.file.write(data)
+            message.spill, message.offset, message.length = self, self.size, len(data)
+            message.text = None
+            self.size += len(data)
+            self.messages.add(message)
+            if self.size >= self.next_check:
+                self._compact()
+
+    def read(self, offset, length):
+        """
+        Returns the text stored at offset.
+        """
+        with self.lock:
+            if self.map is None or len(self.map) < offset + length:
+                self.file.flush()
+                self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            return self.map[offset:offset + length].decode("utf-8")
+
+    def _compact(self):
+        """
+        Rewrites the file with the live messages only if enough of it is garbage.
+        must be called with the lock held.
+        """
+        messages = sorted(self.messages, key=lambda message: message.offset)
+        live = sum(message.length for message in messages)
+        if self.size - live > self.size * self.compact_ratio:
+            self.file.flush()
+            if self.map is not None:
+                self.map.close()
+            old = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            new = tempfile.TemporaryFile() if self.path is None else open(self.path + ".tmp", "w+b")
+            offset = 0
+            for message in messages:
+                new.write(old[message.offset:message.offset + message.length])
+                message.offset = offset
+                offset += message.length
+            new.flush()
+            old.close()
+            self.file.close()
+            if self.path is not None:
+                os.replace(self.path + ".tmp", self.path)
+            self.file, self.map, self.size = new, None, offset
+            self.compactions += 1
+        self.next_check = max(self.size * 2, self.min_compact_bytes)
+
+    def close(self):
+        """
+        Closes the file, the spilled messages can't be read anymore.
+        """
+        with self.lock:
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+            self.file.close()
+
+    def stats(self):
+        """
+        Returns the size of the file, the bytes of the live messages and the number of compactions.
+        """
+        with self.lock:
+            return {"bytes": self.size, "live_bytes": sum(message.length for message in self.messages),
+                    "messages": len(self.messages), "compactions": self.compactions}
@@ -0,0 +1,205 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# USD per 1M tokens: input, cached input, output
+PRICES = {
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+}
+PHASES = ("build", "queue", "retry", "first_byte", "generation", "parse")
+
+
+def cost(model, input_tokens, cached_tokens, output_tokens):
+    """
+    Returns the estimated cost of a call in USD, 0 for unknown models.
+    """
+    price = PRICES.get(model)
+    if price is None:
+        return 0.0
+    return ((input_tokens - cached_tokens) * price[0] + cached_tokens * price[1] + output_tokens * price[2]) / 1e6
+
+
+def percentile(values, fraction):
+    """
+    Returns the value at the given fraction of the sorted values.
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class QueryRecord:
+    def __init__(self, kind, model, tags):
+        """
+        Initializes the record of a single call, the phases are timed from now on.
+        """
+        self.data = {"time": time.time(), "kind": kind, "model": model, "cache_hit": False,
+                     "input_tokens": 0, "cached_tokens": 0, "output_tokens": 0, "cost": 0.0}
+        self.data.update(tags)
+        for phase in PHASES:
+            self.data[phase] = 0.0
+        self.last = time.perf_counter()
+
+    def mark(self, phase):
+        """
+        Adds the time since the previous mark to the phase.
+        """
+        now = time.perf_counter()
+        self.data[phase] += now - self.last
+        self.last = now
+
+    def usage(self, usage):
+        """
+        Adds the token usage block of a response and its cost, a call sending tool outputs back makes a response
+        per tool round.
+        """
+        if usage is None:
+            return
+        details = getattr(usage, "input_tokens_details", None)
+        self.data["input_tokens"] += usage.input_tokens or 0
+        self.data["cached_tokens"] += (getattr(details, "cached_tokens", 0) or 0) if details else 0
+        self.data["output_tokens"] += usage.output_tokens or 0
+        self.data["cost"] = cost(self.data["model"], self.data["input_tokens"], self.data["cached_tokens"],
+                                 self.data["output_tokens"])
+
+    @property
+    def latency(self):
+        """
+        Returns the total time of the call.
+        """
+        return sum(self.data[phase] for phase in PHASES)
+
+
+class Metrics:
+    def __init__(self, jsonl_path=None, prom_path=None, max_records=10000):
+        """
+        Initializes the metrics of the client calls.
+        the records are appended to jsonl_path and the totals are written to the prom_path
+        Prometheus textfile on every flush.
+        tags are added to every new record, e.g. the turn and the intent label.
+        """
+        self.jsonl_path = jsonl_path
+        self.prom_path = prom_path
+        self.records = deque(maxlen=max_records)
+        self.pending = []
+        self.tags = {}
+        self.totals = {}
+        self.lock = threading.Lock()
+
+    def begin(self, kind, model):
+        """
+        Returns a new record for a call, tagged with the current tags.
+        """
+        return QueryRecord(kind, model, dict(self.tags))
+
+    def end(self, record):
+        """
+        Adds a finished record.
+        """
+        with self.lock:
+            self.records.append(record)
+            self.pending.append(record)
+            data = record.data
+            for key in ("input_tokens", "cached_tokens", "output_tokens", "cost", "cache_hit") + PHASES:
+                name = (data["model"], data["kind"], key)
+                self.totals[name] = self.totals.get(name, 0) + data[key]
+            name = (data["model"], data["kind"], "count")
+            self.totals[name] = self.totals.get(name, 0) + 1
+
+    def add_parse(self, record, seconds):
+        """
+        Adds the parse time of the response to the record of its query.
+        """
+        with self.lock:
+            record.data["parse"] += seconds
+            name = (record.data["model"], record.data["kind"], "parse")
+            self.totals[name] = self.totals.get(name, 0) + seconds
+
+    def flush(self):
+        """
+        Writes the pending records to the JSON Lines file and the totals to the Prometheus textfile.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, []
+            totals = dict(self.totals)
+        if self.jsonl_path and pending:
+            with open(self.jsonl_path, "a") as f:
+                for record in pending:
+                    f.write(json.dumps(record.data) + "\n")
+        if self.prom_path:
+            self.write_prometheus(totals)
+
+    def write_prometheus(self, totals):
+        """
+        Writes the totals in the Prometheus text format, replacing the file atomically.
+        """
+        families = {"dpdkbot_queries_total": [], "dpdkbot_cache_hits_total": [], "dpdkbot_phase_seconds_total": [],
+                    "dpdkbot_tokens_total": [], "dpdkbot_cost_usd_total": []}
+        for (model, kind, key), value in sorted(totals.items()):
+            labels = f'model="{model}",kind="{kind}"'
+            if key == "count":
+                families["dpdkbot_queries_total"].append(f"{{{labels}}} {value}")
+            elif key == "cache_hit":
+                families["dpdkbot_cache_hits_total"].append(f"{{{labels}}} {int(value)}")
+            elif key in PHASES:
+                families["dpdkbot_phase_seconds_total"].append(f'{{{labels},phase="{key}"}} {value:.6f}')
+            elif key == "cost":
+                families["dpdkbot_cost_usd_total"].append(f"{{{labels}}} {value:.6f}")
+            else:
+                families["dpdkbot_tokens_total"].append(f'{{{labels},type="{key[:-len("_tokens")]}"}} {value}')
+        lines = []
+        for family, samples in families.items():
+            lines.append(f"# TYPE {family} counter")
+            lines.extend(family + sample for sample in samples)
+        tmp = self.prom_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, self.prom_path)
+
+    def turn_usage(self, records=None):
+        """
+        Returns the (turn, input_tokens, cached_tokens) of every turn, from the usage of its answer calls.
+        """
+        if records is None:
+            with self.lock:
+                records = [r for r in self.records if r.data["kind"] == "answer"]
+        turns = {}
+        for record in records:
+            usage = turns.setdefault(record.data.get("turn"), [0, 0])
+            usage[0] += record.data["input_tokens"]
+            usage[1] += record.data["cached_tokens"]
+        return [(turn, usage[0], usage[1]) for turn, usage in turns.items()]
+
+    def summary(self):
+        """
+        Returns the per session summary of the answer calls as text.
+        """
+        with self.lock:
+            records = [r for r in self.records if r.data["kind"] == "answer"]
+            others = [r for r in self.records if r.data["kind"] != "answer"]
+        if not records:
+            return "no answers recorded"
+        latency = [r.latency for r in records]
+        first_byte = [r.data["build"] + r.data["queue"] + r.data["retry"] + r.data["first_byte"] for r in records]
+        lines = [f"answers: {len(records)}, other calls: {len(others)}, "
+                 f"cache hits: {sum(r.data['cache_hit'] for r in records)}",
+                 f"latency     p50 {percentile(latency, 0.5):.3f} s  p95 {percentile(latency, 0.95):.3f} s",
+                 f"first byte  p50 {percentile(first_byte, 0.5):.3f} s  p95 {percentile(first_byte, 0.95):.3f} s"]
+        for phase in PHASES:
+            values = [r.data[phase] for r in records]
+            lines.append(f"  {phase:10}  p50 {percentile(values, 0.5):.3f} s  p95 {percentile(values, 0.95):.3f} s")
+        for key in ("input_tokens", "cached_tokens", "output_tokens"):
+            lines.append(f"{key:14} per turn: {sum(r.data[key] for r in records) / len(records):.0f}")
+        input_tokens = sum(r.data["input_tokens"] for r in records)
+        cached_tokens = sum(r.data["cached_tokens"] for r in records)
+        lines.append(f"prompt cache   {cached_tokens / input_tokens if input_tokens else 0:.0%} of the input tokens, "
+                     "cached/input by turn: " + ", ".join(f"{turn} {cached}/{total}"
+                                                          for turn, total, cached in self.turn_usage(records)))
+        total_cost = sum(r.data["cost"] for r in records) + sum(r.data["cost"] for r in others)
+        lines.append(f"estimated cost: ${total_cost:.4f}")
+        return "\n".join(lines)
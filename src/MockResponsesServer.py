@@ -0,0 +1,385 @@
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from RateLimiter import TokenBucket
+
+CLASSIFY_MARKER = "the possible values are"
+SUMMARY_MARKER = "summarize the conversation"
+# like the API prompt cache: prefixes of at least 1024 tokens, cached by 128 tokens increments
+CACHE_MIN_TOKENS = 1024
+CACHE_INCREMENT = 128
+MAX_PREFIXES = 10000
+MAX_RESPONSES = 10000
+API_NAME_RE = re.compile(r"rte_\w+")
+FILLER = ("the rte_flow template API lets the application create pattern and actions templates, "
+          "bind them to a template table and enqueue flow rules on flow queues ")
+
+
+class MockConfig:
+    def __init__(self, latency=0.2, token_rate=100.0, answer_tokens=120, error_rate=0.0, rate_limit_rate=0.0,
+                 seed=None, rpm=None, tpm=None, slow_rate=0.0, slow_latency=2.0, small_unsure_rate=0.0,
+                 small_speedup=1.0, chain_loss_rate=0.0):
+        """
+        Initializes the behaviour of the mock server.
+        latency is the time to the first token in seconds, token_rate the generated tokens per second,
+        answer_tokens the length of the answers, error_rate and rate_limit_rate the fraction of requests
+        failing with a 500 or a 429.
+        rpm and tpm are the enforced requests and tokens per minute limits, reported in the x-ratelimit-* headers.
+        slow_rate is the fraction of requests waiting slow_latency more seconds before the first token.
+        small_unsure_rate is the fraction of the small models (mini and nano) answers that are not sure (code 2),
+        the small models are small_speedup times faster than the others.
+        chain_loss_rate is the fraction of the previous_response_id requests failing as if the response expired.
+        """
+        self.latency = latency
+        self.token_rate = token_rate
+        self.answer_tokens = answer_tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.random = random.Random(seed)
+        self.rpm = rpm
+        self.tpm = tpm
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.small_unsure_rate = small_unsure_rate
+        self.small_speedup = small_speedup
+        self.chain_loss_rate = chain_loss_rate
+
+
+def request_kind(body):
+    """
+    Returns the kind of call of a request: classify, summary or answer.
+    """
+    if SUMMARY_MARKER in (body.get("instructions") or ""):
+        return "summary"
+    if CLASSIFY_MARKER in json.dumps(body["input"]):
+        return "classify"
+    return "answer"
+
+
+def is_small_model(model):
+    """
+    Returns True for the mini and nano models.
+    """
+    return "mini" in (model or "") or "nano" in (model or "")
+
+
+def reply_text(body, config, unsure=False):
+    """
+    Returns the text of the reply: a label for the start_msg classification, a response dictionary otherwise,
+    as JSON when the request asks for a structured response.
+    unsure replies with a short answer the model is not sure about.
+    """
+    kind = request_kind(body)
+    if kind == "classify":
+        return "feature"
+    if kind == "summary":
+        return "the user asked about the rte_flow template API"
+    if unsure:
+        reply = {"answer": "I'm not sure, it depends on the DPDK version.", "code": 2}
+    else:
+        words = (FILLER * (config.answer_tokens // 15 + 1)).split()[:config.answer_tokens]
+        reply = {"answer": " ".join(words), "code": 1}
+    return json.dumps(reply) if body.get("text") else str(reply)
+
+
+def tool_call(body):
+    """
+    Returns the tool call (name, arguments) of an answer request offering tools, or None: the model looks up the
+    prototype of the first API named in the question, or searches the guides for the question, once per answer.
+    """
+    if request_kind(body) != "answer" or not body.get("tools") or body.get("tool_choice") == "none":
+        return None
+    items = body.get("input") or []
+    if isinstance(items, str) or any(item.get("type") == "function_call_output" for item in items):
+        return None
+    question = next((item.get("content") for item in reversed(items) if item.get("role") == "user"), None)
+    if not isinstance(question, str):
+        return None
+    try:
+        question = str(json.loads(question)["question"])
+    except (ValueError, KeyError, TypeError):
+        pass
+    names = {tool["name"] for tool in body["tools"]}
+    api = API_NAME_RE.search(question)
+    if api and "get_api_signature" in names:
+        return "get_api_signature", json.dumps({"name": api.group()})
+    if "search_dpdk_docs" in names:
+        return "search_dpdk_docs", json.dumps({"query": question[:200]})
+    return None
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        """
+        Keeps the benchmark output clean.
+        """
+
+    def send_json(self, status, payload, headers=None):
+        """
+        Sends a JSON response with a content length, so the connection is kept alive.
+        """
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_chunk(self, data):
+        """
+        Writes a chunk of a chunked transfer encoded response.
+        """
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        """
+        Answers the models list, used to open a connection.
+        """
+        self.send_json(200, {"object": "list", "data": [{"id": "gpt-4.1", "object": "model", "created": 0,
+                                                         "owned_by": "mock"}]})
+
+    def do_POST(self):
+        """
+        Answers a responses.create call, streamed or not.
+        """
+        server = self.server
+        config = server.config
+        raw = self.rfile.read(int(self.headers.get("content-length", 0)))
+        body = json.loads(raw)
+        previous = body.get("previous_response_id")
+        with server.lock:
+            held = server.responses.get(previous, []) if previous else []
+            lost = previous and (previous not in server.responses or config.random.random() < config.chain_loss_rate)
+            if lost:
+                server.requests.append({"time": time.time(), "bytes": len(raw), "model": body.get("model"),
+                                        "kind": request_kind(body), "stream": bool(body.get("stream")),
+                                        "messages": len(body.get("input") or []), "chained": True, "status": 400})
+        if lost:
+            self.send_json(400, {"error": {"message": f"Previous response with id '{previous}' not found.",
+                                           "type": "invalid_request_error", "param": "previous_response_id",
+                                           "code": "previous_response_not_found"}})
+            return
+        # the input of a chained request follows the conversation held by the previous response
+        messages = body.get("input") or []
+        if isinstance(messages, str):
+            messages = [{"role": "user", "content": messages}]
+        conversation = held + messages
+        small = is_small_model(body.get("model"))
+        speed = config.small_speedup if small else 1.0
+        with server.lock:
+            unsure = small and config.random.random() < config.small_unsure_rate
+        call = tool_call(body)
+        text = reply_text(body, config, unsure) if call is None else ""
+        input_tokens = (len(raw) + len(json.dumps(held))) // 4
+        output_tokens = max(len(text if call is None else call[1]) // 4, 1)
+        with server.lock:
+            draw = config.random.random()
+            slow = config.random.random() < config.slow_rate
+            limited = draw < config.rate_limit_rate or not server.admit(input_tokens + output_tokens)
+            server.requests.append({"time": time.time(), "bytes": len(raw), "model": body.get("model"),
+                                    "kind": request_kind(body),
+                                    "stream": bool(body.get("stream")), "messages": len(body.get("input") or []),
+                                    "chained": bool(previous),
+                                    "status": 429 if limited else 500 if draw < config.rate_limit_rate + config.error_rate else 200})
+            headers = server.rate_limit_headers()
+            cached_tokens = 0 if limited else min(server.cached_tokens(dict(body, input=conversation)), input_tokens)
+        if limited:
+            self.send_json(429, {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                           dict(headers, **{"retry-after-ms": "100"}))
+            return
+        if draw < config.rate_limit_rate + config.error_rate:
+            self.send_json(500, {"error": {"message": "The server had an error", "type": "server_error", "code": None}})
+            return
+
+        response_id = f"resp_{server.next_id()}"
+        if call is None:
+            output = {"type": "message", "id": "msg_" + response_id, "role": "assistant", "status": "completed",
+                      "content": [{"type": "output_text", "text": text, "annotations": []}]}
+            held_output = {"role": "assistant", "content": text}
+        else:
+            held_output = {"type": "function_call", "call_id": "call_" + response_id, "name": call[0],
+                           "arguments": call[1]}
+            output = dict(held_output, id="fc_" + response_id, status="completed")
+        if body.get("store", True):
+            server.keep(response_id, conversation + [held_output])
+        response = {"id": response_id, "object": "response", "created_at": int(time.time()), "model": body.get("model"),
+                    "status": "completed", "parallel_tool_calls": True, "tool_choice": "auto", "tools": [],
+                    "output": [output],
+                    "usage": {"input_tokens": input_tokens, "input_tokens_details": {"cached_tokens": cached_tokens},
+                              "output_tokens": output_tokens, "output_tokens_details": {"reasoning_tokens": 0},
+                              "total_tokens": input_tokens + output_tokens}}
+        time.sleep(config.latency / speed + (config.slow_latency if slow else 0))
+        if not body.get("stream"):
+            time.sleep(output_tokens / (config.token_rate * speed))
+            self.send_json(200, response, headers)
+            return
+
+        self.send_response(200)
+        self.send_header("content-type", "text/event-stream")
+        self.send_header("transfer-encoding", "chunked")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        sequence = 0
+
+        def event(payload):
+            nonlocal sequence
+            payload["sequence_number"] = sequence
+            sequence += 1
+            self.send_chunk(f"event: {payload['type']}\ndata: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+        event({"type": "response.created", "response": dict(response, status="in_progress", output=[], usage=None)})
+        for i in range(0, len(text), 4):
+            event({"type": "response.output_text.delta", "item_id": "msg_" + response_id, "output_index": 0,
+                   "content_index": 0, "delta": text[i:i + 4]})
+            time.sleep(1 / (config.token_rate * speed))
+        event({"type": "response.completed", "response": response})
+        self.send_chunk(b"")
+
+
+class MockResponsesServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        """
+        Initializes a local stand in for the Responses API, port 0 picks a free port.
+        """
+        super().__init__((host, port), MockHandler)
+        self.config = config if config is not None else MockConfig()
+        self.lock = threading.Lock()
+        self.requests = []
+        self.ids = 0
+        self.request_bucket = TokenBucket(self.config.rpm)
+        self.token_bucket = TokenBucket(self.config.tpm)
+        self.prefixes = OrderedDict()
+        self.responses = OrderedDict()
+
+    def keep(self, response_id, conversation):
+        """
+        Stores the conversation held by a response, for the requests continuing it.
+        """
+        with self.lock:
+            self.responses[response_id] = conversation
+            if len(self.responses) > MAX_RESPONSES:
+                self.responses.popitem(last=False)
+
+    def cached_tokens(self, body):
+        """
+        Returns the input tokens of the request found in the prompt cache, the longest prefix of whole messages
+        already seen in a request of the same model, and caches the prefixes of the request.
+        must be called with the lock held.
+        """
+        messages = body.get("input") or []
+        if isinstance(messages, str):
+            messages = [messages]
+        digest = hashlib.sha256(json.dumps([body.get("model"), body.get("instructions"), body.get("text")],
+                                           sort_keys=True).encode("utf-8"))
+        tokens = len(body.get("instructions") or "") // 4
+        cached = 0
+        for message in messages:
+            part = json.dumps(message, sort_keys=True)
+            digest.update(part.encode("utf-8"))
+            tokens += len(part) // 4
+            key = digest.hexdigest()
+            if key in self.prefixes:
+                self.prefixes.move_to_end(key)
+                cached = tokens
+            else:
+                self.prefixes[key] = True
+                if len(self.prefixes) > MAX_PREFIXES:
+                    self.prefixes.popitem(last=False)
+        return cached // CACHE_INCREMENT * CACHE_INCREMENT if cached >= CACHE_MIN_TOKENS else 0
+
+    def admit(self, tokens):
+        """
+        Takes a request and its tokens from the limits, returns False if the request is over a limit.
+        must be called with the lock held.
+        """
+        if self.request_bucket.wait_time(1) > 0 or self.token_bucket.wait_time(tokens) > 0:
+            return False
+        self.request_bucket.take(1)
+        self.token_bucket.take(tokens)
+        return True
+
+    def rate_limit_headers(self):
+        """
+        Returns the x-ratelimit-* headers of the current limits, none when there is no limit.
+        must be called with the lock held.
+        """
+        headers = {}
+        for bucket, name in ((self.request_bucket, "requests"), (self.token_bucket, "tokens")):
+            if bucket.capacity is None:
+                continue
+            headers[f"x-ratelimit-limit-{name}"] = str(int(bucket.capacity))
+            headers[f"x-ratelimit-remaining-{name}"] = str(max(int(bucket.level), 0))
+            headers[f"x-ratelimit-reset-{name}"] = f"{(bucket.capacity - bucket.level) / bucket.rate:.3f}s"
+        return headers
+
+    def next_id(self):
+        """
+        Returns a new response number.
+        """
+        with self.lock:
+            self.ids += 1
+            return self.ids
+
+    def handle_error(self, request, client_address):
+        """
+        Ignores the clients closing their keep alive connections.
+        """
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def base_url(self):
+        """
+        Returns the base url to give to the OpenAI client.
+        """
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/v1"
+
+    def start(self):
+        """
+        Serves the requests on a background thread.
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="local mock of the OpenAI Responses API")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds to the first token")
+    parser.add_argument("--token-rate", type=float, default=100.0, help="generated tokens per second")
+    parser.add_argument("--answer-tokens", type=int, default=120)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--rpm", type=int, help="requests per minute limit")
+    parser.add_argument("--tpm", type=int, help="tokens per minute limit")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of requests with a slow first token")
+    parser.add_argument("--slow-latency", type=float, default=2.0)
+    parser.add_argument("--small-unsure-rate", type=float, default=0.0,
+                        help="fraction of the mini and nano answers that are not sure")
+    parser.add_argument("--small-speedup", type=float, default=1.0, help="speed factor of the mini and nano models")
+    parser.add_argument("--chain-loss-rate", type=float, default=0.0,
+                        help="fraction of the previous_response_id requests failing as expired")
+    args = parser.parse_args()
+    config = MockConfig(args.latency, args.token_rate, args.answer_tokens, args.error_rate, args.rate_limit_rate,
+                        rpm=args.rpm, tpm=args.tpm, slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+                        small_unsure_rate=args.small_unsure_rate, small_speedup=args.small_speedup,
+                        chain_loss_rate=args.chain_loss_rate)
+    server = MockResponsesServer(config, port=args.port)
+    print(f"serving on {server.base_url}, set OPENAI_BASE_URL to use it")
+    server.serve_forever()
@@ -0,0 +1,101 @@
+import re
+import threading
+from Metrics import percentile
+from StructuredAnswer import ANSWERED, CallFailedError
+
+DEFAULT_TIERS = ("gpt-4.1-mini", "gpt-4.1")
+MIN_ANSWER_CHARS = 40
+UNSURE_RE = re.compile(r"\b(?:i'?m not sure|i am not sure|not certain|i don'?t know|i do not know|unclear|"
+                       r"can(?:not|'t) (?:determine|confirm|tell)|may or may not)\b", re.IGNORECASE)
+
+
+class ModelCascade:
+    def __init__(self, tiers=DEFAULT_TIERS, race=False, min_answer_chars=MIN_ANSWER_CHARS):
+        """
+        Initializes the cascade of models a question is sent to, from the fastest and cheapest to the largest.
+        a response is escalated to the next tier when the call failed, it doesn't follow the response structure,
+        its code isn't 1 (answered) or its answer looks unsure (too short or hedging).
+        race sends the question to the first and last tiers at once, the slower one is cancelled, or left running
+        by the threaded bot, when the other one answers.
+        """
+        self.tiers = tuple(tiers)
+        self.race = race
+        self.min_answer_chars = min_answer_chars
+        self.latencies = {model: [] for model in self.tiers}
+        self.escalations = {model: 0 for model in self.tiers}
+        self.reasons = {}
+        self.cancelled = 0
+        self.abandoned = 0
+        self.lock = threading.Lock()
+
+    @property
+    def first(self):
+        """
+        Returns the fastest tier, also used for the classification.
+        """
+        return self.tiers[0]
+
+    def escalation_reason(self, result, response):
+        """
+        Returns why the Answer of a response should be escalated to the next tier, None if it is accepted.
+        """
+        if isinstance(result.error, CallFailedError):
+            return "error"
+        if result.error is not None:
+            return "parse"
+        if result.code != ANSWERED:
+            return "code"
+        answer = result.answer
+        if len(answer) < self.min_answer_chars:
+            return "short"
+        if UNSURE_RE.search(answer):
+            return "unsure"
+        return None
+
+    def record(self, model, seconds, reason=None):
+        """
+        Records the latency of a tier and whether its response was escalated.
+        """
+        with self.lock:
+            self.latencies.setdefault(model, []).append(seconds)
+            if reason is not None:
+                self.escalations[model] = self.escalations.get(model, 0) + 1
+                self.reasons[reason] = self.reasons.get(reason, 0) + 1
+
+    def record_loser(self, cancelled=True):
+        """
+        Counts a raced call that lost the race, cancelled or, when it can't be interrupted, left running.
+        """
+        with self.lock:
+            if cancelled:
+                self.cancelled += 1
+            else:
+                self.abandoned += 1
+
+    def stats(self):
+        """
+        Returns the calls, latency and escalation rate of every tier.
+        """
+        with self.lock:
+            tiers = {}
+            for model in self.tiers:
+                latencies = self.latencies.get(model, [])
+                tiers[model] = {"calls": len(latencies), "p50": percentile(latencies, 0.5),
+                                "p95": percentile(latencies, 0.95), "escalations": self.escalations.get(model, 0),
+                                "escalation_rate": self.escalations.get(model, 0) / len(latencies) if latencies else 0}
+            return {"tiers": tiers, "reasons": dict(self.reasons), "cancelled": self.cancelled,
+                    "abandoned": self.abandoned}
+
+    def summary(self):
+        """
+        Returns the per tier stats as text.
+        """
+        stats = self.stats()
+        lines = []
+        for model, tier in stats["tiers"].items():
+            lines.append(f"{model:14} calls {tier['calls']:4}  p50 {tier['p50']:.3f} s  p95 {tier['p95']:.3f} s  "
+                         f"escalated {tier['escalation_rate']:.0%}")
+        reasons = ", ".join(f"{reason} {count}" for reason, count in sorted(stats["reasons"].items()))
+        lines.append(f"escalation reasons: {reasons or 'none'}, raced calls cancelled: {stats['cancelled']}, "
+                     f"left running: {stats['abandoned']}")
+        return "\n".join(lines)
@@ -1,50 +1,520 @@
-from openai import OpenAI
+import contextvars
+import threading
+import time
+from collections import Counter
 import SystemMsg
+from CallPolicy import CallPolicy, PrimedStream, TRANSIENT_ERRORS
+from ResponseCache import request_key
+from ConversationHistory import ConversationHistory, message_key
+from ContextIndex import estimate_tokens
+from DocTools import tool_calls
+from Metrics import Metrics
+from RateLimiter import INTERACTIVE, KIND_PRIORITY, estimate_request
+from StructuredAnswer import ANSWER_FORMAT, ERROR_PREFIX, AnswerError, parse_answer
+from Startup import PROFILE, WARM_UP_TIMEOUT, keepalive_limits, sdk, sdk_errors
+
+SUMMARY_INSTRUCTIONS = """
+summarize the conversation between a user and the DPDK bot given in the <conversation> xml tag,
+merging it with the previous summary given in the <summary> xml tag if there is one.
+keep the DPDK APIs, testpmd commands, parameters, values and decisions that were discussed.
+reply with the summary only, in less than 200 words.
+"""
+# the openai errors of a request continuing a response the API doesn't hold anymore, and their error code
+CHAIN_ERRORS = ("BadRequestError", "NotFoundError")
+CHAIN_LOST_CODE = "previous_response_not_found"
+# the metrics record of the last query of each thread and asyncio task, for the parse time of its response
+QUERY_RECORD = contextvars.ContextVar("query_record", default=None)
 
 
 class OpenAIClient:
-    def __init__(self):
+    def __init__(self, cache=None, history=None, summary_model="gpt-4.1-mini", client=None, metrics=None,
+                 limiter=None, policy=None, stateful=False, tools=None):
+        """
+        Initializes the OpenAIClient with the API key from the environment, the OpenAI client is created on its first
+        use (see Startup.WarmUp).
+        cache is an optional ResponseCache used to answer repeated requests without calling the API.
+        history is the ConversationHistory holding the messages, by default old turns are summarized with summary_model.
+        client is an already created OpenAI client to use instead of a new one.
+        metrics records the latency breakdown and the token usage of every call.
+        limiter is an optional RateLimiter, possibly shared with other clients, the calls wait for its budgets.
+        policy is the CallPolicy of the calls deadlines, hedging, retries and circuit breaker, possibly shared with
+        other clients. it replaces the retries of the OpenAI client.
+        stateful chains the answers with previous_response_id, so only the messages the API doesn't hold yet are sent.
+        the history then folds keep_turns turns at a time, each summary starts a new chain.
+        tools is an optional DocTools the model calls while answering to look up the documentation it needs, the
+        calls are run in process and their output sent back, for at most tools.max_rounds rounds.
+        """
+        self._client = client.with_options(max_retries=0) if client is not None else None
+        self.client_lock = threading.Lock()
+        self.cache = cache
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.limiter = limiter
+        self.policy = policy if policy is not None else CallPolicy()
+        self.summary_model = summary_model
+        self.history = history if history is not None else ConversationHistory(summarizer=self.summarize)
+        self.stateful = stateful
+        if stateful:
+            self.history.fold_turns = max(self.history.fold_turns, self.history.keep_turns)
+        self.tools = tools
+        # (response id, keys of the messages it holds) of the last answer, and of the answers not added yet
+        self.chain = None
+        self.pending = {}
+
+    @property
+    def client(self):
+        """
+        Returns the OpenAI client, creating it on the first use.
+        """
+        if self._client is None:
+            with self.client_lock:
+                if self._client is None:
+                    sdk()
+                    with PROFILE.timed("create client"):
+                        self._client = self.make_client().with_options(max_retries=0)
+        return self._client
+
+    def make_client(self):
+        """
+        Returns a new OpenAI client keeping its idle connections open between the questions.
+        """
+        openai = sdk()
+        return openai.OpenAI(http_client=openai.DefaultHttpxClient(limits=keepalive_limits()))
+
+    def warm_up(self):
+        """
+        Opens a connection to the API, or keeps the idle one open, with a request that costs no tokens.
+        """
+        client = self.client.with_options(timeout=WARM_UP_TIMEOUT)
+        with PROFILE.timed("connect"):
+            client.models.list()
+
+    @property
+    def messages(self):
         """
-        Initializes the OpenAIClient with the API key from the environment and creates the OpenAI client.
+        Returns the messages to send, as built by the conversation history.
         """
-        self.client = OpenAI()
-        self.messages = []
+        return self.history.build(estimate_tokens(SystemMsg.system_message))
+
+    def add_context(self, key, text):
+        """
+        Adds a context section, it is sent only once per session.
+        """
+        return self.history.add_context(key, text)
 
     def add_user_message(self, message):
         """
         Adds a user message to the list of messages.
         """
-        self.messages.append({"role": "user", "content": message})
+        self.history.add_message("user", message)
 
     def add_assistant_message(self, message):
         """
-        Adds an assistant message to the list of messages.
+        Adds an assistant message to the list of messages, the next answer continues its response in stateful mode.
         """
-        self.messages.append({"role": "assistant", "content": message})
+        self.history.add_message("assistant", message)
+        chain = self.pending.get(message)
+        self.pending.clear()
+        if chain is not None:
+            self.chain = chain
+
+    def chain_input(self, kind, messages):
+        """
+        Returns the input of a call, the id of the response it continues or None and the keys of the messages the
+        response of the call will hold, None outside of the stateful mode.
+        the last response is continued as long as the history still holds all its messages, only the new messages
+        are sent. once the history was summarized or trimmed the whole messages are sent again.
+        """
+        if not self.stateful or kind != "answer":
+            return messages, None, None
+        keys = [message_key(m) for m in messages]
+        if self.chain is not None:
+            previous, held = self.chain
+            remaining = Counter(held)
+            if not remaining - Counter(keys):
+                delta = []
+                for key, message in zip(keys, messages):
+                    if remaining[key]:
+                        remaining[key] -= 1
+                    else:
+                        delta.append(message)
+                if delta:
+                    return delta, previous, held + [message_key(m) for m in delta]
+        return messages, None, keys
+
+    def extend_chain(self, response_id, sent, text):
+        """
+        Keeps the response of a stateful call, it is continued once its text is added to the messages.
+        """
+        if sent is not None and response_id:
+            self.pending[text] = (response_id, sent + [message_key({"role": "assistant", "content": text})])
 
     def add_developer_message(self, message):
         """
         Adds an developer message to the list of messages.
         """
-        self.messages.append({"role": "developer", "content": message})
+        self.history.add_message("developer", message)
+
+    def summarize(self, summary, turns):
+        """
+        Returns a summary of the given turns merged with the previous summary, using the summary model.
+        """
+        record, params = self.summary_request(summary, turns)
+        return self.end_summary(record, self._create(record, None, **params))
+
+    def summary_request(self, summary, turns):
+        """
+        Returns the metrics record and the parameters of the call summarizing the turns.
+        """
+        record = self.metrics.begin("summary", self.summary_model)
+        conversation = "\n".join(f"{m['role']}: {m['content']}" for turn in turns for m in turn)
+        record.mark("build")
+        return record, dict(
+        model = self.summary_model,
+        temperature = 0,
+        instructions = SUMMARY_INSTRUCTIONS,
+        input = f"<summary>{summary}</summary>\n<conversation>{conversation}</conversation>"
+        )
+
+    def end_summary(self, record, response):
+        """
+        Records the usage of the summary call and returns the summary.
+        """
+        record.mark("first_byte")
+        record.usage(response.usage)
+        self.settle(record)
+        self.metrics.end(record)
+        return response.output_text
+
+    def _create(self, record, priority=None, deadline=None, **params):
+        """
+        Returns the result of a responses.create call, the first event of a stream is read before it is returned.
+        the call is sent once the rate limiter has the budget for it, hedged when it is slower than usual and sent
+        again after a transient error or a rate limit, until deadline seconds (by default the CallPolicy one) passed.
+        priority is the RateLimiter priority, by default it depends on the kind of the record.
+        """
+        policy = self.policy
+        deadline_at, key, priority, tokens = self.begin_call(record, priority, deadline, params)
+        stream = bool(params.get("stream"))
+
+        def send():
+            timeout = max(deadline_at - time.monotonic(), 0.001)
+            if self.limiter is None:
+                response = self.client.responses.create(timeout=timeout, **params)
+            else:
+                raw = self.client.responses.with_raw_response.create(timeout=timeout, **params)
+                self.limiter.update(raw.headers)
+                response = raw.parse()
+            return PrimedStream(response, next(response, None)) if stream else response
+
+        for attempt in range(policy.attempts):
+            policy.breaker.check()
+            try:
+                if self.limiter is not None:
+                    self.limiter.acquire(tokens, priority)
+                record.mark("queue")
+                start = time.monotonic()
+                response = policy.run(key, send, deadline_at, lambda: self.can_hedge(tokens),
+                                      PrimedStream.close if stream else None)
+            except Exception as e:
+                wait = self.retry_delay(record, attempt, deadline_at, e)
+            except BaseException:
+                policy.breaker.release()
+                raise
+            else:
+                self.call_done(key, start)
+                return response
+            time.sleep(wait)
+            record.mark("retry")
+
+    def begin_call(self, record, priority, deadline, params):
+        """
+        Returns the time the call must complete by, its CallPolicy key, its RateLimiter priority and its estimated
+        tokens, which are added to the record when the calls are rate limited.
+        """
+        deadline_at = time.monotonic() + (deadline if deadline is not None else self.policy.deadline)
+        key = (params["model"], record.data["kind"], bool(params.get("stream")))
+        if priority is None:
+            priority = KIND_PRIORITY.get(record.data["kind"], INTERACTIVE)
+        tokens = estimate_request(params.get("instructions"), params["input"])
+        if self.limiter is not None:
+            record.data["estimated_tokens"] = record.data.get("estimated_tokens", 0) + tokens
+        return deadline_at, key, priority, tokens
+
+    def can_hedge(self, tokens):
+        """
+        Returns True if a hedged call can be sent, taking its tokens from the rate limiter budget.
+        """
+        return self.limiter is None or self.limiter.try_acquire(tokens)
+
+    def call_done(self, key, start):
+        """
+        Records a successful call started at start.
+        """
+        self.policy.breaker.success()
+        self.policy.observe(key, time.monotonic() - start)
+
+    def retry_delay(self, record, attempt, deadline_at, error):
+        """
+        Records the failed attempt of a call and returns the seconds to wait before sending it again, raises the error
+        when it isn't a transient error or a rate limit, or when no attempt or time is left.
+        the circuit breaker counts an error answered by the API (a 4xx or a rate limit) as a success, the API is up,
+        and any other error as a failure.
+        """
+        policy = self.policy
+        rate_limited = isinstance(error, sdk_errors("RateLimitError"))
+        if isinstance(error, sdk_errors("APIStatusError")) and error.status_code < 500:
+            policy.breaker.success()
+        else:
+            policy.breaker.failure()
+        if rate_limited and self.limiter is not None:
+            self.limiter.pause(error.response.headers)
+        if not rate_limited and not isinstance(error, sdk_errors(*TRANSIENT_ERRORS)):
+            raise error
+        wait = 0 if rate_limited and self.limiter is not None else policy.backoff_delay(attempt)
+        if attempt + 1 == policy.attempts or time.monotonic() + wait >= deadline_at:
+            raise error
+        record.data["retries"] = attempt + 1
+        policy.retried()
+        # the failed attempt and the backoff are timed as the retry phase
+        record.mark("retry")
+        return wait
+
+    def _create_chained(self, record, priority, deadline, messages, **params):
+        """
+        Returns the result of _create for the messages and the keys of the messages its response holds.
+        in stateful mode the answer calls continue the last response, the whole messages are sent again when the
+        API lost it (expired or deleted).
+        """
+        input, previous, sent = self.chain_input(record.data["kind"], messages)
+        if previous is not None:
+            record.data["chained"] = True
+            try:
+                return self._create_with_tools(record, priority, deadline, input=input,
+                                               previous_response_id=previous, **params), sent
+            except sdk_errors(*CHAIN_ERRORS) as e:
+                if not self.chain_lost(e):
+                    raise
+                sent = self.lose_chain(record, messages)
+        return self._create_with_tools(record, priority, deadline, input=messages, **params), sent
 
-    def query(self, model="gpt-4.1"):
+    def chain_lost(self, error):
+        """
+        Returns True if the error of a chained request is the API not holding the response it continues.
+        """
+        return getattr(error, "code", None) == CHAIN_LOST_CODE
+
+    def lose_chain(self, record, messages):
+        """
+        Forgets the response the API lost, returns the keys of the messages sent again in its place.
+        """
+        record.data["chain_lost"] = True
+        self.chain = None
+        return [message_key(m) for m in messages]
+
+    def _create_with_tools(self, record, priority, deadline, **params):
+        """
+        Returns the result of _create, once the tools the model called were run and their output sent back.
+        a stream goes on with the stream of the next request after each tool round.
+        """
+        result = self._create(record, priority, deadline, **params)
+        if not params.get("tools"):
+            return result
+        if params.get("stream"):
+            return self._tool_stream(record, priority, deadline, params, result)
+        follow_up = self.tool_follow_up(record, params, result.output)
+        while follow_up is not None:
+            # the query records the usage and the wait of the last response only
+            record.usage(result.usage)
+            record.mark("first_byte")
+            params = follow_up
+            result = self._create(record, priority, deadline, **params)
+            follow_up = self.tool_follow_up(record, params, result.output)
+        return result
+
+    def _tool_stream(self, record, priority, deadline, params, stream):
+        """
+        Yields the events of the stream and of the streams of the requests sending the tool outputs back.
+        """
+        text = False
+        while True:
+            follow_up = None
+            for event in stream:
+                if event.type == "response.output_text.delta":
+                    text = True
+                elif event.type == "response.completed":
+                    follow_up = self.tool_follow_up(record, params, event.response.output)
+                yield event
+            if follow_up is None:
+                return
+            # the rounds before the first text are part of the wait for the first byte
+            record.mark("generation" if text else "first_byte")
+            params = follow_up
+            stream = self._create(record, priority, deadline, **params)
+
+    def tool_follow_up(self, record, params, output):
+        """
+        Runs the tools called in the output of a response and returns the parameters of the request sending their
+        output back, None when the model answered or no tool round is left.
+        """
+        calls = tool_calls(output)
+        if not calls or record.data.get("tool_rounds", 0) >= self.tools.max_rounds:
+            return None
+        return self.tools.follow_up(record, params, calls)
+
+    def settle(self, record):
+        """
+        Gives the actual token usage of a call to the rate limiter, in place of its estimate.
+        """
+        if self.limiter is not None and "estimated_tokens" in record.data:
+            self.limiter.settle(record.data["estimated_tokens"],
+                                record.data["input_tokens"] + record.data["output_tokens"])
+
+    def text_format(self, kind):
+        """
+        Returns the text parameter of a call of the given kind, the answers follow ANSWER_SCHEMA.
+        """
+        return {"text": ANSWER_FORMAT} if kind == "answer" else {}
+
+    def tool_params(self, kind):
+        """
+        Returns the tools parameter of a call of the given kind, only the answers can look up the documentation.
+        """
+        return {"tools": self.tools.definitions} if self.tools is not None and kind == "answer" else {}
+
+    def cache_key(self, model, messages, text=None):
+        """
+        Returns the cache key of the request, or None if caching is disabled.
+        """
+        if self.cache is None:
+            return None
+        return request_key(model, SystemMsg.system_message, messages, temperature=0, **(text or {}))
+
+    def query(self, model="gpt-4.1", use_cache=True, messages=None, kind="answer", priority=None, deadline=None):
         """
         Sends the messages to the OpenAI API and returns the result.
+        use_cache=False bypasses the response cache.
+        messages is a one off list of messages to send instead of the history.
+        kind tags the call in the metrics, without streaming the whole wait is recorded as first_byte.
+        the answer calls request the ANSWER_FORMAT structured response.
+        priority is the RateLimiter priority of the call, by default it depends on the kind.
+        deadline is the time limit of the call in seconds, by default the one of the CallPolicy.
         """
+        record, messages, params, key, cached = self.begin_query(model, messages, kind, use_cache)
+        if cached is not None:
+            return cached
         try:
-            response = self.client.responses.create(
-            model = model,
-            temperature = 0,
-            instructions = SystemMsg.system_message,
-            input = self.messages
-            )
-            return response.output_text
+            response, sent = self._create_chained(record, priority, deadline, messages, **params)
+            record.mark("first_byte")
+            record.usage(response.usage)
+            return self.end_query(record, key, response.id, sent, response.output_text)
         except Exception as e:
-            return f"An unexpected error occurred: {e}"
+            return self.failed_query(record, e, "first_byte")
+
+    def query_stream(self, model="gpt-4.1", on_delta=None, use_cache=True, messages=None, kind="answer",
+                     priority=None, deadline=None):
+        """
+        Sends the messages to the OpenAI API as a stream and returns the full result.
+        on_delta is called with every chunk of text as it arrives.
+        use_cache=False bypasses the response cache.
+        messages is a one off list of messages to send instead of the history.
+        kind tags the call in the metrics, the answer calls request the ANSWER_FORMAT structured response.
+        priority is the RateLimiter priority of the call, by default it depends on the kind.
+        deadline is the time limit of the call in seconds, by default the one of the CallPolicy.
+        """
+        record, messages, params, key, cached = self.begin_query(model, messages, kind, use_cache)
+        if cached is not None:
+            if on_delta:
+                on_delta(cached)
+            return cached
+        chunks = []
+        response_id = None
+        try:
+            stream, sent = self._create_chained(record, priority, deadline, messages, stream=True, **params)
+            for event in stream:
+                response_id = self.read_event(record, event, chunks, on_delta) or response_id
+            record.mark("generation" if chunks else "first_byte")
+            return self.end_query(record, key, response_id, sent, "".join(chunks))
+        except Exception as e:
+            return self.failed_query(record, e, "generation" if chunks else "first_byte")
+
+    def begin_query(self, model, messages, kind, use_cache):
+        """
+        Returns the metrics record, the messages, the parameters and the cache key of a query, and its cached
+        response or None. the record of a cached response is ended.
+        """
+        record = self.metrics.begin(kind, model)
+        QUERY_RECORD.set(record)
+        messages = self.messages if messages is None else messages
+        params = dict(self.text_format(kind), **self.tool_params(kind))
+        key = self.cache_key(model, messages, params) if use_cache else None
+        record.mark("build")
+        cached = self.cache.get(key) if key else None
+        if cached is not None:
+            record.data["cache_hit"] = True
+            record.mark("first_byte")
+            self.metrics.end(record)
+        return (record, messages, dict(params, model=model, temperature=0, instructions=SystemMsg.system_message),
+                key, cached)
+
+    def last_record(self):
+        """
+        Returns the metrics record of the last query made by the current thread or asyncio task, None if there is
+        none.
+        """
+        return QUERY_RECORD.get()
+
+    def read_event(self, record, event, chunks, on_delta):
+        """
+        Adds the text of a stream event to the chunks, returns the response id of the completed event.
+        """
+        if event.type == "response.output_text.delta":
+            if not chunks:
+                record.mark("first_byte")
+            chunks.append(event.delta)
+            if on_delta:
+                on_delta(event.delta)
+        elif event.type == "response.completed":
+            record.usage(event.response.usage)
+            return event.response.id
+        return None
+
+    def end_query(self, record, key, response_id, sent, text):
+        """
+        Ends the record of a query, caches its response and keeps it to be continued, returns the text.
+        an answer is cached only if it is valid, so asking again calls the API.
+        """
+        self.settle(record)
+        self.metrics.end(record)
+        if key and self.cacheable(record.data["kind"], text):
+            self.cache.put(key, text)
+        self.extend_chain(response_id, sent, text)
+        return text
+
+    def cacheable(self, kind, text):
+        """
+        Returns True if the response of a call of the given kind can be cached, the answers must follow ANSWER_SCHEMA.
+        """
+        if kind != "answer":
+            return True
+        try:
+            parse_answer(text)
+        except AnswerError:
+            return False
+        return True
+
+    def failed_query(self, record, error, phase):
+        """
+        Ends the record of a failed query, returns the error message given in place of the response.
+        """
+        record.data["error"] = True
+        record.mark(phase)
+        self.metrics.end(record)
+        return f"{ERROR_PREFIX}{error}"
     
     def clear_messages(self):
         """
-        Clears the list of messages.
+        Clears the list of messages, the next answer starts a new chain of responses.
         """
-        self.messages = []
\ No newline at end of file
+        self.history.clear()
+        self.chain = None
+        self.pending.clear()
\ No newline at end of file
@@ -0,0 +1,206 @@
+import hashlib
+import random
+import re
+import threading
+from collections import OrderedDict
+from ContextIndex import tokenize
+
+DEFAULT_THRESHOLD = 1.0
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+SIGNATURE_SIZE = 64
+BANDS = 16
+# 2 ** 61 - 1, the modulus of the MinHash permutations
+PRIME = (1 << 61) - 1
+# words changing the phrasing of a question but not what it asks
+FILLER_WORDS = frozenset("""
+please explain tell show step steps way ways procedure possible need want know
+""".split())
+# the words setting what a question asks, dropped from the terms as stop words
+QUESTION_WORDS = ("how", "what", "why", "when", "where", "which", "who")
+# a negated question asks the opposite, its terms get NEGATION
+NEGATION_RE = re.compile(r"\b(?:not|no|never|without|cannot|\w+n't)\b")
+NEGATION = "not"
+# suffix, replacement: create, creates, created, creating and creation all give creat
+SUFFIXES = (("ations", "at"), ("ation", "at"), ("ings", ""), ("ing", ""), ("ed", ""), ("es", ""), ("s", ""), ("e", ""))
+MIN_STEM = 3
+
+
+def stem(word):
+    """
+    Returns the word without its inflection suffix, a crude stemmer good enough to match rephrased questions.
+    """
+    if not word.isalpha() or word.endswith("ss"):
+        return word
+    for suffix, replacement in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM:
+            return word[:-len(suffix)] + replacement
+    return word
+
+
+def question_terms(question):
+    """
+    Returns the normalized terms of a question: the stems of its lower case index terms, without the stop and
+    filler words, and NEGATION if the question is negated.
+    """
+    terms = {stem(term) for term in tokenize(question) if term not in FILLER_WORDS}
+    if NEGATION_RE.search(question.lower().replace("\u2019", "'")):
+        terms.add(NEGATION)
+    return frozenset(terms)
+
+
+def question_word(question):
+    """
+    Returns the first of the QUESTION_WORDS found in a question, or None.
+    """
+    for word in re.findall(r"[a-z]+", question.lower()):
+        if word in QUESTION_WORDS:
+            return word
+    return None
+
+
+def exact_terms(terms):
+    """
+    Returns the terms that must match for two questions to be duplicates: identifiers and numbers.
+    """
+    return frozenset(term for term in terms if "_" in term or not term.isalpha())
+
+
+def jaccard(a, b):
+    """
+    Returns the Jaccard similarity of two sets.
+    """
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class MinHasher:
+    def __init__(self, size=SIGNATURE_SIZE, seed=1):
+        """
+        Initializes size random hash permutations, the same seed gives the same signatures.
+        """
+        rng = random.Random(seed)
+        self.permutations = [(rng.randrange(1, PRIME), rng.randrange(PRIME)) for _ in range(size)]
+
+    def signature(self, terms):
+        """
+        Returns the MinHash signature of a set of terms, the fraction of equal values of two signatures estimates
+        the Jaccard similarity of their sets.
+        """
+        hashes = [int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+                  for term in terms]
+        return tuple(min((a * h + b) % PRIME for h in hashes) for a, b in self.permutations)
+
+
+class QuestionCache:
+    def __init__(self, threshold=DEFAULT_THRESHOLD, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES,
+                 bands=BANDS, hasher=None):
+        """
+        Initializes the in memory cache of the answers to the first question of a session, shared by the sessions.
+        a question is answered from the cache when an earlier question with the same context version has a
+        Jaccard similarity of at least threshold over the normalized terms, with the same identifiers, numbers and
+        negation, and the same question word when both have one. by default all the terms must match, a single
+        different word such as async instead of sync changes the question.
+        the candidates are found with a MinHash LSH index of bands bands.
+        the least recently used answers are evicted above max_entries or max_bytes.
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hasher = hasher if hasher is not None else MinHasher()
+        self.rows = len(self.hasher.permutations) // bands
+        self.bands = bands
+        # (version, terms, question word) -> (terms, signature, response)
+        self.entries = OrderedDict()
+        self.buckets = {}
+        self.size = 0
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def band_keys(self, version, signature):
+        """
+        Returns the LSH bucket keys of a signature.
+        """
+        return [(version, band, signature[band * self.rows:(band + 1) * self.rows]) for band in range(self.bands)]
+
+    def get(self, question, version):
+        """
+        Returns the cached response of a near duplicate of the question, or None.
+        """
+        terms = question_terms(question)
+        if not terms:
+            return None
+        word = question_word(question)
+        key = (version, terms, word)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+        signature = self.hasher.signature(terms)
+        exact = exact_terms(terms)
+        with self.lock:
+            candidates = set()
+            for band_key in self.band_keys(version, signature):
+                candidates.update(self.buckets.get(band_key, ()))
+            best, best_score = None, self.threshold
+            for candidate in candidates:
+                other, other_word = candidate[1], candidate[2]
+                if exact_terms(other) != exact or (NEGATION in other) != (NEGATION in terms):
+                    continue
+                if word is not None and other_word is not None and word != other_word:
+                    continue
+                score = jaccard(terms, other)
+                if score >= best_score:
+                    best, best_score = candidate, score
+            if best is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(best)
+            self.hits += 1
+            self.near_hits += 1
+            return self.entries[best][2]
+
+    def put(self, question, version, response):
+        """
+        Stores the response to a question, evicting the least recently used answers if needed.
+        """
+        terms = question_terms(question)
+        if not terms:
+            return
+        key = (version, terms, question_word(question))
+        signature = self.hasher.signature(terms)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (terms, signature, response)
+            self.size += len(response)
+            for band_key in self.band_keys(version, signature):
+                self.buckets.setdefault(band_key, set()).add(key)
+            while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        """
+        Removes an entry and its LSH buckets.
+        must be called with the lock held.
+        """
+        _, signature, response = self.entries.pop(key)
+        self.size -= len(response)
+        for band_key in self.band_keys(key[0], signature):
+            bucket = self.buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self.buckets[band_key]
+
+    def stats(self):
+        """
+        Returns the entries, size and hit counters of the cache.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries), "bytes": self.size, "hits": self.hits, "near_hits": self.near_hits,
+                    "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0}
@@ -0,0 +1,243 @@
+import heapq
+import itertools
+import re
+import threading
+import time
+from ContextIndex import estimate_tokens
+
+# the lower the number the sooner the request is sent
+INTERACTIVE = 0
+BACKGROUND = 1
+BATCH = 2
+KIND_PRIORITY = {"summary": BACKGROUND}
+DEFAULT_OUTPUT_TOKENS = 600
+MESSAGE_OVERHEAD_TOKENS = 4
+ASYNC_POLL = 0.05
+DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(text):
+    """
+    Returns the seconds of a rate limit reset duration, e.g. "1s", "6m0s" or "120ms".
+    """
+    return sum(float(value) * DURATION_UNITS[unit] for value, unit in DURATION_RE.findall(text or ""))
+
+
+def estimate_request(instructions, messages, output_tokens=DEFAULT_OUTPUT_TOKENS):
+    """
+    Returns the estimated tokens counted against the tokens per minute limit by a request.
+    """
+    if isinstance(messages, str):
+        messages = [{"content": messages}]
+    tokens = estimate_tokens(instructions or "") + output_tokens
+    for message in messages:
+        tokens += estimate_tokens(str(message.get("content", ""))) + MESSAGE_OVERHEAD_TOKENS
+    return tokens
+
+
+class TokenBucket:
+    def __init__(self, per_minute=None):
+        """
+        Initializes a bucket refilled at per_minute units per minute, up to per_minute units.
+        a bucket without a limit never waits until the limit is learned from the response headers.
+        """
+        self.capacity = None
+        self.rate = None
+        self.level = 0.0
+        self.updated = time.monotonic()
+        if per_minute:
+            self.set_limit(per_minute)
+            self.level = self.capacity
+
+    def set_limit(self, per_minute):
+        """
+        Sets the limit of the bucket, keeping its current level.
+        """
+        self.refill()
+        if self.capacity is None:
+            self.level = float(per_minute)
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = min(self.level, self.capacity)
+
+    def refill(self):
+        """
+        Adds the units accumulated since the last refill.
+        """
+        now = time.monotonic()
+        if self.capacity is not None:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """
+        Returns the seconds to wait before amount units are available, requests larger than the bucket wait
+        for a full bucket.
+        """
+        if self.capacity is None:
+            return 0.0
+        self.refill()
+        missing = min(amount, self.capacity) - self.level
+        return max(missing / self.rate, 0.0)
+
+    def take(self, amount):
+        """
+        Takes amount units, the level can go below 0 when the estimate was too low and a negative amount gives
+        back the units that were over estimated.
+        """
+        if self.capacity is not None:
+            self.level -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    def __init__(self, rpm=None, tpm=None):
+        """
+        Initializes the scheduler of the requests sent to the API.
+        rpm and tpm are the requests and tokens per minute budgets, they are adjusted from the x-ratelimit-*
+        headers of every response, so they can be left unset.
+        the waiting requests are sent by priority (INTERACTIVE, BACKGROUND, BATCH) and in order within a priority.
+        """
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.rate_limited = 0
+
+    def _poll(self, ticket):
+        """
+        Returns 0 if the ticket was admitted, or the seconds to wait before polling again.
+        must be called with the lock held.
+        """
+        if self.waiting[0] is not ticket:
+            return None
+        wait = max(self.paused_until - time.monotonic(), self.requests.wait_time(1), self.tokens.wait_time(ticket[2]))
+        if wait > 0:
+            return wait
+        heapq.heappop(self.waiting)
+        self.requests.take(1)
+        self.tokens.take(ticket[2])
+        self.condition.notify_all()
+        return 0
+
+    def _cancel(self, ticket):
+        """
+        Removes a ticket which is not waiting anymore.
+        """
+        with self.lock:
+            if ticket in self.waiting:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+
+    def _ticket(self, tokens, priority):
+        """
+        Returns a new ticket queued for the given tokens.
+        """
+        ticket = (priority, next(self.sequence), tokens)
+        with self.lock:
+            heapq.heappush(self.waiting, ticket)
+        return ticket
+
+    def acquire(self, tokens, priority=INTERACTIVE):
+        """
+        Waits until a request of the given estimated tokens can be sent, returns the seconds waited.
+        """
+        start = time.monotonic()
+        ticket = self._ticket(tokens, priority)
+        try:
+            with self.lock:
+                while True:
+                    wait = self._poll(ticket)
+                    if wait == 0:
+                        return time.monotonic() - start
+                    self.condition.wait(wait)
+        except BaseException:
+            self._cancel(ticket)
+            raise
+
+    async def acquire_async(self, tokens, priority=INTERACTIVE):
+        """
+        Waits until a request of the given estimated tokens can be sent without blocking the event loop,
+        returns the seconds waited.
+        """
+        import asyncio
+        start = time.monotonic()
+        ticket = self._ticket(tokens, priority)
+        try:
+            while True:
+                with self.lock:
+                    wait = self._poll(ticket)
+                if wait == 0:
+                    return time.monotonic() - start
+                await asyncio.sleep(ASYNC_POLL if wait is None else min(wait, ASYNC_POLL * 10))
+        except BaseException:
+            self._cancel(ticket)
+            raise
+
+    def try_acquire(self, tokens):
+        """
+        Takes the budget of a request if it is available right away and nothing is waiting, returns True if it did.
+        """
+        with self.lock:
+            if self.waiting or time.monotonic() < self.paused_until:
+                return False
+            if self.requests.wait_time(1) > 0 or self.tokens.wait_time(tokens) > 0:
+                return False
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            return True
+
+    def settle(self, estimated, used):
+        """
+        Corrects the tokens bucket with the actual usage of a request.
+        """
+        with self.lock:
+            self.tokens.take(used - estimated)
+
+    def update(self, headers):
+        """
+        Adjusts the budgets from the x-ratelimit-* response headers.
+        the server side remaining counts are trusted when they are lower than the local ones.
+        """
+        with self.lock:
+            for bucket, name in ((self.requests, "requests"), (self.tokens, "tokens")):
+                limit = headers.get(f"x-ratelimit-limit-{name}")
+                if not limit:
+                    continue
+                bucket.set_limit(float(limit))
+                remaining = headers.get(f"x-ratelimit-remaining-{name}")
+                if remaining is not None:
+                    bucket.level = min(bucket.level, float(remaining))
+            self.condition.notify_all()
+
+    def pause(self, headers):
+        """
+        Stops sending requests after a 429, for the retry-after time of the response or until the limit resets.
+        """
+        retry_after = headers.get("retry-after-ms")
+        if retry_after:
+            seconds = float(retry_after) / 1000
+        elif headers.get("retry-after"):
+            seconds = float(headers["retry-after"])
+        else:
+            seconds = max(parse_duration(headers.get("x-ratelimit-reset-requests")),
+                          parse_duration(headers.get("x-ratelimit-reset-tokens")), 1.0)
+        self.update(headers)
+        with self.lock:
+            self.rate_limited += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def stats(self):
+        """
+        Returns the current budgets and queue of the scheduler.
+        """
+        with self.lock:
+            self.requests.refill()
+            self.tokens.refill()
+            return {"rpm": self.requests.capacity, "tpm": self.tokens.capacity,
+                    "requests_available": self.requests.level, "tokens_available": self.tokens.level,
+                    "waiting": len(self.waiting), "rate_limited": self.rate_limited}
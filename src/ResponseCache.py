@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "dpdkbot", "responses.db")
+
+
+def request_key(model, instructions, messages, **params):
+    """
+    Returns a stable hash of the full request.
+    """
+    request = {"model": model, "instructions": instructions, "input": messages, "params": params}
+    blob = json.dumps(request, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path=DEFAULT_PATH, max_entries=10000, max_bytes=64 * 1024 * 1024, ttl=7 * 24 * 3600):
+        """
+        Initializes the on disk cache of responses.
+        entries older than ttl seconds expire, and the least recently used entries are evicted
+        once the cache holds more than max_entries or max_bytes.
+        """
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                               key TEXT PRIMARY KEY,
+                               value TEXT NOT NULL,
+                               size INTEGER NOT NULL,
+                               created REAL NOT NULL,
+                               accessed REAL NOT NULL)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+
+    def get(self, key):
+        """
+        Returns the cached response for the key or None.
+        """
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            self.db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, value):
+        """
+        Stores the response for the key and evicts old entries if needed.
+        """
+        now = time.time()
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                            (key, value, len(value.encode("utf-8")), now, now))
+            self._evict(now)
+
+    def _evict(self, now):
+        """
+        Removes the expired entries and the least recently used ones above the size limits.
+        """
+        self.db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        count, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if count <= self.max_entries and size <= self.max_bytes:
+            return
+        for key, entry_size in self.db.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            if count <= self.max_entries and size <= self.max_bytes:
+                break
+            self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            count -= 1
+            size -= entry_size
+
+    def clear(self):
+        """
+        Removes all the cached responses.
+        """
+        with self.lock:
+            self.db.execute("DELETE FROM responses")
+
+    def stats(self):
+        """
+        Returns the cache counters.
+        """
+        with self.lock:
+            count, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": count, "bytes": size}
@@ -0,0 +1,374 @@
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import weakref
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "dpdkbot", "sessions.db")
+# the writes queued while the previous batch is committed are committed together, waiting at most COMMIT_DELAY
+# seconds for more of them
+COMMIT_DELAY = 0.01
+MAX_BATCH = 256
+# a batch that failed to commit is retried COMMIT_ATTEMPTS times in all, waiting RETRY_DELAY seconds more each time
+COMMIT_ATTEMPTS = 3
+RETRY_DELAY = 0.5
+# the sessions not used for DEFAULT_MAX_AGE seconds are deleted by the compaction, run at most every
+# COMPACT_INTERVAL seconds when the store is opened
+DEFAULT_MAX_AGE = 30 * 24 * 3600
+COMPACT_INTERVAL = 24 * 3600
+
+
+def new_session_id():
+    """
+    Returns a new session id, readable enough to be typed after --resume.
+    """
+    return time.strftime("%Y%m%d-%H%M%S") + "-" + secrets.token_hex(2)
+
+
+class SessionStore:
+    def __init__(self, path=DEFAULT_PATH, commit_delay=COMMIT_DELAY, max_batch=MAX_BATCH, max_age=DEFAULT_MAX_AGE,
+                 compact_interval=COMPACT_INTERVAL):
+        """
+        Initializes the on disk store of the chat sessions, a SQLite database in WAL mode.
+        the sessions are written by a background thread so the chat never waits for the disk: the writes queued
+        while a batch is committed are committed together in a single transaction (group commit).
+        every session holds its label, turn number and summary, its messages are appended as the turns complete
+        and its context sections refer to texts stored once for all the sessions.
+        a batch that can't be committed is retried, then dropped: the next write of its sessions writes their whole
+        state again (see SessionLog.save).
+        the sessions older than max_age seconds and the messages the sessions dropped are deleted by the compaction,
+        run in the background at most every compact_interval seconds.
+        """
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.commit_delay = commit_delay
+        self.max_batch = max_batch
+        self.max_age = max_age
+        self.compact_interval = compact_interval
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                label TEXT,
+                turn INTEGER NOT NULL,
+                summary TEXT NOT NULL,
+                first_live INTEGER NOT NULL,
+                created REAL NOT NULL,
+                updated REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS sessions_updated ON sessions(updated);
+            CREATE TABLE IF NOT EXISTS messages (
+                session TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                PRIMARY KEY (session, seq)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS contexts (
+                session TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                key TEXT NOT NULL,
+                digest BLOB NOT NULL,
+                PRIMARY KEY (session, position)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS texts (
+                digest BLOB PRIMARY KEY,
+                text TEXT NOT NULL) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (
+                name TEXT PRIMARY KEY,
+                value REAL NOT NULL);""")
+        self.queue = []
+        self.submitted = 0
+        self.committed = 0
+        self.dropped = 0
+        self.batches = 0
+        self.failures = 0
+        self.lost = set()
+        self.error = None
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name="session-store", daemon=True)
+        self.thread.start()
+
+    def write(self, session_id, label, turn, summary, first_live, contexts, texts, messages):
+        """
+        Queues the write of a session state and returns right away.
+        contexts is the list of the (key, digest) pairs of its context sections, None if they didn't change, texts
+        the (digest, text) pairs not written yet and messages the new (seq, role, content) messages.
+        the messages before first_live were dropped by the session.
+        """
+        with self.condition:
+            if self.closed:
+                raise ValueError("the session store is closed")
+            self.queue.append((session_id, label, turn, summary, first_live, contexts, texts, messages, time.time()))
+            self.submitted += 1
+            self.condition.notify_all()
+
+    def take_lost(self, session_id):
+        """
+        Returns True once if writes of the session were dropped since the last call.
+        """
+        with self.condition:
+            if session_id not in self.lost:
+                return False
+            self.lost.discard(session_id)
+            return True
+
+    def run(self):
+        if time.time() - self.last_compaction() >= self.compact_interval:
+            try:
+                self.compact()
+            except sqlite3.Error:
+                self.failures += 1
+        attempts = 0
+        while True:
+            with self.condition:
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+                if not self.queue:
+                    return
+                # the writes arriving meanwhile join the batch
+                deadline = time.monotonic() + self.commit_delay
+                while len(self.queue) < self.max_batch and not self.closed and time.monotonic() < deadline:
+                    self.condition.wait(deadline - time.monotonic())
+                batch, self.queue = self.queue[:self.max_batch], self.queue[self.max_batch:]
+            try:
+                self.commit(batch)
+            except sqlite3.Error as e:
+                attempts += 1
+                with self.condition:
+                    self.failures += 1
+                    self.error = e
+                    if attempts < COMMIT_ATTEMPTS:
+                        # the later writes of the sessions only hold what changed since, the batch goes first
+                        self.queue[:0] = batch
+                        self.condition.wait(RETRY_DELAY * attempts)
+                        continue
+                    self.dropped += len(batch)
+                    self.lost.update(write[0] for write in batch)
+                    self.condition.notify_all()
+            else:
+                with self.condition:
+                    self.committed += len(batch)
+                    self.batches += 1
+                    self.condition.notify_all()
+            attempts = 0
+
+    def commit(self, batch):
+        """
+        Writes a batch of session states in a single transaction.
+        """
+        with self.lock:
+            self.db.execute("BEGIN")
+            try:
+                for session_id, label, turn, summary, first_live, contexts, texts, messages, now in batch:
+                    self.db.execute("""INSERT INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?)
+                                       ON CONFLICT(id) DO UPDATE SET label = excluded.label, turn = excluded.turn,
+                                       summary = excluded.summary, first_live = excluded.first_live,
+                                       updated = excluded.updated""",
+                                    (session_id, label, turn, summary, first_live, now, now))
+                    self.db.executemany("INSERT OR IGNORE INTO texts VALUES (?, ?)", texts)
+                    self.db.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?)",
+                                        [(session_id, seq, role, content) for seq, role, content in messages])
+                    if contexts is not None:
+                        self.db.execute("DELETE FROM contexts WHERE session = ?", (session_id,))
+                        self.db.executemany("INSERT INTO contexts VALUES (?, ?, ?, ?)",
+                                            [(session_id, position, key, digest)
+                                             for position, (key, digest) in enumerate(contexts)])
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def flush(self):
+        """
+        Waits until the queued writes are committed or dropped.
+        """
+        with self.condition:
+            target = self.submitted
+            while self.committed + self.dropped < target and self.thread.is_alive():
+                self.condition.wait()
+
+    def close(self):
+        """
+        Commits the queued writes and closes the database.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        with self.lock:
+            self.db.close()
+
+    def load(self, session_id):
+        """
+        Returns the persisted state of a session, or None: its label, turn and summary, the (key, text) pairs of its
+        context sections and its live (seq, role, content) messages.
+        """
+        with self.lock:
+            row = self.db.execute("SELECT label, turn, summary, first_live FROM sessions WHERE id = ?",
+                                  (session_id,)).fetchone()
+            if row is None:
+                return None
+            label, turn, summary, first_live = row
+            context = self.db.execute("""SELECT key, text FROM contexts JOIN texts USING (digest)
+                                         WHERE session = ? ORDER BY position""", (session_id,)).fetchall()
+            messages = self.db.execute("""SELECT seq, role, content FROM messages WHERE session = ? AND seq >= ?
+                                          ORDER BY seq""", (session_id, first_live)).fetchall()
+        return {"label": label, "turn": turn, "summary": summary, "context": context, "messages": messages}
+
+    def latest(self):
+        """
+        Returns the id of the last used session, or None.
+        """
+        with self.lock:
+            row = self.db.execute("SELECT id FROM sessions ORDER BY updated DESC LIMIT 1").fetchone()
+        return row[0] if row else None
+
+    def sessions(self, limit=20):
+        """
+        Returns the last used sessions, most recent first.
+        """
+        with self.lock:
+            rows = self.db.execute("""SELECT id, label, turn, updated FROM sessions
+                                      ORDER BY updated DESC LIMIT ?""", (limit,)).fetchall()
+        return [{"session": session_id, "label": label, "turns": turn, "updated": updated}
+                for session_id, label, turn, updated in rows]
+
+    def last_compaction(self):
+        """
+        Returns the time of the last compaction, 0 if there was none.
+        """
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE name = 'compacted'").fetchone()
+        return row[0] if row else 0.0
+
+    def compact(self, max_age=None, vacuum=False):
+        """
+        Deletes the sessions unused for max_age seconds (by default the store one), the messages the sessions
+        dropped and the context texts no session refers to anymore, and returns the number of deleted rows.
+        vacuum also gives the freed pages back to the file system, it rewrites the whole database.
+        """
+        max_age = self.max_age if max_age is None else max_age
+        now = time.time()
+        with self.lock:
+            self.db.execute("BEGIN")
+            try:
+                old = [row[0] for row in self.db.execute("SELECT id FROM sessions WHERE updated < ?",
+                                                         (now - max_age,))]
+                deleted = {"sessions": len(old)}
+                self.db.executemany("DELETE FROM sessions WHERE id = ?", [(s,) for s in old])
+                self.db.executemany("DELETE FROM contexts WHERE session = ?", [(s,) for s in old])
+                deleted["messages"] = self.db.execute("""
+                    DELETE FROM messages WHERE seq < COALESCE(
+                        (SELECT first_live FROM sessions WHERE id = messages.session), seq + 1)""").rowcount
+                deleted["texts"] = self.db.execute("""
+                    DELETE FROM texts WHERE digest NOT IN (SELECT digest FROM contexts)""").rowcount
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('compacted', ?)", (now,))
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            if vacuum:
+                self.db.execute("VACUUM")
+            self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return deleted
+
+    def stats(self):
+        """
+        Returns the number of stored sessions, queued, committed and dropped writes, commit batches and failures.
+        """
+        with self.lock:
+            sessions = self.db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        with self.condition:
+            return {"sessions": sessions, "queued": len(self.queue), "committed": self.committed,
+                    "dropped": self.dropped, "batches": self.batches, "failures": self.failures,
+                    "error": str(self.error) if self.error is not None else None}
+
+
+class SessionLog:
+    def __init__(self, store, session_id=None):
+        """
+        Initializes the persistence of a chat session in a SessionStore, a new session unless session_id is given.
+        only what changed since the last save is written: the new messages, and the context sections when a
+        section was added.
+        """
+        self.store = store
+        self.session_id = session_id if session_id is not None else new_session_id()
+        # the seq of the messages already written, the records are dropped along with the history ones
+        self.seqs = weakref.WeakKeyDictionary()
+        self.next_seq = 0
+        self.contexts = []
+        self.texts = set()
+
+    def save(self, label, turn, history):
+        """
+        Queues the write of the session state, its label, turn number and answered turns, without waiting.
+        the whole state is written again when the store dropped a previous write of the session.
+        """
+        summary, context, messages = history.snapshot()
+        resend = self.store.take_lost(self.session_id)
+        if resend:
+            self.contexts = None
+            self.texts = set()
+        new = []
+        for message in messages:
+            if message not in self.seqs:
+                self.seqs[message] = self.next_seq
+                self.next_seq += 1
+            elif not resend:
+                continue
+            new.append((self.seqs[message], message.role, message.content))
+        first_live = self.seqs[messages[0]] if messages else self.next_seq
+        contexts = [(key, blob.digest) for key, blob in context]
+        texts = [(blob.digest, blob.text) for _, blob in context if blob.digest not in self.texts]
+        self.texts.update(digest for digest, _ in texts)
+        changed = contexts != self.contexts
+        self.contexts = contexts
+        self.store.write(self.session_id, label, turn, summary, first_live, contexts if changed else None, texts, new)
+
+    def restore(self, history):
+        """
+        Restores the persisted messages, summary and context sections of the session in the history and returns
+        the state of the session (see SessionStore.load), None if the session wasn't found.
+        no API call is made, the summary is the last one persisted.
+        """
+        state = self.store.load(self.session_id)
+        if state is None:
+            return None
+        messages = state["messages"]
+        restored = history.restore(state["summary"], state["context"],
+                                   [(role, content) for _, role, content in messages])
+        for message, (seq, _, _) in zip(restored, messages):
+            self.seqs[message] = seq
+        self.next_seq = messages[-1][0] + 1 if messages else 0
+        _, context, _ = history.snapshot()
+        self.contexts = [(key, blob.digest) for key, blob in context]
+        self.texts = {digest for _, digest in self.contexts}
+        return state
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="list or compact the persisted chat sessions")
+    parser.add_argument("command", choices=("list", "compact"))
+    parser.add_argument("--path", default=DEFAULT_PATH)
+    parser.add_argument("--limit", type=int, default=20, help="number of sessions to list")
+    parser.add_argument("--max-age-days", type=float, default=DEFAULT_MAX_AGE / 86400,
+                        help="delete the sessions unused for this many days")
+    parser.add_argument("--vacuum", action="store_true", help="shrink the database file")
+    args = parser.parse_args()
+    store = SessionStore(args.path, compact_interval=float("inf"))
+    try:
+        if args.command == "list":
+            for session in store.sessions(args.limit):
+                updated = time.strftime("%Y-%m-%d %H:%M", time.localtime(session["updated"]))
+                print(f"{session['session']}  {updated}  {session['turns']:>3} turns  {session['label']}")
+        else:
+            print(json.dumps(store.compact(args.max_age_days * 86400, args.vacuum)))
+    finally:
+        store.close()
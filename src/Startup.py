@@ -0,0 +1,306 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+# time of the first import of this module, the first import of the bot
+STARTED = time.perf_counter()
+# the idle upstream connections are kept KEEPALIVE_EXPIRY seconds (5 by default), the warm up refreshes them
+# every KEEPALIVE_INTERVAL seconds while the user types
+KEEPALIVE_EXPIRY = 60.0
+KEEPALIVE_INTERVAL = 30.0
+# the warm up stops refreshing the connection once the user didn't type anything for MAX_IDLE seconds
+MAX_IDLE = 600.0
+WARM_UP_TIMEOUT = 10.0
+# the connection limits of the openai client
+MAX_CONNECTIONS = 1000
+MAX_KEEPALIVE_CONNECTIONS = 100
+
+_sdk = None
+_sdk_lock = threading.Lock()
+
+
+class StartupProfile:
+    def __init__(self, started=STARTED):
+        """
+        Initializes the startup profile of the process, the phases are timed from started.
+        """
+        self.started = started
+        self.phases = []
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds):
+        """
+        Records a phase of seconds ending now, only the first time: the later clients or connections aren't part
+        of the startup.
+        """
+        with self.lock:
+            if any(phase["phase"] == name for phase in self.phases):
+                return
+            self.phases.append({"phase": name, "at": time.perf_counter() - self.started, "seconds": seconds,
+                                "thread": threading.current_thread().name})
+
+    def mark(self, name):
+        """
+        Records a milestone, a phase lasting since the start.
+        """
+        self.add(name, time.perf_counter() - self.started)
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        """
+        Records the time spent in the block as a phase, unless it raised.
+        """
+        start = time.perf_counter()
+        yield
+        self.add(name, time.perf_counter() - start)
+
+    def report(self):
+        """
+        Returns the phases as a human readable report.
+        """
+        with self.lock:
+            phases = sorted(self.phases, key=lambda phase: phase["at"])
+        lines = ["startup            at (s)   took (s)  thread"]
+        for phase in phases:
+            lines.append(f"{phase['phase']:<17}{phase['at']:>8.3f}  {phase['seconds']:>9.3f}  {phase['thread']}")
+        return "\n".join(lines)
+
+    def write(self, path):
+        """
+        Appends the phases to a JSON Lines file, one line per run, to track the startup time across versions.
+        """
+        with self.lock:
+            record = {"time": time.time(), "phases": list(self.phases)}
+        with open(path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+PROFILE = StartupProfile()
+
+
+def sdk():
+    """
+    Returns the openai module, imported on the first use only: it takes longer to import than the rest of the bot.
+    """
+    global _sdk
+    if _sdk is None:
+        with _sdk_lock:
+            if _sdk is None:
+                with PROFILE.timed("import openai"):
+                    import openai
+                _sdk = openai
+    return _sdk
+
+
+def sdk_errors(*names):
+    """
+    Returns the openai exception classes of the given names, to be used in the except clauses, which are evaluated
+    only once an exception was raised, so after the SDK was imported.
+    """
+    openai = sdk()
+    return tuple(getattr(openai, name) for name in names)
+
+
+def keepalive_limits():
+    """
+    Returns the connection limits of the clients created by the bot, the idle connections are kept
+    KEEPALIVE_EXPIRY seconds.
+    """
+    import httpx
+    return httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=KEEPALIVE_EXPIRY)
+
+
+class WarmUp:
+    def __init__(self, client, interval=KEEPALIVE_INTERVAL, max_idle=MAX_IDLE):
+        """
+        Initializes the warm up of an OpenAIClient while the user types.
+        once resumed a background thread imports the SDK, creates the OpenAI client and opens its upstream
+        connection, then refreshes it every interval seconds until paused, so the next question doesn't pay the
+        import, the TCP and TLS handshakes. it stops refreshing after max_idle seconds without a question.
+        """
+        self.client = client
+        self.interval = interval
+        self.max_idle = max_idle
+        self.waiting = False
+        self.closed = False
+        self.since = None
+        self.last = None
+        self.pings = 0
+        self.failures = 0
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def resume(self):
+        """
+        Starts refreshing the connection, called before waiting for the user.
+        """
+        with self.condition:
+            self.waiting = True
+            self.since = time.monotonic()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="warm-up", daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def pause(self):
+        """
+        Stops refreshing the connection, called once the user sent a question: the question itself uses it.
+        """
+        with self.condition:
+            self.waiting = False
+            if self.last is not None:
+                self.last = time.monotonic()
+
+    def close(self):
+        """
+        Stops the warm up thread.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def delay(self):
+        """
+        Returns the seconds until the next refresh, None while paused or idle.
+        must be called with the lock held.
+        """
+        now = time.monotonic()
+        if not self.waiting or now - self.since > self.max_idle:
+            return None
+        return 0 if self.last is None else max(self.last + self.interval - now, 0)
+
+    def run(self):
+        with self.condition:
+            while not self.closed:
+                delay = self.delay()
+                if delay != 0:
+                    self.condition.wait(delay)
+                    continue
+                self.condition.release()
+                try:
+                    self.ping()
+                finally:
+                    self.condition.acquire()
+
+    def ping(self):
+        """
+        Opens or refreshes the connection, the errors are left to the next question.
+        """
+        try:
+            self.client.warm_up()
+        except Exception:
+            self.failures += 1
+        else:
+            self.pings += 1
+        self.last = time.monotonic()
+
+
+class AsyncWarmUp(WarmUp):
+    def __init__(self, client, interval=KEEPALIVE_INTERVAL, max_idle=MAX_IDLE):
+        """
+        Initializes the warm up of an AsyncOpenAIClient, run as a task of the chat event loop since its connections
+        belong to the loop. the SDK is imported on a thread so the loop stays responsive.
+        """
+        super().__init__(client, interval, max_idle)
+        self.task = None
+        self.wake = None
+
+    def resume(self):
+        self.waiting = True
+        self.since = time.monotonic()
+        if self.task is None:
+            import asyncio
+            self.wake = asyncio.Event()
+            self.task = asyncio.get_running_loop().create_task(self.run())
+        self.wake.set()
+
+    def pause(self):
+        self.waiting = False
+        if self.last is not None:
+            self.last = time.monotonic()
+
+    def close(self):
+        self.closed = True
+        if self.task is not None:
+            self.task.cancel()
+
+    async def run(self):
+        import asyncio
+        await asyncio.to_thread(sdk)
+        while not self.closed:
+            delay = self.delay()
+            if delay != 0:
+                self.wake.clear()
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self.wake.wait(), delay)
+                continue
+            await self.ping()
+
+    async def ping(self):
+        import asyncio
+        try:
+            await self.client.warm_up()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.failures += 1
+        else:
+            self.pings += 1
+        self.last = time.monotonic()
+
+
+def import_times(module, runs):
+    """
+    Returns the cumulative import times in seconds of module and of the modules it imports, the median of runs
+    fresh interpreters started with -X importtime. the modules imported by the interpreter startup are left out.
+    """
+    import statistics
+    import subprocess
+    import sys
+    samples = {}
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        # the imports of a module are listed before it, indented
+        block = []
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:"):
+                continue
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if not cumulative.strip().isdigit():
+                continue
+            block.append((name.strip(), int(cumulative) / 1e6))
+            if name.strip() == name[1:]:
+                if name.strip() == module:
+                    for imported, seconds in block:
+                        samples.setdefault(imported, []).append(seconds)
+                block = []
+    return {name: statistics.median(times) for name, times in samples.items()}
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="import time report of the bot, to track the startup time")
+    parser.add_argument("--module", default="Bot", help="the module to import")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="number of the slowest imports to show")
+    parser.add_argument("--max-ms", type=float, help="exit with an error if the import takes longer")
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    args = parser.parse_args()
+    times = import_times(args.module, args.runs)
+    total = times.get(args.module, 0)
+    slowest = sorted(((name, seconds) for name, seconds in times.items() if name != args.module),
+                     key=lambda item: item[1], reverse=True)[:args.top]
+    if args.json:
+        print(json.dumps({"module": args.module, "runs": args.runs, "import": total, "slowest": dict(slowest)}))
+    else:
+        print(f"import {args.module}: {total * 1000:.1f} ms (median of {args.runs} runs)")
+        for name, seconds in slowest:
+            print(f"  {name:<40}{seconds * 1000:>8.1f} ms")
+    if args.max_ms is not None and total * 1000 > args.max_ms:
+        sys.exit(f"import {args.module} takes {total * 1000:.1f} ms, more than {args.max_ms} ms")
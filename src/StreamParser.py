@@ -0,0 +1,107 @@
+import re
+
+ANSWER_KEY_RE = re.compile(r"""['"]answer['"]\s*:\s*('''|\"\"\"|'|")""")
+ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "\\": "\\", "'": "'", '"': '"', "0": "\0", "/": "/", "b": "\b",
+           "f": "\f"}
+
+
+def surrogate(escape):
+    """
+    Returns the value of a \\uXXXX escape of a low surrogate, None for any other text.
+    """
+    if len(escape) != 6 or not escape.startswith("\\u"):
+        return None
+    try:
+        value = int(escape[2:], 16)
+    except ValueError:
+        return None
+    return value if 0xDC00 <= value < 0xE000 else None
+
+
+class AnswerStreamParser:
+    def __init__(self):
+        """
+        Initializes the parser for the response described in SystemMsg, a JSON object or a python dictionary.
+        the value of the answer field is decoded as the text is streamed in.
+        """
+        self.text = ""
+        self.pos = 0
+        self.quote = None
+        self.done = False
+
+    def feed(self, delta):
+        """
+        Adds a chunk of the streamed response and returns the newly available part of the answer.
+        """
+        self.text += delta
+        if self.done:
+            return ""
+        if self.quote is None:
+            match = ANSWER_KEY_RE.search(self.text, self.pos)
+            if not match:
+                return ""
+            ahead = self.text[match.end():match.end() + 2]
+            if len(match.group(1)) == 1 and len(ahead) < 2 and ahead == match.group(1) * len(ahead):
+                # could still be the start of a triple quoted string
+                return ""
+            self.quote = match.group(1)
+            self.pos = match.end()
+        return self._decode()
+
+    def _decode(self):
+        """
+        Decodes the answer string from the current position, stopping before incomplete escapes or quotes.
+        """
+        out = []
+        text = self.text
+        quote = self.quote
+        while self.pos < len(text):
+            char = text[self.pos]
+            if char == "\\":
+                if self.pos + 1 >= len(text):
+                    break
+                code = text[self.pos + 1]
+                if code in ("u", "x"):
+                    width = 4 if code == "u" else 2
+                    digits = text[self.pos + 2:self.pos + 2 + width]
+                    if len(digits) < width:
+                        break
+                    try:
+                        value = int(digits, 16)
+                    except ValueError:
+                        out.append(text[self.pos:self.pos + 2 + width])
+                        self.pos += 2 + width
+                        continue
+                    if code == "u" and 0xD800 <= value < 0xDC00:
+                        # a high surrogate is combined with the low surrogate escape following it
+                        low = text[self.pos + 6:self.pos + 12]
+                        if len(low) < 6 and "\\u".startswith(low[:2]):
+                            # the low surrogate may be in the next chunk
+                            break
+                        low_value = surrogate(low)
+                        if low_value is not None:
+                            out.append(chr(0x10000 + (value - 0xD800 << 10) + low_value - 0xDC00))
+                            self.pos += 12
+                            continue
+                    out.append(chr(value))
+                    self.pos += 2 + width
+                    continue
+                if code == "\n":
+                    self.pos += 2
+                    continue
+                out.append(ESCAPES.get(code, "\\" + code))
+                self.pos += 2
+                continue
+            if char == quote[0]:
+                if len(quote) == 1:
+                    self.done = True
+                    break
+                closing = text[self.pos:self.pos + 3]
+                if closing == quote:
+                    self.done = True
+                    break
+                if len(closing) < 3 and quote.startswith(closing):
+                    break
+            out.append(char)
+            self.pos += 1
+        return "".join(out)
@@ -0,0 +1,112 @@
+import json
+import re
+
+# the response of a failed call, returned by the clients instead of raising
+ERROR_PREFIX = "An unexpected error occurred: "
+# the codes of the response structure described in SystemMsg, FAILED is set locally when there is no answer
+FAILED = 0
+ANSWERED = 1
+NEED_INFO = 2
+CODES = (ANSWERED, NEED_INFO)
+ANSWER_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "answer": {"type": "string", "description": "the answer to the question"},
+        "code": {"type": "integer", "enum": list(CODES),
+                 "description": "1 if the question was answered, 2 if more information is needed"},
+    },
+    "required": ["answer", "code"],
+    "additionalProperties": False,
+}
+# the text parameter of the answer requests
+ANSWER_FORMAT = {"format": {"type": "json_schema", "name": "dpdk_answer", "schema": ANSWER_SCHEMA, "strict": True}}
+FENCE_RE = re.compile(r"^\s*```(?:json)?\s*(.*?)\s*```\s*$", re.DOTALL)
+decode_json = json.JSONDecoder().decode
+
+
+def is_error(response):
+    """
+    Returns True if the response is the error message of a failed call.
+    """
+    return response.startswith(ERROR_PREFIX)
+
+
+class AnswerError(ValueError):
+    """
+    Raised when a response doesn't hold a valid answer.
+    """
+
+
+class CallFailedError(AnswerError):
+    """
+    The call failed, the response is its error message.
+    """
+
+
+class AnswerDecodeError(AnswerError):
+    """
+    The response isn't a JSON object.
+    """
+
+
+class AnswerSchemaError(AnswerError):
+    """
+    The response is a JSON object which doesn't match ANSWER_SCHEMA.
+    """
+
+
+class Answer:
+    __slots__ = ("answer", "code", "error")
+
+    def __init__(self, answer, code, error=None):
+        """
+        Initializes the result of a turn, error is the AnswerError of a response without a valid answer,
+        its answer is then the text shown to the user and its code FAILED.
+        """
+        self.answer = answer
+        self.code = code
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def to_dict(self):
+        """
+        Returns the answer and code as a dictionary, with the error type and message of a failed answer.
+        """
+        result = {"answer": self.answer, "code": self.code}
+        if self.error is not None:
+            result["error"] = type(self.error).__name__
+            result["message"] = str(self.error)
+        return result
+
+    def __repr__(self):
+        return f"Answer(answer={self.answer!r}, code={self.code!r}, error={self.error!r})"
+
+
+def parse_answer(response):
+    """
+    Returns the Answer of a response following ANSWER_SCHEMA.
+    a response wrapped in a markdown code fence is accepted, raises an AnswerError otherwise.
+    """
+    if is_error(response):
+        raise CallFailedError(response[len(ERROR_PREFIX):])
+    fenced = FENCE_RE.match(response)
+    try:
+        result = decode_json(fenced.group(1) if fenced else response)
+    except ValueError as e:
+        raise AnswerDecodeError(f"the response isn't JSON: {e}") from None
+    if not isinstance(result, dict):
+        raise AnswerSchemaError(f"the response is a JSON {type(result).__name__}, not an object")
+    answer = result.get("answer")
+    code = result.get("code")
+    if not isinstance(answer, str):
+        raise AnswerSchemaError("the answer field is missing or not a string")
+    # bool is an int subclass, true isn't a code
+    if type(code) is not int or code not in CODES:
+        raise AnswerSchemaError(f"the code field is {code!r}, not one of {CODES}")
+    extra = set(result) - {"answer", "code"}
+    if extra:
+        raise AnswerSchemaError(f"unexpected fields {sorted(extra)}")
+    return Answer(answer, code)
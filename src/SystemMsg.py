@@ -28,7 +28,7 @@ if you don't know the answer, you should ask for more information which will hel
 - if the request is from a developer, the request will only contain string with the developer message.
 
 # response structure:
-- the response is a dictionary with the following
+- the response is a JSON object with the following fields
 - answer: the answer to the question.
 - code 1 if you managed to answer the question
 - code 2 if you requested more information to answer the question
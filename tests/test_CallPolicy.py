@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+import pytest
+from CallPolicy import CallPolicy, DeadlineExceeded
+
+KEY = ("gpt-4.1", "answer", False)
+
+
+def primed(**kwargs):
+    """
+    Returns a policy with enough fast samples to hedge the calls slower than 10 ms.
+    """
+    policy = CallPolicy(**kwargs)
+    for _ in range(policy.hedge_min_samples):
+        policy.observe(KEY, 0.01)
+    return policy
+
+
+def slow_then_fast():
+    """
+    Returns a call whose first run takes 0.3 s and the next ones answer right away.
+    """
+    runs = []
+    lock = threading.Lock()
+
+    def call():
+        with lock:
+            runs.append(threading.current_thread().name)
+            first = len(runs) == 1
+        if first:
+            time.sleep(0.3)
+            return "primary"
+        return "hedge"
+    return call, runs
+
+
+def test_call_without_samples_runs_on_the_callers_thread():
+    policy = CallPolicy()
+    thread = policy.run(KEY, lambda: threading.current_thread(), time.monotonic() + 1)
+    assert thread is threading.current_thread()
+    assert policy.stats()["hedges"] == 0
+
+
+def test_call_past_its_deadline_is_not_sent():
+    calls = []
+    with pytest.raises(DeadlineExceeded):
+        CallPolicy().run(KEY, lambda: calls.append(1), time.monotonic() - 1)
+    assert calls == []
+
+
+def test_call_failing_past_its_deadline_raises_deadline_exceeded():
+    def call():
+        time.sleep(0.05)
+        raise ConnectionError("reset")
+
+    with pytest.raises(DeadlineExceeded):
+        CallPolicy().run(KEY, call, time.monotonic() + 0.01)
+    with pytest.raises(ConnectionError):
+        CallPolicy().run(KEY, call, time.monotonic() + 1)
+
+
+def test_slow_call_is_hedged_and_the_loser_closed():
+    policy = primed(max_hedge_ratio=1.0)
+    call, runs = slow_then_fast()
+    closed = []
+    start = time.monotonic()
+    assert policy.run(KEY, call, start + 5, close=closed.append) == "hedge"
+    assert time.monotonic() - start < 0.2
+    assert runs == ["call", "hedge"]
+    assert policy.stats()["hedges"] == 1 and policy.stats()["hedge_wins"] == 1
+    deadline = time.monotonic() + 2
+    while not closed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert closed == ["primary"]
+
+
+def test_hedge_is_not_sent_when_can_hedge_refuses():
+    policy = primed(max_hedge_ratio=1.0)
+    call, runs = slow_then_fast()
+    assert policy.run(KEY, call, time.monotonic() + 5, can_hedge=lambda: False) == "primary"
+    assert len(runs) == 1
+    assert policy.stats()["hedges"] == 0
+
+
+def test_hedges_stay_within_the_ratio():
+    policy = primed()
+    call, runs = slow_then_fast()
+    assert policy.run(KEY, call, time.monotonic() + 5) == "primary"
+    assert runs == ["MainThread"]
+    assert policy.stats()["hedges"] == 0
+
+
+def test_hedged_call_past_its_deadline():
+    policy = primed(max_hedge_ratio=1.0)
+
+    def call():
+        time.sleep(0.5)
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        policy.run(KEY, call, start + 0.1)
+    assert time.monotonic() - start < 0.4
+
+
+def test_async_slow_call_is_hedged():
+    policy = primed(max_hedge_ratio=1.0)
+    runs = []
+
+    async def call():
+        runs.append(1)
+        if len(runs) == 1:
+            await asyncio.sleep(1.0)
+            return "primary"
+        return "hedge"
+
+    async def main():
+        return await policy.run_async(KEY, call, time.monotonic() + 5)
+    assert asyncio.run(main()) == "hedge"
+    assert policy.stats()["hedge_wins"] == 1
+    assert policy.hedging == 0
+
+
+def test_async_call_past_its_deadline():
+    async def call():
+        await asyncio.sleep(1.0)
+
+    async def main():
+        return await CallPolicy().run_async(KEY, call, time.monotonic() + 0.05)
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(main())
@@ -0,0 +1,71 @@
+import asyncio
+import threading
+import time
+from ConversationHistory import ConversationHistory
+
+
+def add_turns(history, first, last):
+    for i in range(first, last):
+        history.add_message("user", f"q{i}")
+        history.add_message("assistant", f"a{i}")
+
+
+def wait_folded(history):
+    deadline = time.monotonic() + 2
+    while history.folding and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not history.folding
+
+
+def questions(history):
+    return [turn[0].content for turn in history.turns]
+
+
+def test_failed_summary_keeps_the_folded_turns():
+    calls = []
+    done = threading.Event()
+
+    def summarizer(summary, turns):
+        calls.append(len(turns))
+        done.set()
+        raise RuntimeError("the summary model is down")
+    history = ConversationHistory(keep_turns=2, summarizer=summarizer)
+    add_turns(history, 0, 3)
+    assert done.wait(2)
+    wait_folded(history)
+    assert calls == [1]
+    assert history.summary == ""
+    assert questions(history) == ["q0", "q1", "q2"]
+
+
+def test_turns_are_folded_again_after_the_next_answer():
+    calls = []
+
+    def summarizer(summary, turns):
+        calls.append([turn[0]["content"] for turn in turns])
+        if len(calls) == 1:
+            raise RuntimeError("the summary model is down")
+        return "summary of " + " ".join(calls[-1])
+    history = ConversationHistory(keep_turns=2, summarizer=summarizer)
+    add_turns(history, 0, 3)
+    wait_folded(history)
+    add_turns(history, 3, 4)
+    wait_folded(history)
+    assert calls == [["q0"], ["q0", "q1"]]
+    assert history.summary == "summary of q0 q1"
+    assert questions(history) == ["q2", "q3"]
+
+
+def test_failed_async_summary_keeps_the_folded_turns():
+    async def summarizer(summary, turns):
+        raise RuntimeError("the summary model is down")
+
+    async def main():
+        history = ConversationHistory(keep_turns=2, summarizer=summarizer)
+        add_turns(history, 0, 3)
+        await asyncio.gather(*history.tasks)
+        return history
+    history = asyncio.run(main())
+    assert not history.folding
+    assert history.summary == ""
+    assert questions(history) == ["q0", "q1", "q2"]
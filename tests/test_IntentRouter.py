@@ -0,0 +1,29 @@
+import pytest
+from IntentRouter import LABELS, IntentRouter, normalize_label
+from StructuredAnswer import ERROR_PREFIX
+
+QUESTION = "how do I set up the template table"
+
+
+@pytest.fixture(scope="module")
+def router():
+    return IntentRouter()
+
+
+def test_unsure_question_is_sent_to_the_fallback(router):
+    label, _ = router.classify(QUESTION)
+    other = next(name for name in LABELS if name != label)
+    unsure = IntentRouter(threshold=1.1)
+    assert unsure.route(QUESTION, lambda text: other) == (other, False)
+
+
+@pytest.mark.parametrize("error", ["502 Bad Gateway", "Error code: 500 - testpmd crashed", "Connection error."])
+def test_failed_fallback_keeps_the_local_label(router, error):
+    label, _ = router.classify(QUESTION)
+    unsure = IntentRouter(threshold=1.1)
+    assert unsure.route(QUESTION, lambda text: ERROR_PREFIX + error) == (label, True)
+
+
+def test_error_text_would_have_been_read_as_a_label():
+    # what the fallback check protects against
+    assert normalize_label(ERROR_PREFIX + "502 Bad Gateway") == "gateway"
@@ -0,0 +1,50 @@
+import pytest
+from QuestionCache import QuestionCache
+
+QUESTION = "how do I resize a template table"
+ANSWER = '{"answer": "use rte_flow_template_table_resize", "code": 1}'
+
+
+@pytest.fixture
+def cache():
+    cache = QuestionCache()
+    cache.put(QUESTION, "v1", ANSWER)
+    return cache
+
+
+@pytest.mark.parametrize("question", [
+    "how do I resize a template table",
+    "How do I resize a template table?",
+    "how do i resize template tables",
+    "please explain how to resize a template table",
+])
+def test_rephrased_question_hits(cache, question):
+    assert cache.get(question, "v1") == ANSWER
+
+
+@pytest.mark.parametrize("question", [
+    "how do I resize an async template table",
+    "how do I not resize a template table",
+    "why does resizing a template table fail",
+    "how do I resize a template table and a pattern template",
+    "how do I create a template table",
+])
+def test_different_question_misses(cache, question):
+    assert cache.get(question, "v1") is None
+
+
+def test_other_pack_version_misses(cache):
+    assert cache.get(QUESTION, "v2") is None
+
+
+def test_sync_and_async_are_different_questions():
+    cache = QuestionCache()
+    cache.put("how do I configure sync flow rules", "v1", ANSWER)
+    assert cache.get("how do I configure async flow rules", "v1") is None
+
+
+@pytest.mark.parametrize("threshold, hit", [(1.0, False), (0.5, True)])
+def test_threshold(threshold, hit):
+    cache = QuestionCache(threshold=threshold)
+    cache.put("steps to resize a template table in testpmd", "v1", ANSWER)
+    assert (cache.get("steps to resize a template table", "v1") == ANSWER) is hit
@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+import pytest
+from OpenAIClient import OpenAIClient
+from ResponseCache import ResponseCache
+
+VALID = '{"answer": "use rte_flow_template_table_resize", "code": 1}'
+MESSAGES = [{"role": "user", "content": "how do I resize a template table"}]
+
+
+class FakeResponses:
+    def __init__(self, text):
+        self.text = text
+        self.calls = 0
+
+    def create(self, **params):
+        self.calls += 1
+        return SimpleNamespace(id=f"resp_{self.calls}", output_text=self.text, output=[], usage=None)
+
+
+class FakeOpenAI:
+    def __init__(self, responses):
+        self.responses = responses
+
+    def with_options(self, **options):
+        return self
+
+
+def make_client(text):
+    responses = FakeResponses(text)
+    client = OpenAIClient(cache=ResponseCache(":memory:"), client=FakeOpenAI(responses))
+    return client, responses
+
+
+def test_valid_answer_is_cached():
+    client, responses = make_client(VALID)
+    assert client.query(messages=MESSAGES) == VALID
+    assert client.query(messages=MESSAGES) == VALID
+    assert responses.calls == 1
+    assert client.cache.stats()["hits"] == 1
+
+
+@pytest.mark.parametrize("text", [
+    "not json at all",
+    '{"answer": "missing the code"}',
+    '{"answer": "unknown code", "code": 7}',
+])
+def test_answer_off_the_schema_is_not_cached(text):
+    client, responses = make_client(text)
+    assert client.query(messages=MESSAGES) == text
+    assert client.query(messages=MESSAGES) == text
+    assert responses.calls == 2
+    assert client.cache.stats()["entries"] == 0
+
+
+def test_other_kinds_are_cached_as_is():
+    client, responses = make_client("testpmd")
+    assert client.query(messages=MESSAGES, kind="classify") == "testpmd"
+    assert client.query(messages=MESSAGES, kind="classify") == "testpmd"
+    assert responses.calls == 1
+
+
+def test_failed_call_is_not_cached():
+    client, responses = make_client(VALID)
+
+    def create(**params):
+        responses.calls += 1
+        raise ValueError("bad request")
+    responses.create = create
+    assert client.query(messages=MESSAGES).startswith("An unexpected error occurred: ")
+    assert client.cache.stats()["entries"] == 0
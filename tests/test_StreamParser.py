@@ -0,0 +1,52 @@
+import json
+import pytest
+from StreamParser import AnswerStreamParser
+
+
+def feed(text, size):
+    parser = AnswerStreamParser()
+    out = "".join(parser.feed(text[i:i + size]) for i in range(0, len(text), size))
+    return out, parser
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 1000])
+def test_json_escapes_across_chunks(size):
+    answer = 'a "quoted" line\nand a\ttab, a back\\slash, café and \U0001F600'
+    text = json.dumps({"answer": answer, "code": 1})
+    out, parser = feed(text, size)
+    assert out == answer
+    assert parser.done
+
+
+@pytest.mark.parametrize("size", [1, 4, 1000])
+def test_surrogate_pair_is_combined(size):
+    text = json.dumps({"answer": "smile \U0001F600 done"}, ensure_ascii=True)
+    assert "\\ud83d\\ude00" in text
+    out, _ = feed(text, size)
+    assert out == "smile \U0001F600 done"
+
+
+def test_lone_surrogate_is_kept():
+    text = '{"answer": "a \\ud83d b"}'
+    assert feed(text, 1)[0] == json.loads(text)["answer"]
+
+
+def test_split_escape_waits_for_the_next_chunk():
+    parser = AnswerStreamParser()
+    assert parser.feed('{"answer": "line\\') == "line"
+    assert parser.feed('nnext"}') == "\nnext"
+    assert parser.done
+
+
+@pytest.mark.parametrize("size", [1, 2, 1000])
+def test_python_dictionary_with_triple_quotes(size):
+    text = "{'answer': '''it's \"fine\"\n''', 'code': 1}"
+    out, parser = feed(text, size)
+    assert out == "it's \"fine\"\n"
+    assert parser.done
+
+
+def test_no_answer_field():
+    out, parser = feed("plain text without structure", 4)
+    assert out == ""
+    assert parser.quote is None